@@ -21,11 +21,20 @@
 # Will be uploaded as a 3D model to [Sketchfab](https://sketchfab.com).
 
 # %%
+import os
+import re
+
 import cmcrameri.cm as cmc
+import numpy as np
 import pandas as pd
 import pygmt
 import pyvista as pv
 
+import export3d
+import gridding
+import lakecatalog
+import pointcloud
+
 
 # %% [markdown]
 # ## Load ICESat-2 point cloud over Siple Coast
@@ -34,49 +43,149 @@ import pyvista as pv
 # Load Siple Coast pre-processed ATL11 point cloud data
 # This 4.6GB file was processed using the atlxi_dhdt.ipynb script from
 # https://github.com/weiji14/deepicedrain/pull/329/commits/9073678a2adb42fcc863afec22957c879988fa3d
-df_dhdt: pd.DataFrame = pd.read_parquet(path="df_dhdt_siple_coast.parquet")
+# and is converted once into a Morton-ordered memory-mapped cache,
+# streaming in only the x, y, h_corr_11 and dhdt_slope columns, plus the
+# running regression of height over time from the h_corr of each cycle
+cachedir: str = "df_dhdt_siple_coast_cache"
+if not os.path.exists(path=f"{cachedir}/metadata.json"):
+    pointcloud.build_dhdt_cache(
+        path="df_dhdt_siple_coast.parquet",
+        cachedir=cachedir,
+        cycles=[(f"h_corr_{cycle}", f"utc_time_{cycle}") for cycle in range(3, 12)],
+    )
+
+# %%
+# Add any newer ICESat-2 cycles to the cache incrementally, updating the
+# dhdt_slope of only the points they have heights for, and keeping track of
+# which blocks of the cache changed so that only those are exported again
+new_cycles: dict = {}  # e.g. {"12": "df_atl11_cycle12_siple_coast.parquet"}
+changed_blocks: np.ndarray = np.unique(
+    np.concatenate(
+        [
+            pointcloud.append_dhdt_cycle(cachedir=cachedir, path=path, cycle=cycle)
+            for cycle, path in new_cycles.items()
+        ]
+        + [np.empty(shape=0, dtype=np.int64)]
+    )
+)
+if len(changed_blocks) and os.path.exists(path="ds_grid_dhdt_siple_coast.nc"):
+    gridding.update_grid(
+        grid="ds_grid_dhdt_siple_coast.nc", cachedir=cachedir, block_ids=changed_blocks
+    )
 
 # %%
 # Filter point cloud to those with rate of elevation change (dhdt)
-# that is -0.12 m/yr < dhdt_slope > 0.12 m/yr
-_df_dhdt = df_dhdt[abs(df_dhdt.dhdt_slope) > 0.12]  # 0.105
-points: pd.DataFrame = (
-    _df_dhdt[["x", "y", "h_corr_11", "dhdt_slope"]]
-    .rename(columns=dict(h_corr_11="z"))
-    .dropna()
+# that is -0.12 m/yr < dhdt_slope > 0.12 m/yr,
+# and add some vertical exaggeration (x100) to z-axis
+xyz, dhdt_slope = pointcloud.query_dhdt_cache(
+    cachedir=cachedir, region=None, dhdt_threshold=0.12, z_scale=100  # 0.105
+)
+xyz
+
+# %%
+# Quick headless check of the dhdt threshold and colour limits, binning the
+# points into a top-down PNG image with the same extent and colour scaling as
+# the 3D exports, instead of opening a PyVista render window
+export3d.write_preview(
+    filename="siple_coast_point_cloud_preview.png",
+    cachedir=cachedir,
+    cmap=cmc.vik_r,
+    clim=(-2.5, 2.5),
+    statistic="maxabs",
+    dhdt_threshold=0.12,
 )
 
-# Add some vertical exaggeration (x100) to z-axis
-points["z"] *= 100
-points
+# %%
+# Export the full resolution point cloud as a streamable 3D Tiles tileset,
+# for clouds that are too big for a single glTF (e.g. the whole of Antarctica),
+# only rewriting the tiles over changed blocks when new cycles were added
+export3d.write_3dtiles(
+    outdir="siple_coast_point_cloud_3dtiles",
+    xyz=xyz,
+    dhdt_slope=dhdt_slope,
+    cmap=cmc.vik_r,
+    clim=(-2.5, 2.5),
+    region=pointcloud.cache_metadata(cachedir=cachedir)["region"],
+    changed=(
+        pointcloud.block_code_ranges(cachedir=cachedir, block_ids=changed_blocks)
+        if new_cycles
+        else None
+    ),
+)
+
+# %%
+# Thin out the point cloud with an octree so that the exported model fits
+# within Sketchfab's 50MB upload limit, keeping the point with the most
+# extreme dhdt_slope in each cell so that the lake signals are preserved
+keep = pointcloud.octree_decimate(
+    xyz=xyz, dhdt_slope=dhdt_slope, target_bytes=50 * 1024**2, bytes_per_point=12
+)
+xyz, dhdt_slope = xyz[keep], dhdt_slope[keep]
 
 # %% [markdown]
 # ## Wrap ICESat-2 data in PyVista format
 
 # %%
 # Create XYZ point cloud in pyvista format
-cloud = pv.PolyData(var_inp=points[["x", "y", "z"]].to_numpy())
+cloud = pv.PolyData(var_inp=xyz)
 
 # %%
 # Add dhdt_slope as an attribute to the XYZ point cloud
-cloud.point_data["dhdt_slope"] = points.dhdt_slope
+cloud.point_data["dhdt_slope"] = dhdt_slope
 cloud
 
 # %% [markdown]
 # ## Render the point cloud!
 
+# %%
+# Export the XYZ point cloud colored by dhdt_slope straight to a binary glTF,
+# with positions quantized to 16-bit and zipped for uploading to Sketchfab
+export3d.write_glb(
+    filename="siple_coast_point_cloud.glb",
+    xyz=xyz,
+    dhdt_slope=dhdt_slope,
+    cmap=cmc.vik_r,
+    clim=(-2.5, 2.5),
+    zipped=True,
+)
+
 # %%
 # Make a 3D PyVista plot of the XYZ point cloud, colored by dhdt_slope
 p = pv.Plotter()
 p.add_points(points=cloud, clim=[-2.5, 2.5], cmap=cmc.vik_r)
-p.export_gltf(filename="siple_coast_point_cloud.gltf")
 p.show(cpos="xy")
 
 
-# %%
-# https://superuser.com/questions/281573/what-are-the-best-options-to-use-when-compressing-files-using-7-zip/742034#742034
-# !7z a -t7z -m0=lzma2 -mx=9 -mfb=64 -md=32m -ms=on siple_coast_point_cloud.gltf.7z siple_coast_point_cloud.gltf
-
 # %%
 # Quick plot
 # cloud.plot(cpos="xy", render_points_as_spheres=True, clim=[-2.5, 2.5], cmap=cmc.vik_r)
+
+
+# %% [markdown]
+# ## Export point clouds of each subglacial lake
+
+# %%
+# Extract the ICESat-2 points inside each named lake outline, in one pass over
+# the parquet table, keeping all columns (e.g. the h_corr_* height of every
+# cycle) so that each lake gets a time-series table as well as a 3D model
+lake_points: dict = pointcloud.extract_lake_points(
+    gdf_lakes=lakecatalog.read_lakes(store="antarctic_subglacial_lakes_3031.fgb"),
+    path="df_dhdt_siple_coast.parquet",
+)
+
+# %%
+os.makedirs(name="lake_point_clouds", exist_ok=True)
+for lake_name, df_lake in lake_points.items():
+    name: str = re.sub(pattern=r"\W+", repl="_", string=lake_name).strip("_")
+    df_lake.to_parquet(path=f"lake_point_clouds/{name}.parquet", engine="fastparquet")
+
+    df_xyz: pd.DataFrame = df_lake.dropna(subset=["x", "y", "h_corr_11", "dhdt_slope"])
+    if not df_xyz.empty:
+        export3d.write_glb(
+            filename=f"lake_point_clouds/{name}.glb",
+            xyz=df_xyz[["x", "y", "h_corr_11"]].to_numpy(dtype=np.float32)
+            * np.float32([1, 1, 100]),  # x100 vertical exaggeration
+            dhdt_slope=df_xyz.dhdt_slope.to_numpy(dtype=np.float32),
+            cmap=cmc.vik_r,
+            clim=(-2.5, 2.5),
+        )
@@ -0,0 +1,202 @@
+"""
+Render an animation of a map where only some layers change over time, e.g.
+subglacial lakes filling and draining over each ICESat-2 cycle like in the
+AGU2021 poster GIF.
+
+The static base of the map (e.g. MOA, ice velocity and grounding line layers)
+is declared as a FigureSpec and rendered once, to a cached georeferenced
+raster snapshot at the target dpi. Each frame then only draws that raster, its
+own time-varying overlay layers (e.g. the lake outlines colored by that
+cycle's dhdt) and any cheap static layers that go on top (e.g. the graticule
+and labels). Frames are rendered in parallel by worker processes, each with
+its own GMT session, cached by a hash of their layers, and assembled into a
+GIF (with Pillow) or MP4 (with ffmpeg).
+
+Usage:
+
+    spec = figurespec.FigureSpec(name="siple", region=sipreg, projection=sipproj)
+    spec.layer("grdimage", grid=sipbase, nan_transparent="255/0/255")
+    spec.layer("plot", data=gdf_groundingline, pen="0.15p,white")
+    frames: list = [
+        [("plot", dict(data=gdf_cycle, pen="thinnest,yellow,-", cmap="cmap_dhdt.cpt",
+                       color="+z", close=True, aspatial="Z=inner_dhdt"))]
+        for gdf_cycle in gdf_cycles
+    ]
+    top: list = [("basemap", dict(frame=["WSne", "af"]))]
+    animation.render_animation(
+        spec=spec, frames=frames, top=top, outfile="siple_lakes.gif", dpi=150
+    )
+"""
+
+import concurrent.futures
+import io
+import os
+import subprocess
+import time
+
+from PIL import Image
+
+import gmtsession
+import mapdata
+
+# Note that pygmt (and the modules that use it) are imported inside functions,
+# see gmtsession.py
+
+
+def render_animation(
+    spec,
+    frames: list,
+    outfile: str = "animation.gif",
+    top: list = (),
+    dpi: int = 150,
+    fps: float = 2.0,
+    max_workers: int = None,
+) -> dict:
+    """
+    Render the frames of an animation over a static base map in parallel, and
+    assemble them into a GIF or MP4 file.
+
+    Parameters
+    ----------
+    spec : figurespec.FigureSpec
+        The static base layers of the map, with its region and projection set.
+        These should all be inside the map frame, as they are drawn back from a
+        raster snapshot clipped to the region.
+    frames : list
+        One list of (method, kwargs) layers per frame, e.g.
+        [[("plot", dict(data=gdf_cycle3, ...))], [("plot", dict(data=gdf_cycle4,
+        ...))]], plotted in order over the base map.
+    outfile : str
+        Filepath of the animation, ending in .gif or .mp4.
+    top : list
+        List of (method, kwargs) layers to plot over every frame, e.g. the map
+        frame, graticule and labels.
+    dpi : int
+        Resolution of the frames. Default is 150.
+    fps : float
+        Frames per second. Default is 2.
+    max_workers : int
+        Number of frames to render at once. Default is None which lets
+        concurrent.futures decide.
+
+    Returns
+    -------
+    timings : dict
+        Time in seconds spent on the 'base' snapshot, rendering the 'frames'
+        and 'encode'-ing the animation, plus the 'total'.
+    """
+    start: float = time.perf_counter()
+    timings: dict = {}
+    base: str = spec.snapshot(dpi=dpi)
+    timings["base"] = time.perf_counter() - start
+
+    # Frames are keyed by the base snapshot (itself keyed by the base layers)
+    # and their own layers, so that unchanged frames are reused
+    tic: float = time.perf_counter()
+    fnames: list = [
+        os.path.join(
+            spec.cachedir,
+            f"{spec.name}-frame-{mapdata.cache_key(base, layers, top, dpi)}.png",
+        )
+        for layers in frames
+    ]
+    todo: dict = {
+        fname: layers
+        for fname, layers in zip(fnames, frames)
+        if not os.path.exists(fname)
+    }
+    if todo:
+        with gmtsession.process_pool(
+            max_workers=max_workers, name="animation"
+        ) as executor:
+            futures: list = [
+                executor.submit(
+                    _render_frame,
+                    base=base,
+                    region=spec.region,
+                    projection=spec.projection,
+                    layers=[*layers, *top],
+                    fname=fname,
+                    dpi=dpi,
+                )
+                for fname, layers in todo.items()
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    timings["frames"] = time.perf_counter() - tic
+
+    tic: float = time.perf_counter()
+    write_animation(fnames=fnames, outfile=outfile, fps=fps)
+    timings["encode"] = time.perf_counter() - tic
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def write_animation(fnames: list, outfile: str, fps: float = 2.0) -> str:
+    """
+    Assemble a list of PNG frames into an animated GIF (with Pillow) or an
+    MP4 video (by piping the frames to ffmpeg). Frames of different sizes are
+    padded with white to the largest size.
+    """
+    images: list = [Image.open(fp=fname).convert(mode="RGB") for fname in fnames]
+    size: tuple = tuple(max(image.size[i] for image in images) for i in range(2))
+    for i, image in enumerate(images):
+        if image.size != size:
+            images[i] = Image.new(mode="RGB", size=size, color="white")
+            images[i].paste(im=image)
+
+    if outfile.lower().endswith(".gif"):
+        images[0].save(
+            fp=outfile,
+            save_all=True,
+            append_images=images[1:],
+            duration=round(1000 / fps),
+            loop=0,
+        )
+    else:
+        stream = io.BytesIO()
+        for image in images:
+            image.save(fp=stream, format="PNG", compress_level=1)
+        subprocess.run(
+            args=[
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                "-framerate",
+                str(fps),
+                "-f",
+                "image2pipe",
+                "-i",
+                "-",
+                "-vf",
+                "pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white",  # even sizes for x264
+                "-c:v",
+                "libx264",
+                "-pix_fmt",
+                "yuv420p",
+                outfile,
+            ],
+            input=stream.getvalue(),
+            check=True,
+        )
+    return outfile
+
+
+def _render_frame(
+    base: str, region: list, projection: str, layers: list, fname: str, dpi: int
+) -> str:
+    """
+    Render one frame, by drawing the base snapshot and then the frame's layers.
+    """
+    import pygmt
+
+    import figurespec
+
+    fig = pygmt.Figure()
+    fig.grdimage(grid=base, region=region, projection=projection)
+    for method, kwargs in layers:
+        figurespec._render(fig=fig, layer=dict(method=method, config={}, kwargs=kwargs))
+    fig.savefig(fname=fname, dpi=dpi)
+    return fname
@@ -0,0 +1,424 @@
+"""
+Render an 'atlas' of regional maps like the Siple Coast key figure, one for
+every named cluster (basin) of active subglacial lakes, in parallel.
+
+Each cluster's map region, scale and inset box are derived from the bounds of
+its lake outlines. Maps are rendered by worker processes, each with its own GMT
+session, with no interactive previews. Shared inputs (data files and cpts) are
+prepared once by the main process, and the per-cluster cut rasters, composites
+and figures are cached (see mapdata.py and figurespec.py) and reused on reruns.
+
+Usage:
+
+    python atlas.py --clusters Whillans Mercer Kamb --formats png pdf --dpi 300
+"""
+
+import argparse
+import concurrent.futures
+import math
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import gmtsession
+import lakecatalog
+
+# Note that pygmt (and the modules that use it) are imported inside functions,
+# see gmtsession.py
+
+
+def cluster_regions(
+    lakes: str = "antarctic_subglacial_lakes_3031.fgb",
+    by: str = "basin_name",
+    clusters: list = None,
+    figheight: float = 115,
+    pad: float = 0.5,
+    min_size: float = 100_000,
+    max_aspect: float = 2.0,
+    round_to: float = 5_000,
+) -> dict:
+    """
+    Derive a map region and scale for each cluster of lakes, from the bounds
+    of their outlines.
+
+    Parameters
+    ----------
+    lakes : str
+        Filepath to the named lake outline store, e.g.
+        antarctic_subglacial_lakes_3031.fgb (see lakecatalog.read_lakes).
+    by : str
+        Name of the column to group the lakes into clusters by. Default is
+        'basin_name'.
+    clusters : list
+        Names of the clusters to get regions for. Default is None which gets
+        every cluster.
+    figheight : float
+        Height of the map in mm. Default is 115, the same as the key figures.
+    pad : float
+        Fraction of the cluster's extent to pad each side of the region by.
+        Default is 0.5.
+    min_size : float
+        Minimum width and height of a region in metres. Default is 100 km.
+    max_aspect : float
+        Maximum ratio of a region's long side to its short side. Default is 2.
+    round_to : float
+        Round the region outwards to a multiple of this many metres. Default is
+        5 km.
+
+    Returns
+    -------
+    regions : dict
+        Mapping of each cluster name to a dictionary with the map 'region'
+        [xmin, xmax, ymin, ymax], 'scale' denominator, and 'figwidth' in mm.
+    """
+    gdf: gpd.GeoDataFrame = lakecatalog.read_lakes(store=lakes, by=by)
+    if clusters is not None:
+        gdf = gdf[gdf[by].isin(clusters)]
+    bounds: pd.DataFrame = gdf.bounds.groupby(by=gdf[by]).agg(
+        dict(minx="min", miny="min", maxx="max", maxy="max")
+    )
+
+    # Pad each cluster's extent about its centre, and make it not too small
+    # or elongated
+    centre_x: np.ndarray = (bounds.minx + bounds.maxx).to_numpy() / 2
+    centre_y: np.ndarray = (bounds.miny + bounds.maxy).to_numpy() / 2
+    width: np.ndarray = (bounds.maxx - bounds.minx).to_numpy() * (1 + 2 * pad)
+    height: np.ndarray = (bounds.maxy - bounds.miny).to_numpy() * (1 + 2 * pad)
+    width, height = np.maximum(width, min_size), np.maximum(height, min_size)
+    width = np.maximum(width, height / max_aspect)
+    height = np.maximum(height, width / max_aspect)
+
+    xmin: np.ndarray = np.floor((centre_x - width / 2) / round_to) * round_to
+    xmax: np.ndarray = np.ceil((centre_x + width / 2) / round_to) * round_to
+    ymin: np.ndarray = np.floor((centre_y - height / 2) / round_to) * round_to
+    ymax: np.ndarray = np.ceil((centre_y + height / 2) / round_to) * round_to
+    scale: np.ndarray = (ymax - ymin) / (figheight / 1000)
+
+    return {
+        name: dict(
+            region=[int(xmin[i]), int(xmax[i]), int(ymin[i]), int(ymax[i])],
+            scale=float(scale[i]),
+            figwidth=float(figheight * (xmax[i] - xmin[i]) / (ymax[i] - ymin[i])),
+        )
+        for i, name in enumerate(bounds.index)
+    }
+
+
+def make_cpts(outdir: str = ".") -> dict:
+    """
+    Make the MOA, ice velocity and dhdt color maps used by the key figures.
+    Returns a mapping of 'moa', 'vel' and 'dhdt' to the cpt filepaths.
+    """
+    import pygmt
+
+    cpts: dict = {
+        name: os.path.join(outdir, f"cmap_{name}.cpt")
+        for name in ("moa", "vel", "dhdt")
+    }
+    pygmt.makecpt(
+        series=[15000, 17000, 1],
+        cmap="grayC",
+        continuous=True,
+        output=cpts["moa"],
+        reverse=True,
+    )
+    with pygmt.config(COLOR_FOREGROUND="240/249/33", COLOR_BACKGROUND="13/8/135"):
+        pygmt.makecpt(series=[0, 800, 1], cmap="batlow", output=cpts["vel"])
+    pygmt.makecpt(
+        cmap="berlin",
+        series=[-3, 3, 1],
+        reverse=True,
+        continuous=True,
+        output=cpts["dhdt"],
+    )
+    return cpts
+
+
+def write_lake_labels(
+    lakes: str,
+    cluster: str,
+    outfile: str,
+    scale: float,
+    region: list,
+    by: str = "basin_name",
+) -> str:
+    """
+    Write a GMT text file labelling each named lake in a cluster, placed to
+    avoid overlapping the lakes and each other, see labels.lake_labels.
+    """
+    import labels
+
+    gdf: gpd.GeoDataFrame = lakecatalog.read_lakes(store=lakes, group=cluster, by=by)
+    return labels.write_labels(
+        df_labels=labels.lake_labels(gdf=gdf, scale=scale, region=region),
+        outfile=outfile,
+    )
+
+
+def render_cluster(
+    cluster: str,
+    region: list,
+    scale: float,
+    datafiles: dict,
+    cpts: dict,
+    lakes: str = "antarctic_subglacial_lakes_3031.fgb",
+    by: str = "basin_name",
+    outdir: str = "atlas",
+    formats: list = ("png",),
+    dpi: int = 300,
+) -> list:
+    """
+    Render the map of one cluster of lakes in the style of the Siple Coast key
+    figure, and save it in each of the formats. Returns the output filepaths.
+    """
+    import figurespec
+    import mapdata
+
+    xmin, xmax, ymin, ymax = region
+    projection: str = f"x1:{scale}"
+    projection_ll: str = f"s0/-90/-71/1:{scale}"
+
+    spec = figurespec.FigureSpec(
+        name=f"atlas_{cluster}", region=region, projection=projection
+    )
+    moa = spec.product(
+        "moa",
+        mapdata.cut_raster,
+        grid=datafiles["moa"],
+        region=region,
+        scale=scale,
+        dpi=dpi,
+    )
+    vel = spec.product(
+        "vel",
+        mapdata.cut_raster,
+        grid=datafiles["vel"],
+        region=region,
+        scale=scale,
+        dpi=dpi,
+    )
+    base = spec.product(
+        "base",
+        mapdata.composite_rgb,
+        layers=[(moa, cpts["moa"], 0), (vel, cpts["vel"], 70)],
+    )
+    labels = spec.product(
+        "labels",
+        write_lake_labels,
+        lakes=lakes,
+        cluster=cluster,
+        outfile=os.path.join(outdir, f"{cluster}_labels.tsv"),
+        scale=scale,
+        region=region,
+        by=by,
+    )
+
+    # MOA and ice velocity basemap, graticules and grounding line
+    spec.layer(
+        "basemap",
+        config=dict(MAP_FRAME_TYPE="inside"),
+        region=region,
+        projection=projection,
+        frame=["nwse", "xf", "yf"],
+    )
+    spec.layer("grdimage", grid=base, nan_transparent="255/0/255")
+    spec.layer(
+        "basemap",
+        config=dict(
+            MAP_ANNOT_OFFSET_PRIMARY="-2p",
+            MAP_FRAME_TYPE="inside",
+            MAP_ANNOT_OBLIQUE=0,
+            FONT_ANNOT_PRIMARY="8p,grey",
+            MAP_GRID_PEN_PRIMARY="grey",
+            MAP_TICK_LENGTH_PRIMARY="-10p",
+            MAP_TICK_PEN_PRIMARY="thinnest,grey",
+            FORMAT_GEO_MAP="dddF",
+            MAP_POLAR_CAP="88/90",
+        ),
+        projection=projection_ll,
+        region=region,
+        frame=["NSWE", "xafg", "yafg"],
+    )
+    spec.layer(
+        "plot",
+        checkpoint=True,
+        data=mapdata.clip_simplify(
+            vector=datafiles["groundingline"], region=region, scale=scale, dpi=dpi
+        ),
+        region=region,
+        projection=projection,
+        pen="0.15p,white",
+    )
+
+    # Lakes coloured by dhdt, and their labels
+    spec.layer(
+        "plot",
+        data=datafiles["lakes"],
+        pen="thinnest,yellow,-",
+        cmap=cpts["dhdt"],
+        color="+z",
+        close=True,
+        aspatial="Z=inner_dhdt",
+    )
+    spec.layer(
+        "text", textfiles=labels, angle=True, font=True, justify=True, offset="j0.12c"
+    )
+
+    # Color bar and a scalebar of about a fifth of the map width
+    colorbar_config: dict = dict(
+        FONT_ANNOT_PRIMARY="6p,white",
+        FONT_LABEL="6p,white",
+        MAP_ANNOT_OFFSET_PRIMARY="2p",
+        MAP_TICK_PEN_PRIMARY="0.25p,white",
+        MAP_TICK_LENGTH_PRIMARY="3p",
+        MAP_FRAME_PEN="0.5p,white",
+        MAP_LABEL_OFFSET="4p",
+    )
+    colorbar_kwargs: dict = dict(
+        cmap=cpts["dhdt"],
+        position="jBR+jBR+w1.6c/0.18c+o1.2c/0.3c+v+e",
+        frame=["xaf", 'y+l"dhdt (m/yr)"'],
+    )
+    spec.layer(
+        "colorbar",
+        config=colorbar_config,
+        box="+gblack+c-9p/3p",
+        transparency=70,
+        **colorbar_kwargs,
+    )
+    spec.layer("colorbar", config=colorbar_config, **colorbar_kwargs)
+    spec.layer(
+        "basemap",
+        config=colorbar_config,
+        projection=projection_ll,
+        region=region,
+        map_scale=f"jBR+o2.2c/0.3c+w{_nice_length((xmax - xmin) / 5) / 1000:g}k+uk+f",
+    )
+
+    # Inset overview map of Antarctica, with the cluster's region in black
+    antwidth: int = 3
+    spec.layer(
+        "inset",
+        position=f"jTR+w{antwidth}c",
+        layers=[
+            (
+                "basemap",
+                dict(
+                    region=datafiles["vel"],
+                    projection=f"S0/-90/71/{antwidth}c",
+                    frame="+n",
+                ),
+            ),
+            ("coast", dict(area_thresh="+a", land="white")),
+            ("coast", dict(area_thresh="+ag", land="gray")),
+            (
+                "plot",
+                dict(
+                    projection=f"X{antwidth}c",
+                    x=[xmin, xmin, xmax, xmax, xmin],
+                    y=[ymin, ymax, ymax, ymin, ymin],
+                    pen="1p,black",
+                ),
+            ),
+        ],
+    )
+
+    outputs: list = [
+        (os.path.join(outdir, f"{cluster}.{fmt}"), None if fmt == "pdf" else dpi)
+        for fmt in formats
+    ]
+    spec.build(outputs=outputs)
+    return [fname for fname, _ in outputs]
+
+
+def _nice_length(length: float) -> float:
+    """
+    Round a length down to 1, 2 or 5 times a power of ten.
+    """
+    power: float = 10 ** math.floor(math.log10(length))
+    return max(m * power for m in (1, 2, 5) if m * power <= length)
+
+
+def main(args: list = None):
+    """
+    Command line entry point, see `python atlas.py --help`.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--lakes",
+        default="antarctic_subglacial_lakes_3031.fgb",
+        help="named lake outline store (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--by",
+        default="basin_name",
+        help="column to group lakes into clusters by (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--clusters", nargs="+", help="cluster names to map (default: all)"
+    )
+    parser.add_argument(
+        "--outdir", default="atlas", help="output folder (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=["png"],
+        help="output file formats, e.g. png pdf jpg (default: png)",
+    )
+    parser.add_argument(
+        "--dpi", type=int, default=300, help="raster resolution (default: 300)"
+    )
+    parser.add_argument(
+        "--figheight",
+        type=float,
+        default=115,
+        help="map height in mm (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="number of worker processes (default: all CPU cores)",
+    )
+    args = parser.parse_args(args=args)
+
+    import datasets
+
+    os.makedirs(name=args.outdir, exist_ok=True)
+    datafiles: dict = datasets.fetch_all()
+    cpts: dict = make_cpts(outdir=args.outdir)
+    regions: dict = cluster_regions(
+        lakes=args.lakes,
+        by=args.by,
+        clusters=args.clusters,
+        figheight=args.figheight,
+    )
+
+    with gmtsession.process_pool(
+        max_workers=args.max_workers, name="atlas"
+    ) as executor:
+        futures: dict = {
+            executor.submit(
+                render_cluster,
+                cluster=cluster,
+                region=region["region"],
+                scale=region["scale"],
+                datafiles=datafiles,
+                cpts=cpts,
+                lakes=args.lakes,
+                by=args.by,
+                outdir=args.outdir,
+                formats=args.formats,
+                dpi=args.dpi,
+            ): cluster
+            for cluster, region in regions.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            print(f"{futures[future]}: {', '.join(future.result())}")
+
+
+if __name__ == "__main__":
+    main()
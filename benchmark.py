@@ -0,0 +1,483 @@
+"""
+Offline benchmark suite for the key_figure and 3d_sketchfab_model pipelines.
+
+Synthetic stand-ins for the input data are generated at a configurable scale
+(a MOA-like GeoTIFF, a VX/VY velocity NetCDF, grounding line polygons, lake
+outlines and an ATL11-like x, y, h_corr_11, dhdt_slope parquet table), so that
+no Quantarctica data, big parquet file or network access is needed. Each stage
+of the pipelines is then timed, and memory profiled in a second run (as
+tracing allocations slows down the allocation heavy stages), and the results
+are saved to a JSON file that can be compared across commits.
+
+Usage:
+
+    python benchmark.py --scale 1 --output benchmark.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import time
+import tracemalloc
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.affinity
+import shapely.geometry
+import xarray as xr
+
+REGION: list = [-800_000, 25_000, -1_000_000, -400_000]
+
+
+def make_moa(filename: str, region: list = REGION, size: int = 2000, seed: int = 0):
+    """
+    Make a MOA-like uint16 GeoTIFF image of size x size pixels over a region,
+    with brightness values around 15000 to 17000 and 0 for no data.
+    """
+    from osgeo import gdal, osr
+
+    rng = np.random.default_rng(seed=seed)
+    xmin, xmax, ymin, ymax = region
+    yy, xx = np.mgrid[0:size, 0:size] / size
+    image: np.ndarray = 16000 + 800 * np.sin(6 * xx) * np.cos(4 * yy)
+    image += rng.normal(scale=100, size=image.shape)
+    image[: size // 10, : size // 10] = 0  # a corner with no data
+
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        filename, size, size, 1, gdal.GDT_UInt16, options=["COMPRESS=DEFLATE"]
+    )
+    dataset.SetGeoTransform(
+        (xmin, (xmax - xmin) / size, 0, ymax, 0, -(ymax - ymin) / size)
+    )
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3031)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.GetRasterBand(1).WriteArray(image.astype(np.uint16))
+    dataset.GetRasterBand(1).SetNoDataValue(0)
+    dataset.FlushCache()
+    return filename
+
+
+def make_velocity(
+    filename: str, region: list = REGION, size: int = 1000, seed: int = 0
+) -> str:
+    """
+    Make a NetCDF file with VX and VY ice velocity components (m/yr) like the
+    MEaSUREs phase map, with NaNs where there is no data.
+    """
+    rng = np.random.default_rng(seed=seed)
+    xmin, xmax, ymin, ymax = region
+    x: np.ndarray = np.linspace(xmin, xmax, size)
+    y: np.ndarray = np.linspace(ymax, ymin, size)
+    yy, xx = np.meshgrid(
+        np.linspace(0, 1, size), np.linspace(0, 1, size), indexing="ij"
+    )
+    vx: np.ndarray = 300 * np.sin(3 * xx) + rng.normal(scale=10, size=xx.shape)
+    vy: np.ndarray = 300 * np.cos(5 * yy) + rng.normal(scale=10, size=yy.shape)
+    vx[-size // 8 :, -size // 8 :] = np.nan
+    vy[-size // 8 :, -size // 8 :] = np.nan
+    xr.Dataset(
+        data_vars=dict(
+            VX=(("y", "x"), vx.astype(np.float32)),
+            VY=(("y", "x"), vy.astype(np.float32)),
+        ),
+        coords=dict(y=y, x=x),
+    ).to_netcdf(path=filename)
+    return filename
+
+
+def make_groundingline(
+    filename: str, region: list = REGION, vertices: int = 20000, seed: int = 0
+) -> str:
+    """
+    Make a shapefile with a wiggly grounding line polygon across the region,
+    plus a few islands.
+    """
+    rng = np.random.default_rng(seed=seed)
+    xmin, xmax, ymin, ymax = region
+    t: np.ndarray = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    r: np.ndarray = 1 + 0.05 * np.sin(40 * t) + 0.01 * rng.normal(size=vertices)
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    mainland = shapely.geometry.Polygon(
+        zip(
+            cx + r * np.cos(t) * (xmax - xmin) / 2.5,
+            cy + r * np.sin(t) * (ymax - ymin) / 2.5,
+        )
+    )
+    islands: list = [
+        shapely.geometry.Point(x, y).buffer(10_000, resolution=64)
+        for x, y in zip(rng.uniform(xmin, xmax, 5), rng.uniform(ymin, ymax, 5))
+    ]
+    gpd.GeoDataFrame(
+        data=dict(NAME=["mainland"] + ["island"] * len(islands)),
+        geometry=[mainland, *islands],
+        crs="EPSG:3031",
+    ).to_file(filename=filename)
+    return filename
+
+
+def make_lakes(
+    filename: str, region: list = REGION, count: int = 200, seed: int = 0
+) -> str:
+    """
+    Make a GeoJSON file with elliptical lake outlines, with lake_name,
+    basin_name and inner_dhdt attributes like the DeepIceDrain lake catalogue.
+    """
+    rng = np.random.default_rng(seed=seed)
+    xmin, xmax, ymin, ymax = region
+    x: np.ndarray = rng.uniform(xmin, xmax, count)
+    y: np.ndarray = rng.uniform(ymin, ymax, count)
+    radius: np.ndarray = rng.uniform(3_000, 15_000, count)
+    geometry: list = [
+        shapely.affinity.scale(shapely.geometry.Point(*p).buffer(r), 1.0, 0.6)
+        for *p, r in zip(x, y, radius)
+    ]
+    basins: list = ["Whillans", "Mercer", "Kamb", "MacAyeal", "Slessor"]
+    gpd.GeoDataFrame(
+        data=dict(
+            lake_name=[f"Subglacial Lake {basins[i % 5]} {i}" for i in range(count)],
+            basin_name=[basins[i % 5] for i in range(count)],
+            inner_dhdt=rng.normal(scale=1.0, size=count),
+        ),
+        geometry=geometry,
+        crs="EPSG:3031",
+    ).to_file(filename=filename, driver="GeoJSON")
+    return filename
+
+
+def make_atl11(
+    filename: str,
+    region: list = REGION,
+    points: int = 1_000_000,
+    row_group_size: int = 100_000,
+    seed: int = 0,
+) -> str:
+    """
+    Make an ATL11-like parquet table with x, y, h_corr_11 and dhdt_slope
+    columns, sorted along y like repeat ground tracks would be.
+    """
+    rng = np.random.default_rng(seed=seed)
+    xmin, xmax, ymin, ymax = region
+    df: pd.DataFrame = pd.DataFrame(
+        data=dict(
+            x=rng.uniform(xmin, xmax, points),
+            y=np.sort(rng.uniform(ymin, ymax, points)),
+            h_corr_11=rng.normal(loc=500, scale=100, size=points),
+            dhdt_slope=rng.standard_t(df=3, size=points) * 0.1,
+        )
+    )
+    df.loc[rng.random(points) < 0.01, "dhdt_slope"] = np.nan
+    df.to_parquet(path=filename, engine="fastparquet", row_group_offsets=row_group_size)
+    return filename
+
+
+@contextlib.contextmanager
+def _stage(results: list, name: str):
+    """
+    Time a stage of the benchmark, and record the peak resident set size of
+    the process so far (which includes memory allocated by GMT). If tracemalloc
+    is running, the peak memory allocated by Python (and numpy) within the
+    stage is recorded too.
+    """
+    tracing: bool = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    tic: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds: float = time.perf_counter() - tic
+        peak: int = tracemalloc.get_traced_memory()[1] if tracing else None
+        results.append(
+            dict(
+                name=name,
+                seconds=round(seconds, 4),
+                peak_traced_mb=None if peak is None else round(peak / 2**20, 2),
+                max_rss_mb=round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 2
+                ),
+            )
+        )
+        print(f"{name}: {seconds:.2f}s")
+
+
+def run(
+    workdir: str = "benchmark_data",
+    scale: float = 1.0,
+    dpi: int = 300,
+    trace_memory: bool = True,
+) -> list:
+    """
+    Generate the synthetic data under workdir and run every benchmark stage,
+    returning a list of {name, seconds, peak_traced_mb, max_rss_mb} results.
+
+    The seconds and max_rss_mb come from an untraced run, and peak_traced_mb
+    from a second run with tracemalloc on, or is None if trace_memory is False.
+    """
+    results: list = _run_stages(workdir=workdir, scale=scale, dpi=dpi)
+    if trace_memory:
+        print("Running again to trace memory allocations")
+        tracemalloc.start()
+        try:
+            traced: list = _run_stages(workdir=workdir, scale=scale, dpi=dpi)
+        finally:
+            tracemalloc.stop()
+        for result, traced_result in zip(results, traced):
+            result["peak_traced_mb"] = traced_result["peak_traced_mb"]
+    return results
+
+
+def _run_stages(workdir: str, scale: float, dpi: int) -> list:
+    """
+    Run every benchmark stage once, starting from an empty cache of
+    intermediate files, so that each run does the same work.
+    """
+    import pygmt
+
+    import datasets
+    import export3d
+    import figexport
+    import figurespec
+    import gridding
+    import labels
+    import mapdata
+    import pointcloud
+
+    os.makedirs(name=workdir, exist_ok=True)
+    cachedir: str = os.path.join(workdir, "cache")
+    shutil.rmtree(path=cachedir, ignore_errors=True)
+    results: list = []
+    size: int = int(2000 * scale**0.5)
+
+    with _stage(results, "generate synthetic data"):
+        moa: str = make_moa(filename=f"{workdir}/moa.tif", size=size)
+        vel_xy: str = make_velocity(filename=f"{workdir}/vel.nc", size=size // 2)
+        groundingline: str = make_groundingline(filename=f"{workdir}/gl.shp")
+        lakes: str = make_lakes(
+            filename=f"{workdir}/lakes.geojson", count=int(200 * scale**0.5)
+        )
+        atl11: str = make_atl11(
+            filename=f"{workdir}/atl11.parquet", points=int(1_000_000 * scale)
+        )
+
+    # Data preparation, see key_figure.py
+    with _stage(results, "prep: mask MOA zeros as NaN"):
+        moa = datasets.mask_zero_as_nan(infile=moa, outfile=f"{workdir}/moa.nc")
+    with _stage(results, "prep: velocity magnitude"):
+        vel: str = datasets.hypot_magnitude(
+            infile=vel_xy, outfile=f"{workdir}/vel-vmag.nc"
+        )
+    with _stage(results, "prep: makecpt"):
+        pygmt.makecpt(
+            series=[15000, 17000, 1],
+            cmap="grayC",
+            continuous=True,
+            output=f"{workdir}/cmap_moa.cpt",
+            reverse=True,
+        )
+        pygmt.makecpt(
+            series=[0, 800, 1], cmap="batlow", output=f"{workdir}/cmap_vel.cpt"
+        )
+        pygmt.makecpt(
+            cmap="berlin",
+            series=[-3, 3, 1],
+            reverse=True,
+            continuous=True,
+            output=f"{workdir}/cmap_dhdt.cpt",
+        )
+    scale_denominator: float = (REGION[3] - REGION[2]) / 0.115
+    with _stage(results, "prep: cut rasters"):
+        cut_moa: str = mapdata.cut_raster(
+            grid=moa, region=REGION, scale=scale_denominator, dpi=dpi, cachedir=cachedir
+        )
+        cut_vel: str = mapdata.cut_raster(
+            grid=vel, region=REGION, scale=scale_denominator, dpi=dpi, cachedir=cachedir
+        )
+    with _stage(results, "prep: composite MOA and velocity"):
+        base: str = mapdata.composite_rgb(
+            layers=[
+                (cut_moa, f"{workdir}/cmap_moa.cpt", 0),
+                (cut_vel, f"{workdir}/cmap_vel.cpt", 70),
+            ],
+            cachedir=cachedir,
+        )
+    with _stage(results, "prep: clip and simplify grounding line"):
+        gdf_groundingline: gpd.GeoDataFrame = mapdata.clip_simplify(
+            vector=groundingline,
+            region=REGION,
+            scale=scale_denominator,
+            dpi=dpi,
+            cachedir=cachedir,
+        )
+    with _stage(results, "prep: grid dhdt"):
+        gridding.grid_dhdt(path=atl11, outgrid=f"{workdir}/dhdt.nc", region=REGION)
+
+    # Label generation
+    gdf_lakes: gpd.GeoDataFrame = gpd.read_file(filename=lakes)
+    with _stage(results, "labels: place lake labels"):
+        labels.write_labels(
+            df_labels=labels.lake_labels(
+                gdf=gdf_lakes, scale=scale_denominator, region=REGION
+            ),
+            outfile=f"{workdir}/labels.tsv",
+        )
+
+    # Figure layers, one at a time, then saving to each format
+    projection: str = f"x1:{scale_denominator}"
+    layers: list = [
+        ("basemap", dict(region=REGION, projection=projection, frame="f")),
+        ("grdimage", dict(grid=base, nan_transparent="255/0/255")),
+        (
+            "grdimage (transparent)",
+            dict(
+                grid=cut_vel,
+                cmap=f"{workdir}/cmap_vel.cpt",
+                transparency=70,
+                nan_transparent=True,
+            ),
+        ),
+        ("plot grounding line", dict(data=gdf_groundingline, pen="0.15p,white")),
+        (
+            "plot lakes",
+            dict(
+                data=gdf_lakes,
+                pen="thinnest,yellow,-",
+                cmap=f"{workdir}/cmap_dhdt.cpt",
+                color="+z",
+                close=True,
+                aspatial="Z=inner_dhdt",
+            ),
+        ),
+        (
+            "text",
+            dict(
+                textfiles=f"{workdir}/labels.tsv",
+                angle=True,
+                font=True,
+                justify=True,
+                offset="j0.12c",
+            ),
+        ),
+    ]
+    fig = pygmt.Figure()
+    for name, kwargs in layers:
+        method: str = name.split()[0]
+        with _stage(results, f"figure: {name}"):
+            figurespec._render(
+                fig=fig, layer=dict(method=method, config={}, kwargs=kwargs)
+            )
+    for fmt, fmt_dpi in (("pdf", None), ("png", dpi), ("jpg", dpi)):
+        with _stage(results, f"savefig: {fmt}"):
+            fig.savefig(fname=f"{workdir}/figure.{fmt}", dpi=fmt_dpi or 300)
+    with _stage(results, "export: pdf, png and jpg at once"):
+        figexport_outputs: list = [
+            (f"{workdir}/export.pdf", None),
+            (f"{workdir}/export.png", dpi),
+            (f"{workdir}/export.jpg", dpi),
+        ]
+        figexport.export_figure(fig=fig, outputs=figexport_outputs)
+
+    # Point cloud, see 3d_sketchfab_model.py
+    with _stage(results, "3d: parquet filter"):
+        df_points: pd.DataFrame = pointcloud.load_dhdt_points(
+            path=atl11, dhdt_threshold=0.12
+        )
+    xyz: np.ndarray = df_points[["x", "y", "z"]].to_numpy()
+    dhdt_slope: np.ndarray = df_points.dhdt_slope.to_numpy()
+    with _stage(results, "3d: octree decimate"):
+        keep: np.ndarray = pointcloud.octree_decimate(
+            xyz=xyz, dhdt_slope=dhdt_slope, target_points=len(xyz) // 4 + 1
+        )
+    with _stage(results, "3d: PolyData"):
+        import pyvista as pv
+
+        cloud = pv.PolyData(xyz[keep])
+        cloud.point_data["dhdt_slope"] = dhdt_slope[keep]
+    with _stage(results, "3d: glTF"):
+        import cmcrameri.cm as cmc
+
+        export3d.write_glb(
+            filename=f"{workdir}/cloud.glb",
+            xyz=xyz[keep],
+            dhdt_slope=dhdt_slope[keep],
+            cmap=cmc.vik_r,
+            clim=(-2.5, 2.5),
+        )
+    with _stage(results, "3d: per-lake point extraction"):
+        pointcloud.extract_lake_points(gdf_lakes=gdf_lakes, path=atl11)
+
+    return results
+
+
+def main(args: list = None):
+    """
+    Command line entry point, see `python benchmark.py --help`.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="size of the synthetic data, where 1 is 1 million points and a "
+        "2000x2000 pixel MOA image (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dpi", type=int, default=300, help="figure resolution (default: 300)"
+    )
+    parser.add_argument(
+        "--workdir",
+        default="benchmark_data",
+        help="folder for the synthetic data and outputs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark.json",
+        help="JSON file to save the results to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="skip the second run that records peak_traced_mb",
+    )
+    args = parser.parse_args(args=args)
+
+    results: list = run(
+        workdir=args.workdir,
+        scale=args.scale,
+        dpi=args.dpi,
+        trace_memory=args.trace_memory,
+    )
+
+    try:
+        commit: str = subprocess.run(
+            args=["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except FileNotFoundError:
+        commit: str = None
+    with open(file=args.output, mode="w") as file:
+        json.dump(
+            obj=dict(
+                commit=commit or None,
+                date=datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+                python=platform.python_version(),
+                machine=platform.machine(),
+                cpus=os.cpu_count(),
+                scale=args.scale,
+                dpi=args.dpi,
+                stages=results,
+            ),
+            fp=file,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
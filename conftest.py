@@ -0,0 +1,44 @@
+"""
+Shared pytest fixtures.
+"""
+
+import functools
+import http.server
+import threading
+
+import pytest
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """
+    Serve a temporary folder over HTTP on localhost, as a stand-in for remote
+    data servers. Yields the folder and its base URL, and counts the requests
+    made to each path in server.requests.
+    """
+    root = tmp_path / "served"
+    root.mkdir()
+    requests: dict = {}
+
+    class Handler(_QuietHandler):
+        def do_GET(self):
+            requests[self.path] = requests.get(self.path, 0) + 1
+            super().do_GET()
+
+    server = http.server.ThreadingHTTPServer(
+        server_address=("127.0.0.1", 0),
+        RequestHandlerClass=functools.partial(Handler, directory=str(root)),
+    )
+    server.root = root
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.requests = requests
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
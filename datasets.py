@@ -0,0 +1,412 @@
+"""
+Data manager for downloading, verifying and post-processing the input data
+files used by the key_figure notebook, mostly from Quantarctica3 sources.
+
+Each source is declared once in SOURCES with its URL, known hash and any
+post-processing step. Downloads run concurrently in a thread pool, and
+post-processing (e.g. NaN-masking, velocity magnitude) runs in a process pool.
+Post-processed outputs are tagged with a hash of their inputs, so that warm
+runs do no network access or recomputation at all.
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import warnings
+
+import netCDF4
+import numpy as np
+import pooch
+import pygmt
+
+
+def mask_zero_as_nan(infile: str, outfile: str) -> str:
+    """
+    Set grid cells with a value of 0 to NaN, e.g. for the MOA image mosaic.
+    """
+    with pygmt.clib.Session() as lib:
+        # !gmt grdmath $infile 0 NAN = $outfile
+        lib.call_module(module="grdmath", args=f"{infile} 0 NAN = {outfile}")
+    return outfile
+
+
+def hypot_magnitude(
+    infile: str,
+    outfile: str,
+    components: tuple = ("VX", "VY"),
+    block_rows: int = 512,
+    levels: tuple = (2, 4, 8),
+    max_workers: int = None,
+) -> str:
+    """
+    Calculate the magnitude sqrt(VX^2 + VY^2) of a vector grid (e.g. the ice
+    velocity components) in-process, streaming blocks of rows so that memory
+    use is bounded to a few blocks regardless of the grid size.
+
+    Blocks are read from the input NetCDF file one at a time (as netCDF-C is
+    not thread-safe), with np.hypot computed across a pool of worker threads,
+    and written to a compressed, chunked NetCDF file. Downsampled copies (the
+    mean of every factor x factor cells) can be written at the same time, for
+    use in smaller scale overview maps.
+
+    Parameters
+    ----------
+    infile : str
+        Filepath to the input NetCDF file with x, y coordinates.
+    outfile : str
+        Filepath to the output NetCDF grid, e.g. ending in -vmag.nc.
+    components : tuple
+        Names of the two vector component variables. Default is ("VX", "VY").
+    block_rows : int
+        Number of rows in each block. Rounded up to a multiple of the largest
+        downsampling factor. Default is 512.
+    levels : tuple
+        Downsampling factors for the grid pyramid, each written to a file
+        ending in -{factor}x.nc next to outfile. Default is (2, 4, 8).
+    max_workers : int
+        Number of worker threads. Default is None which uses the number of CPU
+        cores.
+
+    Returns
+    -------
+    outfile : str
+        Filepath to the full resolution magnitude grid.
+    """
+    largest: int = max(levels, default=1)
+    block_rows: int = -(-block_rows // largest) * largest
+
+    def _magnitude(vx: np.ndarray, vy: np.ndarray) -> (np.ndarray, dict):
+        magnitude: np.ndarray = np.hypot(vx, vy).astype(np.float32)
+        pyramid: dict = {}
+        for factor in levels:
+            rows, cols = magnitude.shape[0] // factor, magnitude.shape[1] // factor
+            trimmed: np.ndarray = magnitude[: rows * factor, : cols * factor]
+            with np.errstate(invalid="ignore"), warnings.catch_warnings():
+                warnings.simplefilter(action="ignore", category=RuntimeWarning)
+                pyramid[factor] = np.nanmean(
+                    trimmed.reshape(rows, factor, cols, factor), axis=(1, 3)
+                )
+        return magnitude, pyramid
+
+    def _create(filename: str, x: np.ndarray, y: np.ndarray, template):
+        # Make a compressed NetCDF grid with the same x/y attributes as infile
+        dataset = netCDF4.Dataset(filename=filename, mode="w")
+        try:
+            for name, coord in (("y", y), ("x", x)):
+                dataset.createDimension(dimname=name, size=len(coord))
+                var = dataset.createVariable(
+                    varname=name, datatype="f8", dimensions=name
+                )
+                var.setncatts(
+                    {
+                        k: template[name].getncattr(k)
+                        for k in template[name].ncattrs()
+                        if k != "_FillValue"
+                    }
+                )
+                var[:] = coord
+            dataset.createVariable(
+                varname="z",
+                datatype="f4",
+                dimensions=("y", "x"),
+                zlib=True,
+                complevel=4,
+                chunksizes=(min(block_rows, len(y)), min(1024, len(x))),
+                fill_value=np.float32(np.nan),
+            ).setncattr("long_name", "magnitude")
+        except BaseException:
+            dataset.close()
+            raise
+        return dataset
+
+    filenames: dict = {1: outfile, **pyramid_filenames(outfile=outfile, levels=levels)}
+    with netCDF4.Dataset(filename=infile) as source, contextlib.ExitStack() as stack:
+        source.set_auto_mask(False)
+        vx, vy = (source[name] for name in components)
+        x, y = source["x"][:], source["y"][:]
+        fill = [getattr(var, "_FillValue", np.nan) for var in (vx, vy)]
+        outputs: dict = {}
+        for factor, filename in filenames.items():
+            nx, ny = len(x) // factor * factor, len(y) // factor * factor
+            outputs[factor] = stack.enter_context(
+                _create(
+                    filename=filename,
+                    x=x[:nx].reshape(-1, factor).mean(axis=1),
+                    y=y[:ny].reshape(-1, factor).mean(axis=1),
+                    template=source,
+                )
+            )
+
+        def _write(row: int, future):
+            magnitude, pyramid = future.result()
+            outputs[1]["z"][row : row + len(magnitude)] = magnitude
+            for factor, downsampled in pyramid.items():
+                start: int = row // factor
+                outputs[factor]["z"][start : start + len(downsampled)] = downsampled
+
+        max_workers: int = max_workers or os.cpu_count()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending: list = []
+            for row in range(0, len(y), block_rows):
+                blocks: list = []
+                for var, fillvalue in zip((vx, vy), fill):
+                    block: np.ndarray = var[row : row + block_rows].astype(np.float32)
+                    block[block == fillvalue] = np.nan
+                    blocks.append(block)
+                pending.append((row, pool.submit(_magnitude, *blocks)))
+                # Write finished blocks in order, keeping few blocks in memory
+                while pending and (pending[0][1].done() or len(pending) > max_workers):
+                    _write(*pending.pop(0))
+            for row, future in pending:
+                _write(row, future)
+
+    return outfile
+
+
+def pyramid_filenames(outfile: str, levels: tuple = (2, 4, 8)) -> dict:
+    """
+    Get the filepaths of the downsampled grids written by hypot_magnitude next
+    to outfile, e.g. vel-vmag-2x.nc for vel-vmag.nc, keyed by factor.
+    """
+    stem, ext = os.path.splitext(outfile)
+    return {factor: f"{stem}-{factor}x{ext}" for factor in levels}
+
+
+SOURCES: dict = {
+    # MODIS Mosaic of Antarctica
+    "moa": dict(
+        url="ftp://ftp.nsidc.org/pub/DATASETS/nsidc0593_moa2009_v02/geotiff/moa750_2009_hp1_v02.0.tif.gz",
+        known_hash="90d1718ea0971795ec102482c47f308ba08ba2b88383facb9fe210877e80282c",
+        path="SatelliteImagery/MODIS",
+        processor=pooch.Decompress(name="moa750_2009_hp1_v1.1.tif"),
+        postprocess=(mask_zero_as_nan, "moa750_2009_hp1_v01.1.tif"),
+    ),
+    # Scripps Grounding Line
+    "groundingline": dict(
+        url="https://epic.awi.de/id/eprint/33781/1/Antarctica_masks.zip",
+        known_hash="e4c5918240e334680aed1329f109527efd8f43b6a277bb8e77b66f84f8c16619",
+        fname="groundingline",
+        path="Miscellaneous/ScrippsGroundingLine",
+        processor=pooch.Unzip(),
+        select=".shp",
+    ),
+    # MEaSUREs Phase Map of Antarctic Ice Velocity
+    # Note, download require a .netrc file containing 'machine urs.earthdata.nasa.gov login <uid> password <password>'
+    # see https://nsidc.org/support/how/how-do-i-programmatically-access-data-spatial-temporal
+    "vel": dict(
+        url="https://n5eil01u.ecs.nsidc.org/MEASURES/NSIDC-0754.001/1996.01.01/antarctic_ice_vel_phase_map_v01.nc",
+        known_hash="fa0957618b8bd98099f4a419d7dc0e3a2c562d89e9791b4d0ed55e6017f52416",
+        fname="antarctic_ice_vel_phase_map_v01.nc",
+        path="Glaciology/MEaSUREs_PhaseBased_Velocity",
+        postprocess=(hypot_magnitude, "antarctic_ice_vel_phase_map_v01-vmag.nc"),
+        pyramid=True,  # also writes -2x, -4x and -8x downsampled grids
+        fallback="vel_preprocessed",
+    ),
+    # Pre-processed velocity magnitude grid from GitHub, if the above fails
+    "vel_preprocessed": dict(
+        url="https://github.com/weiji14/nzasc2021/releases/download/v0.0.0/antarctic_ice_vel_phase_map_v01-vmag.nc",
+        known_hash="ed6393275d8d8475c2162a838d6b9220cd529d28a2b5d674a6bf6dbda4971049",
+        fname="antarctic_ice_vel_phase_map_v01-vmag.nc",
+        path="Glaciology/MEaSUREs_PhaseBased_Velocity",
+        fallback_only=True,
+    ),
+    # DeepIceDrain active subglacial lake outlines (URL is pinned to a commit).
+    # Its hash is recorded on first download and verified after that, until
+    # known_hash is filled in with the one from fetch_all's (one-off) warning
+    "lakes": dict(
+        url="https://raw.githubusercontent.com/weiji14/deepicedrain/0cec859288b2add98a42b095955c8ec644dd616f/antarctic_subglacial_lakes_3031.geojson",
+        known_hash=None,
+        fname="antarctic_subglacial_lakes_3031.geojson",
+        path="Glaciology/DeepIceDrain",
+    ),
+}
+
+
+def fetch_all(
+    datafold: str = os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"),
+    names: list = None,
+    sources: dict = SOURCES,
+    max_workers: int = None,
+) -> dict:
+    """
+    Download, verify and post-process data files concurrently.
+
+    Parameters
+    ----------
+    datafold : str
+        Root folder to store the data in. Default is the DATAHOME environment
+        variable, or ./Quantarctica3.
+    names : list
+        Names of the sources to get. Default is None which gets every source
+        that isn't only a fallback.
+    sources : dict
+        The data source declarations. Default is SOURCES.
+    max_workers : int
+        Number of download threads and post-processing processes. Default is
+        None which lets concurrent.futures decide.
+
+    Returns
+    -------
+    filepaths : dict
+        Mapping of each source name to the filepath of its final output.
+    """
+    if names is None:
+        names: list = [
+            name for name, source in sources.items() if not source.get("fallback_only")
+        ]
+
+    def _retrieve(name: str) -> str:
+        source: dict = sources[name]
+        known_hash: str = source["known_hash"] or _recorded_hash(datafold, source)
+        output = pooch.retrieve(
+            url=source["url"],
+            known_hash=known_hash,
+            fname=source.get("fname"),
+            path=os.path.join(datafold, source["path"]),
+            processor=source.get("processor"),
+        )
+        if known_hash is None:
+            # Record the hash of an unpinned file on first download, so that a
+            # changed or corrupted file is caught (and re-downloaded) after this
+            download: str = os.path.join(datafold, source["path"], source["fname"])
+            known_hash: str = f"sha256:{pooch.file_hash(fname=download)}"
+            with open(file=f"{download}.sha256", mode="w") as file:
+                file.write(known_hash)
+            warnings.warn(
+                f"Data source {name!r} has no known hash, recorded {known_hash!r}"
+                " to verify it against from now on (pin it in SOURCES)"
+            )
+        if "select" in source:
+            output = [f for f in output if f.endswith(source["select"])][0]
+        return output
+
+    def _fallback(name: str) -> str:
+        # Get the fallback source, marking it as fresh if it stands in for the
+        # post-processed output, so that it is not recomputed on the next run.
+        # Any downsampled grids left from an earlier run are now out of date
+        output: str = _retrieve(sources[name]["fallback"])
+        outfile, key = _postprocess_target(datafold, sources[name])
+        for extra in _extra_outputs(outfile=outfile, source=sources[name]):
+            for filename in (extra, f"{extra}.sha256"):
+                if os.path.exists(filename):
+                    os.remove(filename)
+        if output == outfile:
+            _mark_fresh(outfiles=[outfile], key=key)
+        return output
+
+    filepaths: dict = {}
+    infiles: dict = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as threads:
+        # Skip downloading anything whose post-processed output is up to date
+        pending: dict = {}
+        for name in names:
+            outfile, key = _postprocess_target(datafold, sources[name])
+            if outfile is not None and _is_fresh(
+                outfile=outfile,
+                key=key,
+                extras=_extra_outputs(outfile=outfile, source=sources[name]),
+            ):
+                filepaths[name] = outfile
+            else:
+                pending[name] = threads.submit(_retrieve, name)
+
+        for name, future in pending.items():
+            try:
+                infiles[name] = future.result()
+            except Exception:
+                if "fallback" not in sources[name]:
+                    raise
+                filepaths[name] = _fallback(name)
+
+    # Post-process the downloads once the download threads have finished, as
+    # forking worker processes while other threads are running can deadlock
+    for name in [name for name in infiles if "postprocess" not in sources[name]]:
+        filepaths[name] = infiles.pop(name)
+    if infiles:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as procs:
+            postprocessing: dict = {}
+            for name, infile in infiles.items():
+                function, _ = sources[name]["postprocess"]
+                outfile, key = _postprocess_target(datafold, sources[name])
+                postprocessing[name] = (
+                    procs.submit(function, infile=infile, outfile=outfile),
+                    key,
+                )
+
+            for name, (future, key) in postprocessing.items():
+                try:
+                    filepaths[name] = future.result()
+                    extras: list = _extra_outputs(
+                        outfile=filepaths[name], source=sources[name]
+                    )
+                    _mark_fresh(outfiles=[filepaths[name], *extras], key=key)
+                except Exception:
+                    if "fallback" not in sources[name]:
+                        raise
+                    filepaths[name] = _fallback(name)
+
+    return filepaths
+
+
+def _postprocess_target(datafold: str, source: dict) -> (str, str):
+    """
+    Get the output filepath of a source's post-processing step (or None if it
+    has none), and a key made from hashing the input file's known hash and the
+    name of the post-processing function.
+    """
+    if "postprocess" not in source:
+        return None, None
+    function, fname = source["postprocess"]
+    known_hash: str = source["known_hash"] or _recorded_hash(datafold, source)
+    key: str = hashlib.sha256(f"{known_hash}:{function.__name__}".encode()).hexdigest()
+    return os.path.join(datafold, source["path"], fname), key
+
+
+def _recorded_hash(datafold: str, source: dict) -> str:
+    """
+    Get the hash recorded on the first download of a source without a known
+    hash (which needs an fname), or None if it has not been downloaded yet.
+    """
+    download: str = os.path.join(datafold, source["path"], source["fname"])
+    try:
+        with open(file=f"{download}.sha256") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _extra_outputs(outfile: str, source: dict) -> list:
+    """
+    Get the filepaths of any other files written by a source's post-processing
+    step, i.e. the downsampled grids of hypot_magnitude.
+    """
+    if outfile is None or not source.get("pyramid"):
+        return []
+    return list(pyramid_filenames(outfile=outfile).values())
+
+
+def _mark_fresh(outfiles: list, key: str):
+    """
+    Tag post-processed outputs with the key of the inputs they were made from.
+    """
+    for outfile in outfiles:
+        with open(file=f"{outfile}.sha256", mode="w") as file:
+            file.write(key)
+
+
+def _is_fresh(outfile: str, key: str, extras: list = ()) -> bool:
+    """
+    Check if a post-processed output exists and was made from the same inputs,
+    and that any extra outputs of the same step that exist were too.
+    """
+    for filename in [outfile, *extras]:
+        if filename != outfile and not os.path.exists(filename):
+            continue
+        try:
+            with open(file=f"{filename}.sha256") as file:
+                if not (os.path.exists(filename) and file.read() == key):
+                    return False
+        except FileNotFoundError:
+            return False
+    return True
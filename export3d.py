@@ -0,0 +1,657 @@
+"""
+Writers for exporting the ICESat-2 point cloud to 3D model formats without
+going through a VTK render window, used by the 3d_sketchfab_model notebook.
+"""
+
+import concurrent.futures
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+import pointcloud
+
+
+def colorize(
+    values: np.ndarray, cmap, clim: tuple = (-2.5, 2.5), ncolors: int = 256
+) -> np.ndarray:
+    """
+    Map scalar values to 8-bit RGBA colours using a lookup table sampled from
+    a colormap, e.g. cmc.vik_r from cmcrameri.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (n,) with the values to colour, e.g. dhdt_slope.
+    cmap : matplotlib.colors.Colormap
+        Any callable that returns RGBA floats in [0, 1] for inputs in [0, 1].
+    clim : tuple
+        The (min, max) data values mapped to either end of the colormap.
+        Values outside of this range are clipped. Default is (-2.5, 2.5).
+    ncolors : int
+        Number of colours in the lookup table. Default is 256.
+
+    Returns
+    -------
+    rgba : np.ndarray
+        uint8 array of shape (n, 4).
+    """
+    lut: np.ndarray = np.round(np.asarray(cmap(np.linspace(0, 1, ncolors))) * 255)
+    normalized: np.ndarray = (values - clim[0]) / (clim[1] - clim[0])
+    index: np.ndarray = np.clip(normalized * (ncolors - 1), a_min=0, a_max=ncolors - 1)
+    return lut.astype(np.uint8)[np.round(index).astype(np.int64)]
+
+
+def write_glb(
+    filename: str,
+    xyz: np.ndarray,
+    dhdt_slope: np.ndarray,
+    cmap,
+    clim: tuple = (-2.5, 2.5),
+    include_dhdt: bool = False,
+    zipped: bool = False,
+) -> str:
+    """
+    Write a point cloud to a single binary glTF (.glb) file.
+
+    Positions are quantized to uint16 per axis (KHR_mesh_quantization), with
+    the node transform mapping them back to the original coordinates (minus
+    the centre of the cloud) and rotating the z-up data into glTF's y-up
+    convention. Points are coloured by dhdt_slope as 8-bit RGBA vertex colours.
+
+    Parameters
+    ----------
+    filename : str
+        Output filepath, should end with .glb.
+    xyz : np.ndarray
+        Array of shape (n, 3) with the point coordinates.
+    dhdt_slope : np.ndarray
+        Array of shape (n,) with the rate of elevation change of each point.
+    cmap : matplotlib.colors.Colormap
+        The colormap used to colour the points, e.g. cmc.vik_r.
+    clim : tuple
+        The (min, max) dhdt_slope values for the colormap. Default is
+        (-2.5, 2.5).
+    include_dhdt : bool
+        Also store dhdt_slope as a float32 custom vertex attribute named
+        _DHDT_SLOPE. Default is False.
+    zipped : bool
+        Store the .glb inside a deflate .zip archive (which Sketchfab accepts
+        as an upload), with the points reordered along a Morton curve first so
+        that neighbouring points have similar quantized positions and colours
+        that deflate well. The glTF attributes themselves are not compressed.
+        Default is False.
+
+    Returns
+    -------
+    filename : str
+        The path to the file that was written, ending in .zip if zipped=True.
+    """
+    if len(xyz) == 0:
+        raise ValueError(f"Cannot write {filename!r} with no points in xyz")
+
+    if zipped:
+        order: np.ndarray = np.argsort(
+            pointcloud.morton_code(x=xyz[:, 0], y=xyz[:, 1]), kind="stable"
+        )
+        xyz, dhdt_slope = xyz[order], dhdt_slope[order]
+
+    # Quantize positions to uint16, padded to 8 bytes per vertex for alignment
+    lowest: np.ndarray = xyz.min(axis=0).astype(np.float64)
+    highest: np.ndarray = xyz.max(axis=0).astype(np.float64)
+    scale: np.ndarray = np.where(highest > lowest, (highest - lowest) / 65535, 1.0)
+    positions = np.zeros(shape=(len(xyz), 4), dtype="<u2")
+    positions[:, :3] = np.round((xyz - lowest) / scale)
+    colors: np.ndarray = colorize(values=dhdt_slope, cmap=cmap, clim=clim)
+
+    buffers: list = [positions.tobytes(), colors.tobytes()]
+    if include_dhdt:
+        buffers.append(np.asarray(dhdt_slope, dtype="<f4").tobytes())
+
+    bufferviews: list = []
+    offset: int = 0
+    for buffer, stride in zip(buffers, [8, 4, 4]):
+        bufferviews.append(
+            dict(
+                buffer=0,
+                byteOffset=offset,
+                byteLength=len(buffer),
+                byteStride=stride,
+                target=34962,  # ARRAY_BUFFER
+            )
+        )
+        offset += len(buffer)
+
+    accessors: list = [
+        dict(
+            bufferView=0,
+            componentType=5123,  # UNSIGNED_SHORT
+            count=len(xyz),
+            type="VEC3",
+            min=positions[:, :3].min(axis=0).tolist(),
+            max=positions[:, :3].max(axis=0).tolist(),
+        ),
+        dict(
+            bufferView=1,
+            componentType=5121,  # UNSIGNED_BYTE
+            normalized=True,
+            count=len(xyz),
+            type="VEC4",
+        ),
+    ]
+    attributes: dict = {"POSITION": 0, "COLOR_0": 1}
+    if include_dhdt:
+        accessors.append(
+            dict(bufferView=2, componentType=5126, count=len(xyz), type="SCALAR")
+        )
+        attributes["_DHDT_SLOPE"] = 2
+
+    # Rotate z-up to y-up, i.e. (x, y, z) -> (x, z, -y), around the centre
+    lowest -= (lowest + highest) / 2
+    gltf: dict = dict(
+        asset=dict(version="2.0", generator="agu2021 export3d.write_glb"),
+        extensionsUsed=["KHR_mesh_quantization", "KHR_materials_unlit"],
+        extensionsRequired=["KHR_mesh_quantization"],
+        scene=0,
+        scenes=[dict(nodes=[0])],
+        nodes=[
+            dict(
+                mesh=0,
+                rotation=[-np.sqrt(0.5), 0.0, 0.0, np.sqrt(0.5)],
+                translation=[lowest[0], lowest[2], -lowest[1]],
+                scale=scale.tolist(),
+            )
+        ],
+        meshes=[
+            dict(primitives=[dict(attributes=attributes, mode=0, material=0)])
+        ],  # mode 0 is POINTS
+        materials=[
+            dict(
+                pbrMetallicRoughness=dict(metallicFactor=0.0),
+                extensions=dict(KHR_materials_unlit={}),
+            )
+        ],
+        accessors=accessors,
+        bufferViews=bufferviews,
+        buffers=[dict(byteLength=offset)],
+    )
+
+    glb: bytes = _pack_glb(gltf=gltf, binary=b"".join(buffers))
+    if zipped:
+        zipname: str = f"{filename}.zip"
+        with zipfile.ZipFile(
+            file=zipname, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+        ) as archive:
+            archive.writestr(zinfo_or_arcname=os.path.basename(filename), data=glb)
+        return zipname
+
+    with open(file=filename, mode="wb") as file:
+        file.write(glb)
+    return filename
+
+
+def _pack_glb(gltf: dict, binary: bytes) -> bytes:
+    """
+    Assemble a glTF JSON document and its binary buffer into the GLB container
+    format, i.e. a 12 byte header followed by a JSON chunk and a BIN chunk.
+    """
+    json_chunk: bytes = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    binary += b"\x00" * (-len(binary) % 4)
+
+    length: int = 12 + 8 + len(json_chunk) + 8 + len(binary)
+    return b"".join(
+        [
+            struct.pack("<4sII", b"glTF", 2, length),
+            struct.pack("<II", len(json_chunk), 0x4E4F534A),  # JSON
+            json_chunk,
+            struct.pack("<II", len(binary), 0x004E4942),  # BIN
+            binary,
+        ]
+    )
+
+
+def write_3dtiles(
+    outdir: str,
+    xyz: np.ndarray,
+    dhdt_slope: np.ndarray,
+    cmap,
+    clim: tuple = (-2.5, 2.5),
+    max_points_per_tile: int = 100_000,
+    include_dhdt: bool = True,
+    max_workers: int = None,
+    region: list = None,
+    changed: np.ndarray = None,
+) -> str:
+    """
+    Write a point cloud as a 3D Tiles tileset, i.e. a quadtree hierarchy of
+    binary point cloud (.pnts) tiles described by a tileset.json manifest.
+
+    Points are sorted along a 2D Morton curve, so every quadtree node covers a
+    contiguous run of points. Nodes holding more than max_points_per_tile
+    points are split into four children. Leaf tiles hold all of their points at
+    full resolution, while each parent tile holds a coarser representative
+    subset of its children (picked with pointcloud.octree_decimate) and is
+    replaced by them when zooming in. Tiles are encoded and written across a
+    process pool.
+
+    Positions are kept in the input coordinates (e.g. EPSG:3031 metres with z
+    up), so a viewer expecting Earth-centred coordinates will need a root
+    transform to be added to the tileset.
+
+    Parameters
+    ----------
+    outdir : str
+        Directory to write tileset.json and the .pnts tiles into.
+    xyz : np.ndarray
+        Array of shape (n, 3) with the point coordinates.
+    dhdt_slope : np.ndarray
+        Array of shape (n,) with the rate of elevation change of each point.
+    cmap : matplotlib.colors.Colormap
+        The colormap used to colour the points, e.g. cmc.vik_r.
+    clim : tuple
+        The (min, max) dhdt_slope values for the colormap. Default is
+        (-2.5, 2.5).
+    max_points_per_tile : int
+        Maximum number of points in any one tile. Default is 100_000.
+    include_dhdt : bool
+        Store dhdt_slope per point in each tile's batch table. Default is True.
+    max_workers : int
+        Number of processes used to write tiles. Default is None which uses
+        all CPU cores.
+    region : list
+        The [xmin, xmax, ymin, ymax] region of the quadtree. Default is None
+        which uses the bounds of the points. Pass a fixed region (e.g. that of
+        a pointcloud.build_dhdt_cache cache) to keep tiles stable over updates.
+    changed : np.ndarray
+        Array of shape (k, 2) with the [first, last + 1) ranges of the Morton
+        codes (in the quadtree region, with 16 bits) of points that changed
+        since the tileset was last written, e.g. from
+        pointcloud.block_code_ranges. Only the tiles that overlap these ranges,
+        or are missing, are rewritten. Default is None which writes all tiles.
+
+    Returns
+    -------
+    tileset : str
+        Filepath to the tileset.json file.
+    """
+    os.makedirs(name=outdir, exist_ok=True)
+    bits: int = 16
+    order: np.ndarray = np.argsort(
+        pointcloud.morton_code(x=xyz[:, 0], y=xyz[:, 1], region=region, bits=bits),
+        kind="stable",
+    )
+    xyz, dhdt_slope = xyz[order], dhdt_slope[order]
+    codes: np.ndarray = pointcloud.morton_code(
+        x=xyz[:, 0], y=xyz[:, 1], region=region, bits=bits
+    )
+    del order
+
+    def _build(name: str, level: int, start: int, stop: int) -> dict:
+        # Recursively split a quadtree node, returning its (unfinished) tile
+        node: dict = dict(name=name, start=start, stop=stop, children=[])
+        if stop - start > max_points_per_tile and level < bits:
+            shift = np.uint64(2 * (bits - level - 1))
+            prefix: int = int(codes[start]) >> (2 * (bits - level))
+            for quadrant in range(4):
+                child = np.uint64((prefix << 2) | quadrant)
+                lo, hi = np.searchsorted(codes, [child << shift, (child + 1) << shift])
+                if hi > lo:
+                    node["children"].append(
+                        _build(f"{name}{quadrant}", level + 1, int(lo), int(hi))
+                    )
+        if node["children"]:
+            # Parent tiles hold a coarse representative sample of their children
+            indices: np.ndarray = np.concatenate(
+                [child["indices"] for child in node["children"]]
+            )
+            keep = pointcloud.octree_decimate(
+                xyz=xyz[indices],
+                dhdt_slope=dhdt_slope[indices],
+                target_points=max_points_per_tile,
+            )
+            node["indices"] = indices[keep]
+        else:
+            node["indices"] = np.arange(start, stop)
+        return node
+
+    root: dict = _build(name="r", level=0, start=0, stop=len(xyz))
+
+    def _walk(node: dict):
+        # Yield the nodes whose tiles need to be (re)written
+        level: int = len(node["name"]) - 1
+        shift: int = 2 * (bits - level)
+        prefix: int = int(node["name"][1:] or "0", base=4)
+        if (
+            changed is None
+            or not os.path.exists(f"{outdir}/{node['name']}.pnts")
+            or np.any(
+                (changed[:, 0] < (prefix + 1) << shift)
+                & (changed[:, 1] > prefix << shift)
+            )
+        ):
+            yield node
+        for child in node["children"]:
+            yield from _walk(child)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures: list = [
+            executor.submit(
+                _write_pnts,
+                filename=f"{outdir}/{node['name']}.pnts",
+                xyz=xyz[node["indices"]],
+                dhdt_slope=dhdt_slope[node["indices"]],
+                cmap=cmap,
+                clim=clim,
+                include_dhdt=include_dhdt,
+            )
+            for node in _walk(root)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+    def _tile(node: dict) -> dict:
+        # Bounding box and geometric error (approximate point spacing) of a tile
+        lowest = xyz[node["start"] : node["stop"]].min(axis=0).astype(np.float64)
+        highest = xyz[node["start"] : node["stop"]].max(axis=0).astype(np.float64)
+        center, half = (lowest + highest) / 2, np.maximum((highest - lowest) / 2, 1)
+        tile: dict = dict(
+            boundingVolume=dict(
+                box=[*center, half[0], 0, 0, 0, half[1], 0, 0, 0, half[2]]
+            ),
+            geometricError=(
+                float(np.hypot(half[0], half[1]) * 2 / np.sqrt(len(node["indices"])))
+                if node["children"]
+                else 0.0
+            ),
+            content=dict(uri=f"{node['name']}.pnts"),
+        )
+        if node["children"]:
+            tile["refine"] = "REPLACE"
+            tile["children"] = [_tile(node=child) for child in node["children"]]
+        return tile
+
+    tileset: dict = dict(asset=dict(version="1.0"), root=_tile(node=root))
+    tileset["geometricError"] = tileset["root"]["geometricError"] * 2
+    with open(file=f"{outdir}/tileset.json", mode="w") as file:
+        json.dump(obj=tileset, fp=file)
+
+    return f"{outdir}/tileset.json"
+
+
+def _write_pnts(
+    filename: str,
+    xyz: np.ndarray,
+    dhdt_slope: np.ndarray,
+    cmap,
+    clim: tuple = (-2.5, 2.5),
+    include_dhdt: bool = True,
+) -> str:
+    """
+    Write one 3D Tiles point cloud (.pnts) tile, with uint16 quantized
+    positions, RGB colours and optionally a float32 dhdt_slope batch table.
+    """
+    lowest: np.ndarray = xyz.min(axis=0).astype(np.float64)
+    extent: np.ndarray = np.maximum(xyz.max(axis=0) - lowest, 1e-6)
+    quantized: np.ndarray = np.round((xyz - lowest) / extent * 65535).astype("<u2")
+    rgb: np.ndarray = colorize(values=dhdt_slope, cmap=cmap, clim=clim)[:, :3]
+
+    def _pad(chunk: bytes, offset: int, fill: bytes) -> bytes:
+        # Pad a chunk so that it ends on an 8-byte boundary of the file
+        return chunk + fill * (-(offset + len(chunk)) % 8)
+
+    feature_binary: bytes = quantized.tobytes()
+    feature_json: dict = dict(
+        POINTS_LENGTH=len(xyz),
+        POSITION_QUANTIZED=dict(byteOffset=0),
+        QUANTIZED_VOLUME_OFFSET=lowest.tolist(),
+        QUANTIZED_VOLUME_SCALE=extent.astype(np.float64).tolist(),
+        RGB=dict(byteOffset=len(feature_binary)),
+    )
+    feature_binary: bytes = _pad(feature_binary + rgb.tobytes(), 0, b"\x00")
+    feature_json: bytes = _pad(json.dumps(feature_json).encode(), 28, b" ")
+
+    batch_json, batch_binary = b"", b""
+    if include_dhdt:
+        batch_binary: bytes = _pad(np.asarray(dhdt_slope, "<f4").tobytes(), 0, b"\x00")
+        batch_json: bytes = _pad(
+            json.dumps(
+                dict(
+                    dhdt_slope=dict(byteOffset=0, componentType="FLOAT", type="SCALAR")
+                )
+            ).encode(),
+            0,
+            b" ",
+        )
+
+    body: bytes = feature_json + feature_binary + batch_json + batch_binary
+    header: bytes = struct.pack(
+        "<4s6I",
+        b"pnts",
+        1,  # version
+        28 + len(body),
+        len(feature_json),
+        len(feature_binary),
+        len(batch_json),
+        len(batch_binary),
+    )
+    with open(file=filename, mode="wb") as file:
+        file.write(header + body)
+    return filename
+
+
+def write_preview(
+    filename: str,
+    cmap,
+    cachedir: str = "df_dhdt_siple_coast_cache",
+    clim: tuple = None,
+    statistic: str = "mean",
+    dhdt_threshold: float = 0.12,
+    width: int = 2000,
+    region: list = None,
+    chunk_size: int = 4_000_000,
+    max_workers: int = None,
+) -> str:
+    """
+    Render a quick top-down PNG preview of a point cloud cache (see
+    pointcloud.build_dhdt_cache), without a VTK render window or a display.
+
+    The points are binned onto a pixel grid in chunks of blocks, which are
+    reduced to per-pixel statistics by worker processes (each reading the
+    memory-mapped cache directly) and merged. The pixels are then coloured
+    with colorize, like the points in write_glb and write_3dtiles, and pixels
+    without points are left transparent.
+
+    Parameters
+    ----------
+    filename : str
+        Filepath to the output PNG image.
+    cmap : matplotlib.colors.Colormap
+        The colormap, e.g. cmc.vik_r.
+    cachedir : str
+        Directory holding the cache.
+    clim : tuple
+        The (min, max) values for the colormap. Default is None which uses
+        (-2.5, 2.5) for the dhdt_slope statistics, and the range of the filled
+        pixel values otherwise.
+    statistic : str
+        Per-pixel statistic to colour by, either 'mean' or 'maxabs' (the
+        dhdt_slope furthest from zero) of dhdt_slope, 'count' of points or
+        'max_z' (the highest z). Default is 'mean'.
+    dhdt_threshold : float
+        Only bin points with abs(dhdt_slope) > dhdt_threshold. Default is
+        0.12, the same as the 3D export. Set to None to bin every point.
+    width : int
+        Width of the image in pixels. The height follows from the aspect ratio
+        of the region, with square pixels. Default is 2000.
+    region : list
+        The [xmin, xmax, ymin, ymax] extent of the image. Default is None which
+        uses the region of the cache, like the 3D Tiles quadtree.
+    chunk_size : int
+        Approximate number of points binned at a time by each worker. Default
+        is 4 million.
+    max_workers : int
+        Number of worker processes. Default is None which uses all CPU cores.
+
+    Returns
+    -------
+    filename : str
+        The filepath to the PNG image.
+    """
+    from PIL import Image
+
+    if statistic not in ("mean", "maxabs", "count", "max_z"):
+        raise ValueError(f"Unknown statistic {statistic!r}")
+    region: list = region or pointcloud.cache_metadata(cachedir=cachedir)["region"]
+    xmin, xmax, ymin, ymax = region
+    pixel: float = (xmax - xmin) / width
+    shape: tuple = (max(int(np.ceil((ymax - ymin) / pixel)), 1), width)
+
+    # Group the blocks that could have points to bin into chunks
+    blocks: np.ndarray = np.load(file=f"{cachedir}/blocks.npy")
+    keep: np.ndarray = (
+        (blocks["xmax"] >= xmin)
+        & (blocks["xmin"] <= xmax)
+        & (blocks["ymax"] >= ymin)
+        & (blocks["ymin"] <= ymax)
+    )
+    if dhdt_threshold is not None:
+        keep &= (blocks["dhdt_min"] < -dhdt_threshold) | (
+            blocks["dhdt_max"] > dhdt_threshold
+        )
+    blocks = blocks[keep]
+    chunk_ids: np.ndarray = (
+        np.cumsum(blocks["stop"] - blocks["start"]) - 1
+    ) // chunk_size
+    chunks: list = [
+        list(zip(blocks["start"][chunk_ids == i], blocks["stop"][chunk_ids == i]))
+        for i in np.unique(chunk_ids)
+    ]
+
+    count = np.zeros(shape=shape[0] * shape[1], dtype=np.int64)
+    value = np.full(shape=shape[0] * shape[1], fill_value=np.nan)
+    max_workers: int = max_workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Bin chunks in parallel, keeping a bounded number of them in flight
+        pending: set = set()
+        for slices in chunks:
+            if len(pending) >= 2 * max_workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    _merge_preview(count, value, *future.result(), statistic)
+            pending.add(
+                executor.submit(
+                    _bin_preview,
+                    cachedir=cachedir,
+                    slices=slices,
+                    region=region,
+                    shape=shape,
+                    dhdt_threshold=dhdt_threshold,
+                    statistic=statistic,
+                )
+            )
+        for future in concurrent.futures.as_completed(pending):
+            _merge_preview(count, value, *future.result(), statistic)
+
+    if statistic == "count":
+        value = np.where(count > 0, count, np.nan)
+    elif statistic == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            value /= count
+    filled: np.ndarray = count > 0
+    if clim is None and statistic in ("mean", "maxabs"):
+        clim = (-2.5, 2.5)
+    elif clim is None and filled.any():
+        clim = (np.nanmin(value[filled]), np.nanmax(value[filled]))
+        if clim[0] == clim[1]:  # a single value, colour it mid-colormap
+            clim = (clim[0] - 0.5, clim[1] + 0.5)
+
+    # Pixels without points stay transparent (and an empty preview is blank)
+    rgba: np.ndarray = np.zeros(shape=(len(value), 4), dtype=np.uint8)
+    if filled.any():
+        rgba[filled] = colorize(values=value[filled], cmap=cmap, clim=clim)
+    Image.fromarray(obj=rgba.reshape(*shape, 4), mode="RGBA").save(fp=filename)
+    return filename
+
+
+def _bin_preview(
+    cachedir: str,
+    slices: list,
+    region: list,
+    shape: tuple,
+    dhdt_threshold: float,
+    statistic: str,
+) -> (np.ndarray, np.ndarray):
+    """
+    Bin the points in some (start, stop) slices of a point cloud cache onto a
+    pixel grid (with row 0 at the top), returning the per-pixel point count
+    and either the sum of dhdt_slope ('mean'), the dhdt_slope furthest from
+    zero ('maxabs') or the highest z ('max_z').
+    """
+    xyz: np.memmap = np.load(file=f"{cachedir}/xyz.npy", mmap_mode="r")
+    dhdt: np.memmap = np.load(file=f"{cachedir}/dhdt_slope.npy", mmap_mode="r")
+    ny, nx = shape
+    xmin, xmax, ymin, ymax = region
+    pixel: float = (xmax - xmin) / nx
+
+    count = np.zeros(shape=ny * nx, dtype=np.int64)
+    value = np.full(shape=ny * nx, fill_value=np.nan)
+    for start, stop in slices:
+        _xyz: np.ndarray = xyz[start:stop]
+        _dhdt: np.ndarray = dhdt[start:stop]
+        ix: np.ndarray = ((_xyz[:, 0] - xmin) / pixel).astype(np.int64)
+        iy: np.ndarray = ((ymax - _xyz[:, 1]) / pixel).astype(np.int64)
+        mask: np.ndarray = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        # (points just left of or above the image would truncate to pixel 0)
+        mask &= (_xyz[:, 0] >= xmin) & (_xyz[:, 1] <= ymax)
+        if dhdt_threshold is not None:
+            mask &= np.abs(_dhdt) > dhdt_threshold
+        cells: np.ndarray = iy[mask] * nx + ix[mask]
+
+        _count: np.ndarray = np.bincount(cells, minlength=ny * nx)
+        if statistic == "mean":
+            _value: np.ndarray = np.bincount(
+                cells, weights=_dhdt[mask], minlength=ny * nx
+            )
+        elif statistic in ("maxabs", "max_z"):
+            values: np.ndarray = _dhdt[mask] if statistic == "maxabs" else _xyz[mask, 2]
+            keys: np.ndarray = np.abs(values) if statistic == "maxabs" else values
+            # Sort by cell and then key, so the last point of each cell has the
+            # largest key
+            order: np.ndarray = np.lexsort(keys=(keys, cells))
+            last: np.ndarray = order[
+                np.flatnonzero(np.diff(cells[order], append=np.iinfo(np.int64).max))
+            ]
+            _value = np.full(shape=ny * nx, fill_value=np.nan)
+            _value[cells[last]] = values[last]
+        else:
+            _value = None
+        _merge_preview(count, value, _count, _value, statistic)
+
+    return count, value
+
+
+def _merge_preview(
+    count: np.ndarray,
+    value: np.ndarray,
+    _count: np.ndarray,
+    _value: np.ndarray,
+    statistic: str,
+):
+    """
+    Merge partial per-pixel counts and statistics (see _bin_preview) into the
+    running totals in place.
+    """
+    count += _count
+    if statistic == "mean":
+        value[:] = np.nansum([value, _value], axis=0)
+    elif statistic == "maxabs":
+        replace: np.ndarray = ~(np.abs(value) >= np.abs(_value))
+        replace &= ~np.isnan(_value)
+        value[replace] = _value[replace]
+    elif statistic == "max_z":
+        value[:] = np.fmax(value, _value)
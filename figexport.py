@@ -0,0 +1,148 @@
+"""
+Export a PyGMT figure to several file formats and resolutions at once.
+
+Rather than running one full PostScript conversion per pygmt.Figure.savefig
+call, the PostScript is finalised (to a cropped PDF) once with GMT psconvert.
+Each raster resolution is then rendered from that PDF by its own Ghostscript
+process, concurrently, and outputs that only differ in file format, or (if
+allowed) in having a lower resolution, are derived from an already rendered
+raster instead.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pygmt
+from PIL import Image
+
+
+def export_figure(
+    fig: pygmt.Figure,
+    outputs: list,
+    downsample: bool = False,
+    max_workers: int = None,
+) -> dict:
+    """
+    Save a figure to each of a list of output files.
+
+    Parameters
+    ----------
+    fig : pygmt.Figure
+        The figure to save.
+    outputs : list
+        List of (fname, dpi) tuples, e.g. [("map.pdf", None), ("map.png", 600)].
+        The format is taken from the file extension, which can be pdf, or any
+        raster format supported by Pillow (e.g. png, jpg, tif).
+    downsample : bool
+        If True, render only the highest resolution raster with Ghostscript,
+        and derive lower resolution outputs by downsampling it with a Lanczos
+        filter. Faster, but small text may look slightly different. Default is
+        False, which renders every resolution separately.
+    max_workers : int
+        Number of concurrent conversions. Default is None which lets
+        concurrent.futures decide.
+
+    Returns
+    -------
+    timings : dict
+        Mapping of each output fname to the time in seconds spent making it,
+        including the rendering of the raster it was derived from, plus a
+        'total' wall clock time.
+    """
+    start: float = time.perf_counter()
+    timings: dict = {}
+    vector: list = [f for f, _ in outputs if f.lower().endswith(".pdf")]
+    rasters: list = [(f, dpi) for f, dpi in outputs if f not in vector]
+    if downsample and rasters:
+        render_dpis: set = {max(dpi for _, dpi in rasters)}
+    else:
+        render_dpis: set = {dpi for _, dpi in rasters}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Finalise the PostScript once, as a cropped PDF
+        fig.psconvert(prefix=os.path.join(tmpdir, "figure"), fmt="f", crop=True)
+        pdf: str = os.path.join(tmpdir, "figure.pdf")
+        finalise: float = time.perf_counter() - start
+        for fname in vector:
+            shutil.copyfile(src=pdf, dst=fname)
+            timings[fname] = finalise
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            renders: dict = {
+                pool.submit(
+                    _rasterize,
+                    pdf=pdf,
+                    outfile=os.path.join(tmpdir, f"figure-{dpi}.png"),
+                    dpi=dpi,
+                ): dpi
+                for dpi in render_dpis
+            }
+            conversions: dict = {}
+            for render in concurrent.futures.as_completed(renders):
+                source_dpi: int = renders[render]
+                source, seconds = render.result()
+                for fname, dpi in rasters:
+                    if dpi == source_dpi or (downsample and dpi < source_dpi):
+                        future = pool.submit(
+                            _convert,
+                            source=source,
+                            source_dpi=source_dpi,
+                            fname=fname,
+                            dpi=dpi,
+                        )
+                        conversions[future] = (fname, finalise + seconds)
+            for future in concurrent.futures.as_completed(conversions):
+                fname, seconds = conversions[future]
+                timings[fname] = seconds + future.result()
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def _rasterize(pdf: str, outfile: str, dpi: int) -> (str, float):
+    """
+    Render a PDF to a PNG at a given dpi with Ghostscript, anti-aliased like
+    pygmt.Figure.savefig. Returns the PNG filepath and the time taken.
+    """
+    tic: float = time.perf_counter()
+    subprocess.run(
+        args=[
+            "gs",
+            "-q",
+            "-dSAFER",
+            "-dBATCH",
+            "-dNOPAUSE",
+            "-sDEVICE=png16m",
+            f"-r{dpi}",
+            "-dTextAlphaBits=2",
+            "-dGraphicsAlphaBits=2",
+            f"-sOutputFile={outfile}",
+            pdf,
+        ],
+        check=True,
+    )
+    return outfile, time.perf_counter() - tic
+
+
+def _convert(source: str, source_dpi: int, fname: str, dpi: int) -> float:
+    """
+    Save a rendered PNG raster to another format and/or a lower dpi. Returns
+    the time taken.
+    """
+    tic: float = time.perf_counter()
+    if dpi == source_dpi and fname.lower().endswith(".png"):
+        shutil.copyfile(src=source, dst=fname)
+    else:
+        with Image.open(fp=source) as image:
+            if dpi != source_dpi:
+                size: tuple = tuple(round(n * dpi / source_dpi) for n in image.size)
+                image = image.resize(size=size, resample=Image.LANCZOS)
+            kwargs: dict = (
+                dict(quality=90) if fname.lower().endswith((".jpg", ".jpeg")) else {}
+            )
+            image.convert(mode="RGB").save(fp=fname, dpi=(dpi, dpi), **kwargs)
+    return time.perf_counter() - tic
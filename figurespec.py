@@ -0,0 +1,402 @@
+"""
+A small declarative format for describing a PyGMT figure as a list of layers,
+and a build engine that only re-renders what has changed since the last build.
+
+Each layer is one pygmt.Figure method call (e.g. basemap, grdimage, plot, text)
+with its keyword arguments and optional pygmt.config settings. Intermediate
+products (e.g. cut rasters, label files) are declared as functions whose inputs
+may be other products, and are run as a dependency graph. Everything is keyed
+by a hash of its inputs, so that unchanged products and figure outputs are
+reused from a cache, and raster outputs can resume from a snapshot of the
+longest unchanged run of layers.
+"""
+
+import contextlib
+import graphlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import types
+
+import pygmt
+
+import figexport
+import gmtvector
+import mapdata
+
+
+class Product:
+    """
+    Placeholder for the output filepath of an intermediate product, which can
+    be passed as an input to other products or to figure layers.
+    """
+
+    def __init__(self, name: str, function, kwargs: dict):
+        self.name: str = name
+        self.function = function
+        self.kwargs: dict = kwargs
+
+    def __repr__(self) -> str:
+        return f"Product({self.name!r})"
+
+    @property
+    def dependencies(self) -> list:
+        return [p for p in _walk(self.kwargs) if isinstance(p, Product)]
+
+
+class FigureSpec:
+    """
+    Declarative description of a PyGMT figure.
+
+    Parameters
+    ----------
+    name : str
+        Name of the figure, used to label cached files.
+    region : list
+        The [xmin, xmax, ymin, ymax] region of the main map. Required (with
+        projection) to resume raster outputs from a snapshot of earlier layers.
+    projection : str
+        The GMT projection string of the main map, e.g. x1:5000000.
+    cachedir : str
+        Directory to store cached products, snapshots and outputs in. Default
+        is a 'cache' folder under the DATAHOME environment variable (or
+        ./Quantarctica3).
+
+    Examples
+    --------
+    >>> spec = FigureSpec(name="demo", region=[0, 10, 0, 10], projection="X5c")
+    >>> spec.layer("basemap", frame=True, checkpoint=True)
+    >>> spec.layer("text", x=5, y=5, text="Hello")
+    >>> spec.build(outputs=[("demo.png", 300)])
+    """
+
+    def __init__(
+        self,
+        name: str,
+        region: list = None,
+        projection: str = None,
+        cachedir: str = os.path.join(
+            os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"), "cache"
+        ),
+    ):
+        self.name: str = name
+        self.region: list = region
+        self.projection: str = projection
+        self.cachedir: str = cachedir
+        self.products: dict = {}
+        self.layers: list = []
+        self._results: dict = {}
+        self.timings: dict = {}
+
+    def product(self, name: str, function, **kwargs) -> Product:
+        """
+        Declare an intermediate product, made by calling function(**kwargs).
+        The function should return a filepath. Any Product in the kwargs is
+        replaced by its filepath before the call.
+        """
+        self.products[name] = Product(name=name, function=function, kwargs=kwargs)
+        return self.products[name]
+
+    def layer(
+        self, method: str, config: dict = None, checkpoint: bool = False, **kwargs
+    ):
+        """
+        Append a layer that calls pygmt.Figure.method(**kwargs), optionally
+        within pygmt.config(**config). Set checkpoint=True to snapshot raster
+        builds after this layer, typically after the slow base layers.
+
+        For method='inset', pass a layers=[(method, kwargs), ...] list of the
+        layers to plot inside the inset.
+        """
+        self.layers.append(
+            dict(
+                method=method, config=config or {}, checkpoint=checkpoint, kwargs=kwargs
+            )
+        )
+
+    def resolve(self) -> dict:
+        """
+        Make every declared product in dependency order, reusing those whose
+        function source code (including the local modules it calls) and inputs
+        are unchanged since they were last made, and whose output file is still
+        the one that was made. Returns a dictionary mapping product names to
+        their output filepaths.
+        """
+        os.makedirs(name=self.cachedir, exist_ok=True)
+        manifest_file: str = os.path.join(self.cachedir, "figurespec_products.json")
+        try:
+            with open(file=manifest_file) as file:
+                manifest: dict = json.load(fp=file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest: dict = {}
+
+        graph = graphlib.TopologicalSorter(
+            {p: p.dependencies for p in self.products.values()}
+        )
+        for product in graph.static_order():
+            kwargs: dict = self._substitute(product.kwargs)
+            key: str = mapdata.cache_key(
+                product.name, _source(product.function), kwargs
+            )
+            entry = manifest.get(key)
+            if _is_current(entry):
+                result: str = entry["path"]
+            else:
+                result = product.function(**kwargs)
+                if isinstance(result, str):
+                    # Key on the inputs both before and after the call, in
+                    # case one of them is the output file it has just written,
+                    # and record the output's contents to check it on reuse
+                    after: str = mapdata.cache_key(
+                        product.name, _source(product.function), kwargs
+                    )
+                    manifest[key] = manifest[after] = dict(
+                        path=result, content=mapdata.cache_key(result)
+                    )
+            self._results[product] = result
+
+        # Replace the manifest atomically, as several processes may share it
+        with open(file=f"{manifest_file}.{os.getpid()}", mode="w") as file:
+            json.dump(obj=manifest, fp=file, indent=1)
+        os.replace(src=f"{manifest_file}.{os.getpid()}", dst=manifest_file)
+
+        return {p.name: self._results[p] for p in self.products.values()}
+
+    def keys(self) -> list:
+        """
+        Hash every layer, chained onto the hash of the layer before it, so that
+        a change to one layer also changes the keys of all layers after it.
+        """
+        keys: list = []
+        key: str = mapdata.cache_key(self.name, self.region, self.projection)
+        for layer in self.layers:
+            key = mapdata.cache_key(key, self._substitute(layer))
+            keys.append(key)
+        return keys
+
+    def build(self, outputs: list = ()) -> pygmt.Figure:
+        """
+        Render the figure and save it to each of the (fname, dpi) outputs (use a
+        dpi of None for vector formats like PDF).
+
+        Outputs whose layers are all unchanged are copied from the cache.
+        Otherwise, raster-only builds at a single dpi resume from the snapshot
+        of the last unchanged checkpoint layer, and only the layers after it are
+        re-rendered. The outputs are saved concurrently by
+        figexport.export_figure, with the time spent on each kept in
+        self.timings. Returns the rendered figure, or None if nothing changed.
+        """
+        self.resolve()
+        keys: list = self.keys()
+        cached: dict = {
+            fname: os.path.join(
+                self.cachedir,
+                f"{self.name}-{keys[-1]}-{dpi}{os.path.splitext(fname)[-1]}",
+            )
+            for fname, dpi in outputs
+        }
+        if outputs and all(os.path.exists(f) for f in cached.values()):
+            for fname, _ in outputs:
+                shutil.copyfile(src=cached[fname], dst=fname)
+            self.timings = {}
+            return None
+
+        # Snapshots only help raster outputs that all share the same dpi
+        dpis: set = {dpi for _, dpi in outputs}
+        snapshot_dpi: int = (
+            dpis.pop()
+            if len(dpis) == 1 and None not in dpis and self.region and self.projection
+            else None
+        )
+        fig: pygmt.Figure = self._draw(keys=keys, snapshot_dpi=snapshot_dpi)
+
+        timings: dict = figexport.export_figure(
+            fig=fig, outputs=[(cached[fname], dpi) for fname, dpi in outputs]
+        )
+        self.timings = {fname: timings[cached[fname]] for fname, _ in outputs}
+        self.timings["total"] = timings["total"]
+        for fname, _ in outputs:
+            shutil.copyfile(src=cached[fname], dst=fname)
+
+        return fig
+
+    def snapshot(self, dpi: int) -> str:
+        """
+        Render all of the layers to a georeferenced PNG snapshot at a dpi, or
+        reuse the cached one, and return its filepath. It can be drawn back as
+        a static base under other layers (e.g. the frames of an animation) with
+        grdimage(grid=snapshot, region=self.region, projection=self.projection),
+        so it should only contain layers inside the map frame.
+        """
+        if not (self.region and self.projection):
+            raise ValueError("A snapshot needs the FigureSpec region and projection.")
+        self.resolve()
+        keys: list = self.keys()
+        prefix: str = self._snapshot_prefix(key=keys[-1], dpi=dpi)
+        if not os.path.exists(f"{prefix}.png"):
+            fig: pygmt.Figure = self._draw(keys=keys, snapshot_dpi=dpi)
+            if not os.path.exists(f"{prefix}.png"):
+                fig.psconvert(prefix=prefix, fmt="g", dpi=dpi, crop=True, W=True)
+        return f"{prefix}.png"
+
+    def show(self, dpi: int = 150):
+        """
+        Preview the figure in a Jupyter notebook, via a (cached) PNG image.
+        """
+        from IPython.display import Image, display
+
+        preview: str = os.path.join(self.cachedir, f"{self.name}-preview.png")
+        self.build(outputs=[(preview, dpi)])
+        display(Image(filename=preview))
+
+    def _draw(self, keys: list, snapshot_dpi: int = None) -> pygmt.Figure:
+        """
+        Render the layers onto a new figure. If a snapshot_dpi is given, resume
+        from the snapshot of the last checkpoint layer that has one, and
+        snapshot the checkpoint layers rendered after it.
+        """
+        snapshots: list = [
+            self._snapshot_prefix(key=key, dpi=snapshot_dpi) for key in keys
+        ]
+        fig = pygmt.Figure()
+        start: int = 0
+        if snapshot_dpi:
+            for i in reversed(range(len(self.layers))):
+                if self.layers[i]["checkpoint"] and os.path.exists(
+                    f"{snapshots[i]}.png"
+                ):
+                    fig.grdimage(
+                        grid=f"{snapshots[i]}.png",
+                        region=self.region,
+                        projection=self.projection,
+                    )
+                    start = i + 1
+                    break
+
+        for i, layer in enumerate(self.layers[start:], start=start):
+            _render(fig=fig, layer=self._substitute(layer))
+            if snapshot_dpi and layer["checkpoint"]:
+                fig.psconvert(
+                    prefix=snapshots[i], fmt="g", dpi=snapshot_dpi, crop=True, W=True
+                )
+        return fig
+
+    def _snapshot_prefix(self, key: str, dpi: int) -> str:
+        return os.path.join(self.cachedir, f"{self.name}-{key}-{dpi}-snapshot")
+
+    def _substitute(self, obj):
+        """
+        Replace any Product in a (nested) layer or kwargs with its filepath.
+        """
+        if isinstance(obj, Product):
+            return self._results[obj]
+        if isinstance(obj, dict):
+            return {k: self._substitute(v) for k, v in obj.items()}
+        if isinstance(obj, (tuple, list)):
+            return type(obj)(self._substitute(v) for v in obj)
+        return obj
+
+
+def _render(fig: pygmt.Figure, layer: dict):
+    """
+    Plot one layer onto a figure.
+    """
+    kwargs: dict = dict(layer["kwargs"])
+    config = pygmt.config(**layer["config"]) if layer["config"] else None
+    with config or contextlib.nullcontext():
+        if layer["method"] == "inset":
+            sublayers: list = kwargs.pop("layers")
+            with fig.inset(**kwargs):
+                for method, subkwargs in sublayers:
+                    getattr(fig, method)(**subkwargs)
+        elif layer["method"] == "plot":
+            gmtvector.plot(fig, **kwargs)
+        else:
+            getattr(fig, layer["method"])(**kwargs)
+
+
+def _is_current(entry) -> bool:
+    """
+    Check that a product manifest entry's output file still exists and has not
+    been overwritten since it was made, e.g. by the same product with other
+    inputs writing to the same filepath.
+    """
+    return (
+        isinstance(entry, dict)
+        and os.path.exists(entry["path"])
+        and mapdata.cache_key(entry["path"]) == entry["content"]
+    )
+
+
+def _source(function) -> list:
+    """
+    Identify a function by its source code, and the files of the local modules
+    (next to this one) that it uses directly or through other local modules,
+    so that edits to any of them are picked up (see mapdata.cache_key).
+    """
+    try:
+        source: str = inspect.getsource(function)
+    except (OSError, TypeError):
+        source: str = f"{function.__module__}.{function.__qualname__}"
+    return [source, *sorted(module.__file__ for module in _local_modules(function))]
+
+
+def _local_modules(function) -> set:
+    """
+    Find the local modules that a function refers to by name (including its
+    own), and the local modules that those import, recursively. The __main__
+    script or notebook is left out, as the function's own source covers its
+    part of it, and unrelated edits elsewhere in it should not invalidate it.
+    """
+    names: set = set()
+    codes: list = [getattr(function, "__code__", None)]
+    while codes:
+        code = codes.pop()
+        if isinstance(code, types.CodeType):
+            names.update(code.co_names)
+            codes.extend(code.co_consts)
+    namespace: dict = getattr(function, "__globals__", {})
+    pending: list = [namespace[name] for name in names if name in namespace]
+    pending.append(sys.modules.get(getattr(function, "__module__", None)))
+
+    modules: set = set()
+    while pending:
+        obj = pending.pop()
+        module = obj if isinstance(obj, types.ModuleType) else None
+        if module is None and isinstance(obj, (types.FunctionType, type)):
+            module = sys.modules.get(obj.__module__)
+        if (
+            module is None
+            or module in modules
+            or module.__name__ == "__main__"
+            or not _is_local(module)
+        ):
+            continue
+        modules.add(module)
+        pending.extend(vars(module).values())
+    return modules
+
+
+def _is_local(module: types.ModuleType) -> bool:
+    """
+    Whether a module is one of this repository's, i.e. next to this one.
+    """
+    filename: str = getattr(module, "__file__", None)
+    return filename is not None and os.path.dirname(
+        os.path.abspath(filename)
+    ) == os.path.dirname(os.path.abspath(__file__))
+
+
+def _walk(obj):
+    """
+    Yield every item in a nested structure of dicts, lists and tuples.
+    """
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (tuple, list)):
+        for item in obj:
+            yield from _walk(item)
+    else:
+        yield obj
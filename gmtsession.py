@@ -0,0 +1,57 @@
+"""
+Worker process pools for rendering with GMT in parallel, as used by atlas.py
+and animation.py.
+
+GMT keeps the state of a modern mode session (e.g. the current figure) in a
+session directory named after the parent process id by default, which all of
+the worker processes of a pool would share. So workers are started with the
+'spawn' method, from a fresh interpreter that has not started a GMT session
+yet, and each names its own session before importing pygmt. Modules that are
+used by the workers should therefore import pygmt (and the modules that use
+it) inside their functions.
+
+Usage:
+
+    with gmtsession.process_pool(max_workers=4, name="atlas") as executor:
+        futures: list = [executor.submit(render, region=r) for r in regions]
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+
+
+def process_pool(
+    max_workers: int = None, name: str = "gmt"
+) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Create a pool of spawned worker processes, each with its own GMT session.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of worker processes. Default is None which lets
+        concurrent.futures decide.
+    name : str
+        Prefix of the GMT session names, followed by each worker's process id.
+        Default is 'gmt'.
+
+    Returns
+    -------
+    executor : concurrent.futures.ProcessPoolExecutor
+        The pool, to be used as a context manager.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=start_session,
+        initargs=(name,),
+    )
+
+
+def start_session(name: str = "gmt"):
+    """
+    Give this worker process its own GMT session directory, named after its
+    process id. Must be called before pygmt is imported in the process.
+    """
+    os.environ["GMT_SESSION_NAME"] = f"{name}{os.getpid()}"
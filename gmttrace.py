@@ -0,0 +1,303 @@
+"""
+Opt-in tracing of the PyGMT calls that make up a figure.
+
+While a Tracer is running, every pygmt.Figure plotting method (e.g. grdimage,
+plot, coast, text, colorbar, legend, savefig), every GMT module call (including
+raw lib.call_module calls like grdmath) and every virtual file of in-memory
+data passed to GMT is recorded, with its wall time, the bytes of data passed
+in (e.g. GeoDataFrame geometries) and the peak resident set size of the process
+so far. The calls are saved as a Chrome trace (viewable in chrome://tracing or
+https://ui.perfetto.dev), and summarised per figure in a table.
+
+Recording an event costs a few microseconds, against the milliseconds to
+seconds that a GMT call takes, so the tracer can be left on. The exception is
+the first time a GeoDataFrame is passed to GMT, when its geometries are
+measured once (which takes time in proportion to their number of vertices),
+and cached for later calls.
+
+Usage:
+
+    tracer = gmttrace.Tracer()
+    tracer.start()
+    tracer.section("Siple Coast")
+    ...
+    tracer.stop()
+    tracer.save("key_figure_trace.json")
+    print(tracer.summary())
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import weakref
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pygmt
+import xarray as xr
+
+FIGURE_METHODS: tuple = (
+    "basemap",
+    "coast",
+    "colorbar",
+    "contour",
+    "grdcontour",
+    "grdimage",
+    "grdview",
+    "histogram",
+    "image",
+    "legend",
+    "logo",
+    "meca",
+    "plot",
+    "plot3d",
+    "psconvert",
+    "rose",
+    "savefig",
+    "show",
+    "solar",
+    "text",
+    "velo",
+    "wiggle",
+)
+VIRTUALFILE_METHODS: tuple = (
+    "virtualfile_from_data",
+    "virtualfile_from_grid",
+    "virtualfile_from_matrix",
+    "virtualfile_from_vectors",
+)
+
+# Sizes of the GeoDataFrames measured so far, keyed by their id, with a weak
+# reference to check that the GeoDataFrame is the one that was measured
+_NBYTES: dict = {}
+
+
+class Tracer:
+    """
+    Record the PyGMT calls made between start() and stop() (or within a with
+    block), see the module docstring.
+
+    Parameters
+    ----------
+    figure_methods : tuple
+        Names of the pygmt.Figure methods to trace. Default is FIGURE_METHODS.
+    """
+
+    _active = None
+
+    def __init__(self, figure_methods: tuple = FIGURE_METHODS):
+        self.figure_methods: tuple = figure_methods
+        self.events: list = []
+        self.current_section: str = None
+        self._patches: list = []
+        self._local = threading.local()
+        self._origin: float = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """
+        Start tracing, by wrapping the pygmt.Figure methods, the GMT module
+        call and the virtual file functions. Only one tracer can run at a time.
+        """
+        if Tracer._active is not None:
+            raise RuntimeError("Another Tracer is already running, stop it first.")
+        Tracer._active = self
+        for name in self.figure_methods:
+            if hasattr(pygmt.Figure, name):
+                self._patch(pygmt.Figure, name, self._wrap_figure_method)
+        self._patch(pygmt.clib.Session, "call_module", self._wrap_call_module)
+        for name in VIRTUALFILE_METHODS:
+            if hasattr(pygmt.clib.Session, name):
+                self._patch(pygmt.clib.Session, name, self._wrap_virtualfile)
+        return self
+
+    def stop(self):
+        """
+        Stop tracing, restoring the original PyGMT functions.
+        """
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches.clear()
+        if Tracer._active is self:
+            Tracer._active = None
+        return self
+
+    def section(self, name: str):
+        """
+        Attribute the calls from now on to a named section of the script,
+        typically one per figure, for the summary table.
+        """
+        self.current_section = name
+
+    def save(self, filename: str = "gmt_trace.json") -> str:
+        """
+        Save the recorded calls to a Chrome trace event JSON file.
+        """
+        with open(file=filename, mode="w") as file:
+            json.dump(obj=dict(traceEvents=self.events, displayTimeUnit="ms"), fp=file)
+        return filename
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Summarise the recorded calls per section and call name, with the number
+        of calls, total seconds, megabytes of data passed in and the peak RSS in
+        megabytes. Nested calls (e.g. the GMT module call made by a
+        pygmt.Figure method) are listed on their own rows.
+        """
+        df: pd.DataFrame = pd.DataFrame(
+            data=[
+                dict(
+                    section=event["args"]["section"],
+                    category=event["cat"],
+                    name=event["name"],
+                    seconds=event["dur"] / 1e6,
+                    mb_in=event["args"]["bytes_in"] / 2**20,
+                    max_rss_mb=event["args"]["max_rss_mb"],
+                )
+                for event in self.events
+            ],
+            columns=["section", "category", "name", "seconds", "mb_in", "max_rss_mb"],
+        )
+        return (
+            df.fillna(value=dict(section=""))
+            .groupby(by=["section", "category", "name"], sort=False)
+            .agg(
+                calls=("seconds", "size"),
+                seconds=("seconds", "sum"),
+                mb_in=("mb_in", "sum"),
+                max_rss_mb=("max_rss_mb", "max"),
+            )
+            .round(3)
+        )
+
+    @contextlib.contextmanager
+    def _record(self, name: str, category: str, nbytes: int = 0, **args):
+        """
+        Time a call and append it as a Chrome trace complete ('X') event.
+        Bytes passed in are also added to the calls it is nested within.
+        """
+        stack: list = self._stack()
+        event: dict = dict(
+            name=name,
+            cat=category,
+            ph="X",
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+            args=dict(section=self.current_section, bytes_in=0, **args),
+        )
+        stack.append(event)
+        self._add_bytes(nbytes=nbytes)
+        tic: float = time.perf_counter()
+        try:
+            yield event
+        finally:
+            toc: float = time.perf_counter()
+            stack.pop()
+            event["ts"] = round((tic - self._origin) * 1e6, 1)
+            event["dur"] = round((toc - tic) * 1e6, 1)
+            event["args"]["max_rss_mb"] = round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1
+            )
+            self.events.append(event)
+
+    def _stack(self) -> list:
+        """
+        The calls currently being recorded in this thread, outermost first.
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.virtualfile_depth = 0
+        return self._local.stack
+
+    def _add_bytes(self, nbytes: int):
+        for event in self._stack():
+            event["args"]["bytes_in"] += nbytes
+
+    def _patch(self, owner, name: str, wrapper):
+        original = getattr(owner, name)
+        self._patches.append((owner, name, original))
+        setattr(owner, name, functools.wraps(original)(wrapper(original)))
+
+    def _wrap_figure_method(self, original):
+        tracer = self
+
+        def method(fig, *args, **kwargs):
+            with tracer._record(
+                name=original.__name__, category="figure", figure=fig._name
+            ):
+                return original(fig, *args, **kwargs)
+
+        return method
+
+    def _wrap_call_module(self, original):
+        tracer = self
+
+        def call_module(lib, module, args):
+            with tracer._record(
+                name=f"gmt {module}", category="module", command=str(args)[:200]
+            ):
+                return original(lib, module, args)
+
+        return call_module
+
+    def _wrap_virtualfile(self, original):
+        tracer = self
+
+        @contextlib.contextmanager
+        def virtualfile(lib, *args, **kwargs):
+            # Virtual file functions call each other (e.g. virtualfile_from_data
+            # uses virtualfile_from_vectors), so only count the outermost one
+            tracer._stack()
+            local = tracer._local
+            nbytes: int = 0
+            if local.virtualfile_depth == 0:
+                nbytes = sum(map(_nbytes, (*args, *kwargs.values())))
+            with tracer._record(
+                name=original.__name__, category="data", nbytes=nbytes
+            ), contextlib.ExitStack() as stack:
+                local.virtualfile_depth += 1
+                try:
+                    vfile: str = stack.enter_context(original(lib, *args, **kwargs))
+                finally:
+                    local.virtualfile_depth -= 1
+                yield vfile
+
+        return virtualfile
+
+
+def _nbytes(data) -> int:
+    """
+    Approximate size in bytes of data passed to GMT in memory. Geometries are
+    counted by their WKB size, which is dominated by 16 bytes per vertex, once
+    per GeoDataFrame (so a GeoDataFrame modified in place after being measured
+    keeps its old size). Filenames and other arguments count as 0.
+    """
+    if isinstance(data, gpd.GeoDataFrame):
+        key: int = id(data)
+        if key in _NBYTES and _NBYTES[key][0]() is data:
+            return _NBYTES[key][1]
+        attributes: pd.DataFrame = data.drop(columns=data.geometry.name)
+        nbytes: int = int(
+            data.geometry.to_wkb().map(len).sum()
+            + attributes.memory_usage(deep=True).sum()
+        )
+        _NBYTES[key] = (weakref.ref(data), nbytes)
+        weakref.finalize(data, _NBYTES.pop, key, None)
+        return nbytes
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return int(np.sum(data.memory_usage(deep=True)))
+    if isinstance(data, (np.ndarray, xr.DataArray)):
+        return int(data.nbytes)
+    if isinstance(data, (list, tuple)):
+        return sum(map(_nbytes, data))
+    return 0
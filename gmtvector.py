@@ -0,0 +1,156 @@
+"""
+Plot GeoDataFrames of lines and polygons with GMT through in-memory virtual
+files, instead of the temporary OGR text file that pygmt.Figure.plot writes
+for every call.
+
+The geometries are converted once into a packed float64 (x, y) coordinate
+buffer, with a NaN record between each ring or line (which GMT reads as a
+segment header), and an optional per-segment Z value column (passed to GMT
+plot -Z, e.g. for color="+z"). The packed buffers are cached per GeoDataFrame,
+so plotting the same layer again (in another figure, or a preview) skips the
+conversion.
+
+Usage:
+
+    gmtvector.plot(fig, data=gdf_lakes, pen="thinnest", cmap="cmap_dhdt.cpt",
+                   color="+z", close=True, aspatial="Z=inner_dhdt")
+"""
+
+import contextlib
+import weakref
+
+import geopandas as gpd
+import numpy as np
+import pygmt
+from pygmt.helpers import build_arg_string, kwargs_to_strings, use_alias
+
+# Packed buffers, keyed by the id of the GeoDataFrame and the Z column, with a
+# weak reference to check that the GeoDataFrame is the one that was packed
+_CACHE: dict = {}
+
+
+def pack(gdf: gpd.GeoDataFrame, zcolumn: str = None) -> dict:
+    """
+    Convert the line and polygon geometries of a GeoDataFrame into packed
+    numpy buffers for GMT.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        The (Multi)LineString and (Multi)Polygon geometries to convert.
+    zcolumn : str
+        Name of an attribute column to give a Z value to each segment (i.e.
+        every ring or line of a feature), e.g. 'inner_dhdt'. Default is None.
+
+    Returns
+    -------
+    packed : dict
+        With 'coords', a C-contiguous float64 array of shape (n, 2) with the
+        vertices of every segment separated by all-NaN records, 'z', a float64
+        array of each segment's Z value (or None), and 'holes', whether any
+        polygon has interior rings.
+    """
+    parts: list = []
+    feature: list = []
+    holes: bool = False
+    separator: np.ndarray = np.full(shape=(1, 2), fill_value=np.nan)
+    for i, geometry in enumerate(gdf.geometry):
+        for part in getattr(geometry, "geoms", [geometry]):
+            if hasattr(part, "exterior"):
+                rings: list = [part.exterior, *part.interiors]
+                holes |= len(rings) > 1
+            else:
+                rings: list = [part]
+            for ring in rings:
+                parts.extend([separator, np.asarray(ring.coords)[:, :2]])
+                feature.append(i)
+
+    coords: np.ndarray = np.ascontiguousarray(
+        np.concatenate(parts[1:]) if parts else np.empty(shape=(0, 2)),
+        dtype=np.float64,
+    )
+    z: np.ndarray = (
+        gdf[zcolumn].to_numpy(dtype=np.float64)[np.asarray(feature, dtype=np.int64)]
+        if zcolumn is not None
+        else None
+    )
+    return dict(coords=coords, z=z, holes=holes)
+
+
+def packed(gdf: gpd.GeoDataFrame, zcolumn: str = None) -> dict:
+    """
+    Get the packed buffers of a GeoDataFrame (see pack), converting it only
+    the first time. Note that a GeoDataFrame modified in place after being
+    packed needs to be copied to be packed again.
+    """
+    key: tuple = (id(gdf), zcolumn)
+    if key in _CACHE:
+        ref, buffers = _CACHE[key]
+        if ref() is gdf:
+            return buffers
+    buffers: dict = pack(gdf=gdf, zcolumn=zcolumn)
+    _CACHE[key] = (weakref.ref(gdf), buffers)
+    weakref.finalize(gdf, _CACHE.pop, key, None)
+    return buffers
+
+
+def plot(fig: pygmt.Figure, data=None, **kwargs):
+    """
+    Drop-in replacement for pygmt.Figure.plot, that sends GeoDataFrames of
+    lines and polygons to GMT as cached in-memory buffers.
+
+    The Z value of each feature can be set with aspatial="Z=column", like with
+    an OGR file. Anything else (e.g. points, other aspatial columns, or filled
+    polygons with holes, which GMT would fill over) is passed on to
+    pygmt.Figure.plot unchanged.
+    """
+    aspatial: str = kwargs.get("aspatial")
+    zcolumn: str = aspatial[2:] if aspatial and aspatial.startswith("Z=") else None
+    if (
+        not isinstance(data, gpd.GeoDataFrame)
+        or (aspatial and (zcolumn is None or "," in zcolumn))
+        or not data.geom_type.isin(
+            ["LineString", "MultiLineString", "Polygon", "MultiPolygon"]
+        ).all()
+    ):
+        return fig.plot(data=data, **kwargs)
+
+    buffers: dict = packed(gdf=data, zcolumn=zcolumn)
+    if buffers["holes"] and ("color" in kwargs or "G" in kwargs):
+        return fig.plot(data=data, **kwargs)
+    kwargs.pop("aspatial", None)
+    return _plot(fig, coords=buffers["coords"], z=buffers["z"], **kwargs)
+
+
+@use_alias(
+    A="straight_line",
+    B="frame",
+    C="cmap",
+    G="color",
+    J="projection",
+    L="close",
+    R="region",
+    S="style",
+    V="verbose",
+    W="pen",
+    X="xshift",
+    Y="yshift",
+    p="perspective",
+    t="transparency",
+)
+@kwargs_to_strings(R="sequence", p="sequence")
+def _plot(fig: pygmt.Figure, coords: np.ndarray, z: np.ndarray = None, **kwargs):
+    """
+    Run GMT plot on packed buffers, in the same GMT API session as their
+    virtual files.
+    """
+    kwargs = fig._preprocess(**kwargs)  # activate the figure
+    with pygmt.clib.Session() as lib:
+        with lib.virtualfile_from_matrix(coords) as infile, (
+            lib.virtualfile_from_vectors(z)
+            if z is not None
+            else contextlib.nullcontext()
+        ) as zfile:
+            if zfile is not None:
+                kwargs["Z"] = zfile
+            lib.call_module("plot", " ".join([infile, build_arg_string(kwargs)]))
@@ -0,0 +1,307 @@
+"""
+Helper functions for gridding the ICESat-2 ATL11 point cloud onto a regular
+grid in Antarctic Polar Stereographic (EPSG:3031) coordinates, i.e. producing
+ds_grid_dhdt_siple_coast.nc for the key_figure notebook.
+"""
+
+import concurrent.futures
+import glob
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+import pointcloud
+
+
+def grid_dhdt(
+    path: str = "df_dhdt_siple_coast.parquet",
+    outgrid: str = "ds_grid_dhdt_siple_coast.nc",
+    region: list = [-800_000, 25_000, -1_000_000, -400_000],
+    spacing: float = 1000,
+    band_rows: int = 64,
+    max_workers: int = None,
+) -> str:
+    """
+    Grid the dhdt_slope of an ATL11 point cloud parquet table onto a regular
+    EPSG:3031 grid, computing the per-cell median, mean and point count.
+
+    The parquet file is streamed in one row group at a time. Each chunk is
+    binned in a worker process into mergeable partial results (the count and
+    sum of only the cells it touches), while its (cell, dhdt_slope) pairs are
+    spilled to disk in bands of grid rows. The exact per-cell median is then
+    computed one band at a time, also in parallel.
+
+    Memory use is the full count, sum and median grids (20 bytes per cell)
+    held once in the main process, plus up to 2 * max_workers chunks in flight
+    (each a row group of points and its sparse partial results), plus one
+    band's worth of points per worker when computing the medians. It does not
+    grow with the size of the whole point cloud.
+
+    Parameters
+    ----------
+    path : str
+        Filepath to the parquet file, e.g. df_dhdt_siple_coast.parquet.
+    outgrid : str
+        Filepath to the output NetCDF grid. Default is
+        ds_grid_dhdt_siple_coast.nc.
+    region : list
+        The [xmin, xmax, ymin, ymax] grid bounds in EPSG:3031 metres. Default
+        is the Siple Coast region [-800_000, 25_000, -1_000_000, -400_000].
+    spacing : float
+        Grid spacing in metres. Default is 1000.
+    band_rows : int
+        Number of grid rows in each band used to compute the median.
+        Default is 64.
+    max_workers : int
+        Number of worker processes. Default is None which uses all CPU cores.
+
+    Returns
+    -------
+    outgrid : str
+        The filepath to the gridline registered NetCDF grid, with variables
+        dhdt_median (read by GMT by default), dhdt_mean and count.
+    """
+    xmin, xmax, ymin, ymax = region
+    nx: int = int(round((xmax - xmin) / spacing)) + 1
+    ny: int = int(round((ymax - ymin) / spacing)) + 1
+    count = np.zeros(shape=ny * nx, dtype=np.int64)
+    total = np.zeros(shape=ny * nx, dtype=np.float64)
+    median = np.full(shape=ny * nx, fill_value=np.nan, dtype=np.float32)
+
+    max_workers: int = max_workers or os.cpu_count()
+    with tempfile.TemporaryDirectory() as spilldir, (
+        concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    ) as executor:
+        # Bin chunks in parallel, keeping a bounded number of them in flight
+        pending: set = set()
+        for chunk_id, array in enumerate(
+            pointcloud.iter_dhdt_chunks(
+                path=path, dhdt_threshold=None, columns=("x", "y", "dhdt_slope")
+            )
+        ):
+            if len(pending) >= 2 * max_workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    _cells, _count, _total = future.result()
+                    count[_cells] += _count
+                    total[_cells] += _total
+            pending.add(
+                executor.submit(
+                    _bin_chunk,
+                    array=array,
+                    region=region,
+                    spacing=spacing,
+                    shape=(ny, nx),
+                    band_rows=band_rows,
+                    spillfile=f"{spilldir}/{{band}}_{chunk_id}.npy",
+                )
+            )
+        for future in concurrent.futures.as_completed(pending):
+            _cells, _count, _total = future.result()
+            count[_cells] += _count
+            total[_cells] += _total
+
+        # Compute the exact median one band of rows at a time
+        bands: set = {
+            os.path.basename(f).split("_")[0] for f in glob.glob(f"{spilldir}/*.npy")
+        }
+        futures = [
+            executor.submit(
+                _median_band, spillfiles=glob.glob(f"{spilldir}/{band}_*.npy")
+            )
+            for band in bands
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            cells, medians = future.result()
+            median[cells] = medians
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean: np.ndarray = (total / count).astype(np.float32)
+    dims: tuple = ("y", "x")
+    ds_grid = xr.Dataset(
+        data_vars=dict(
+            dhdt_median=(dims, median.reshape(ny, nx)),
+            dhdt_mean=(dims, mean.reshape(ny, nx)),
+            count=(dims, count.reshape(ny, nx).astype(np.int32)),
+        ),
+        coords=dict(
+            y=ymin + np.arange(ny, dtype=np.float64) * spacing,
+            x=xmin + np.arange(nx, dtype=np.float64) * spacing,
+        ),
+        attrs=dict(crs="EPSG:3031", source=os.path.basename(path)),
+    )
+    ds_grid.to_netcdf(
+        path=outgrid,
+        encoding={var: dict(zlib=True, complevel=5) for var in ds_grid.data_vars},
+    )
+
+    return outgrid
+
+
+def update_grid(
+    grid: str = "ds_grid_dhdt_siple_coast.nc",
+    cachedir: str = "df_dhdt_siple_coast_cache",
+    block_ids: np.ndarray = None,
+) -> str:
+    """
+    Update a grid made by grid_dhdt in place, after some blocks of a point
+    cloud cache have changed (see pointcloud.append_dhdt_cycle).
+
+    Only the grid cells under the bounding boxes of the changed blocks are
+    recomputed, from the points of every cache block that overlaps them, so
+    the time taken scales with the size of the update rather than the whole
+    point cloud. Note that the cache should be built with the default
+    dhdt_threshold=0.0, so that it has the same points as the grid.
+
+    Parameters
+    ----------
+    grid : str
+        Filepath to the NetCDF grid to update.
+    cachedir : str
+        Directory holding the cache (see pointcloud.build_dhdt_cache).
+    block_ids : np.ndarray
+        Indices of the blocks of the cache that changed.
+
+    Returns
+    -------
+    grid : str
+        The filepath to the updated grid.
+    """
+    with xr.open_dataset(grid) as ds:
+        ds_grid: xr.Dataset = ds.load()
+    x: np.ndarray = ds_grid.x.to_numpy()
+    y: np.ndarray = ds_grid.y.to_numpy()
+    spacing: float = float(x[1] - x[0])
+    region: list = [float(x[0]), float(x[-1]), float(y[0]), float(y[-1])]
+    ny, nx = len(y), len(x)
+
+    # Grid cells under each changed block, as [ix0, ix1, iy0, iy1] ranges
+    blocks: np.ndarray = np.load(file=f"{cachedir}/blocks.npy")
+    changed: np.ndarray = blocks[np.asarray(block_ids, dtype=np.int64)]
+    ranges: np.ndarray = np.column_stack(
+        [
+            np.round((changed["xmin"] - region[0]) / spacing),
+            np.round((changed["xmax"] - region[0]) / spacing),
+            np.round((changed["ymin"] - region[2]) / spacing),
+            np.round((changed["ymax"] - region[2]) / spacing),
+        ]
+    ).astype(np.int64)
+    ranges = np.clip(ranges, a_min=0, a_max=[nx - 1, nx - 1, ny - 1, ny - 1])
+    update = np.zeros(shape=(ny, nx), dtype=bool)
+    for ix0, ix1, iy0, iy1 in ranges:
+        update[iy0 : iy1 + 1, ix0 : ix1 + 1] = True
+
+    # Read the points of every block overlapping those cells
+    lower: np.ndarray = region[0] + (ranges[:, 0] - 0.5) * spacing
+    upper: np.ndarray = region[0] + (ranges[:, 1] + 0.5) * spacing
+    overlaps: np.ndarray = (blocks["xmax"][:, None] >= lower) & (
+        blocks["xmin"][:, None] <= upper
+    )
+    lower = region[2] + (ranges[:, 2] - 0.5) * spacing
+    upper = region[2] + (ranges[:, 3] + 0.5) * spacing
+    overlaps &= (blocks["ymax"][:, None] >= lower) & (blocks["ymin"][:, None] <= upper)
+    xyz, dhdt = pointcloud.query_dhdt_cache(
+        cachedir=cachedir,
+        dhdt_threshold=None,
+        block_ids=np.flatnonzero(overlaps.any(axis=1)),
+    )
+
+    ix: np.ndarray = np.round((xyz[:, 0] - region[0]) / spacing).astype(np.int64)
+    iy: np.ndarray = np.round((xyz[:, 1] - region[2]) / spacing).astype(np.int64)
+    inside: np.ndarray = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    cells: np.ndarray = iy[inside] * nx + ix[inside]
+    values: np.ndarray = dhdt[inside]
+    keep: np.ndarray = update.ravel()[cells]
+    cells, values = cells[keep], values[keep]
+
+    count: np.ndarray = ds_grid["count"].to_numpy().ravel()
+    mean: np.ndarray = ds_grid["dhdt_mean"].to_numpy().ravel()
+    median: np.ndarray = ds_grid["dhdt_median"].to_numpy().ravel()
+    count[update.ravel()], mean[update.ravel()], median[update.ravel()] = (
+        0,
+        np.nan,
+        np.nan,
+    )
+    _count: np.ndarray = np.bincount(cells, minlength=ny * nx)
+    _total: np.ndarray = np.bincount(cells, weights=values, minlength=ny * nx)
+    filled: np.ndarray = np.flatnonzero(_count)
+    count[filled] = _count[filled]
+    mean[filled] = _total[filled] / _count[filled]
+    _cells, medians = _median_cells(cells=cells, values=values)
+    median[_cells] = medians
+
+    ds_grid["count"][:] = count.reshape(ny, nx)
+    ds_grid["dhdt_mean"][:] = mean.reshape(ny, nx)
+    ds_grid["dhdt_median"][:] = median.reshape(ny, nx)
+    ds_grid.to_netcdf(
+        path=f"{grid}.{os.getpid()}",
+        encoding={var: dict(zlib=True, complevel=5) for var in ds_grid.data_vars},
+    )
+    os.replace(src=f"{grid}.{os.getpid()}", dst=grid)
+
+    return grid
+
+
+def _bin_chunk(
+    array: np.ndarray,
+    region: list,
+    spacing: float,
+    shape: tuple,
+    band_rows: int,
+    spillfile: str,
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Bin one chunk of (x, y, value) points onto the grid, returning the (unique)
+    cells it touches with their count and sum, and spill the (cell, value)
+    pairs into one file per band.
+    """
+    ny, nx = shape
+    ix: np.ndarray = np.round((array[:, 0] - region[0]) / spacing).astype(np.int64)
+    iy: np.ndarray = np.round((array[:, 1] - region[2]) / spacing).astype(np.int64)
+    inside: np.ndarray = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    cells: np.ndarray = iy[inside] * nx + ix[inside]
+    values: np.ndarray = array[inside, 2]
+
+    unique, inverse = np.unique(cells, return_inverse=True)
+    count: np.ndarray = np.bincount(inverse, minlength=len(unique))
+    total: np.ndarray = np.bincount(inverse, weights=values, minlength=len(unique))
+
+    bands: np.ndarray = iy[inside] // band_rows
+    order: np.ndarray = np.argsort(bands, kind="stable")
+    bands, cells, values = bands[order], cells[order], values[order]
+    starts: np.ndarray = np.flatnonzero(np.diff(bands, prepend=-1))
+    for start, stop in zip(starts, np.append(starts[1:], len(bands))):
+        spill = np.empty(shape=stop - start, dtype=[("cell", "<i8"), ("value", "<f4")])
+        spill["cell"], spill["value"] = cells[start:stop], values[start:stop]
+        np.save(file=spillfile.format(band=bands[start]), arr=spill)
+
+    return unique, count, total
+
+
+def _median_band(spillfiles: list) -> (np.ndarray, np.ndarray):
+    """
+    Compute the exact median value of every grid cell in one band of rows,
+    from the (cell, value) pairs spilled by _bin_chunk.
+    """
+    spill: np.ndarray = np.concatenate([np.load(file=f) for f in spillfiles])
+    return _median_cells(cells=spill["cell"], values=spill["value"])
+
+
+def _median_cells(cells: np.ndarray, values: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Compute the exact median value of every grid cell with any values, given
+    the cell of each value. Returns the (sorted) cells and their medians.
+    """
+    order: np.ndarray = np.lexsort(keys=(values, cells))
+    cells, values = cells[order], values[order]
+
+    starts: np.ndarray = np.flatnonzero(np.diff(cells, prepend=-1))
+    lengths: np.ndarray = np.diff(np.append(starts, len(cells)))
+    lower: np.ndarray = starts + (lengths - 1) // 2
+    upper: np.ndarray = starts + lengths // 2
+
+    return cells[starts], (values[lower] + values[upper]) / 2
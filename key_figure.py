@@ -24,13 +24,21 @@
 
 # %%
 import os
-import re
 
 import geopandas as gpd
-import numpy as np
 import pandas as pd
-import pooch
 import pygmt
+import shapely.geometry
+
+import datasets
+import figexport
+import figurespec
+import gmttrace
+import gmtvector
+import gridding
+import labels
+import lakecatalog
+import mapdata
 
 # %% [markdown]
 # # Get data files
@@ -47,68 +55,14 @@ datafold: str = os.getenv("DATAHOME") or os.path.abspath("Quantarctica3")
 os.makedirs(name=datafold, exist_ok=True)
 
 # %%
-# MODIS Mosaic of Antarctica
-moa_no_nan: str = pooch.retrieve(
-    url="ftp://ftp.nsidc.org/pub/DATASETS/nsidc0593_moa2009_v02/geotiff/moa750_2009_hp1_v02.0.tif.gz",
-    known_hash="90d1718ea0971795ec102482c47f308ba08ba2b88383facb9fe210877e80282c",
-    path=f"{datafold}/SatelliteImagery/MODIS",
-    processor=pooch.Decompress(name="moa750_2009_hp1_v1.1.tif"),
-)
-moa = f"{datafold}/SatelliteImagery/MODIS/moa750_2009_hp1_v01.1.tif"
-try:
-    assert os.path.exists(path=moa)
-except AssertionError:
-    with pygmt.clib.Session() as lib:
-        # !gmt grdmath $moa_no_nan 0 NAN = $moa
-        lib.call_module(module="grdmath", args=f"{moa_no_nan} 0 NAN = {moa}")
-
-# %%
-# Scripps Grounding Line
-shapefiles: list = pooch.retrieve(
-    url="https://epic.awi.de/id/eprint/33781/1/Antarctica_masks.zip",
-    known_hash="e4c5918240e334680aed1329f109527efd8f43b6a277bb8e77b66f84f8c16619",
-    fname="groundingline",
-    path=f"{datafold}/Miscellaneous/ScrippsGroundingLine",
-    processor=pooch.Unzip(),
-)
-groundingline: str = [file for file in shapefiles if file.endswith(".shp")][0]
-gdf_groundingline: gpd.GeoDataFrame = gpd.read_file(filename=groundingline)
-
-# %%
-# MEaSUREs Phase Map of Antarctic Ice Velocity
-vel_file = f"{datafold}/Glaciology/MEaSUREs_PhaseBased_Velocity/antarctic_ice_vel_phase_map_v01"
-vel: str = f"{vel_file}-vmag.nc"
-try:
-    assert os.path.exists(vel)
-except AssertionError:
-    # Note, download require a .netrc file containing 'machine urs.earthdata.nasa.gov login <uid> password <password>'
-    # see https://nsidc.org/support/how/how-do-i-programmatically-access-data-spatial-temporal
-    try:
-        # Run processing of velocity magnitude grid locally
-        vel_file: str = pooch.retrieve(
-            url="https://n5eil01u.ecs.nsidc.org/MEASURES/NSIDC-0754.001/1996.01.01/antarctic_ice_vel_phase_map_v01.nc",
-            known_hash="fa0957618b8bd98099f4a419d7dc0e3a2c562d89e9791b4d0ed55e6017f52416",
-            fname="antarctic_ice_vel_phase_map_v01.nc",
-            path=f"{datafold}/Glaciology/MEaSUREs_PhaseBased_Velocity",
-        )
-        with pygmt.clib.Session() as lib:
-            #! gmt grdmath ${vel_file}.nc?VX 2 POW ${vel_file}.nc?VY 2 POW POW 0.5 = ${vel_file}-vmag.nc
-            lib.call_module(
-                module="grdmath",
-                args=f"{vel_file}.nc?VX 2 POW {vel_file}.nc?VY 2 POW POW 0.5 = {vel}",
-            )
-    except:
-        # Just download pre-processed velocity magnitude grid from GitHub
-        vel: str = pooch.retrieve(
-            url="https://github.com/weiji14/nzasc2021/releases/download/v0.0.0/antarctic_ice_vel_phase_map_v01-vmag.nc",
-            known_hash="ed6393275d8d8475c2162a838d6b9220cd529d28a2b5d674a6bf6dbda4971049",
-            fname="antarctic_ice_vel_phase_map_v01-vmag.nc",
-            path=f"{datafold}/Glaciology/MEaSUREs_PhaseBased_Velocity",
-        )
-
-# %%
-# DeepIceDrain active subglacial lake outlines
-lakes = "https://raw.githubusercontent.com/weiji14/deepicedrain/0cec859288b2add98a42b095955c8ec644dd616f/antarctic_subglacial_lakes_3031.geojson"
+# Download, verify and post-process the MODIS Mosaic of Antarctica, Scripps
+# Grounding Line, MEaSUREs Phase Map of Antarctic Ice Velocity and DeepIceDrain
+# active subglacial lake outlines concurrently, see datasets.SOURCES for details
+datafiles: dict = datasets.fetch_all(datafold=datafold)
+moa: str = datafiles["moa"]
+groundingline: str = datafiles["groundingline"]
+vel: str = datafiles["vel"]
+lakes: str = datafiles["lakes"]
 gdf_lakes: gpd.GeoDataFrame = gpd.read_file(filename=lakes)
 
 # %% [markdown]
@@ -135,12 +89,32 @@ pygmt.makecpt(
     output="cmap_dhdt.cpt",
 )
 
+# %%
+# Pre-composite the grayscale MOA and 70% transparent ice velocity layers into
+# one RGB image with numpy, which is much faster to save as a PNG/JPG than a
+# PostScript transparency layer. Only the cells under the graticules and
+# grounding line (which are drawn between them) keep a transparent velocity
+# layer. Set to False to plot them as separate layers.
+composite_layers: bool = True
+
+# Show previews of the figures as they are built up. Set to False when only
+# saving the figures, to skip the extra PostScript to PNG conversions.
+preview: bool = True
+
+# Record the wall time, data size and peak memory of every PyGMT call, saved as
+# a Chrome trace to key_figure_trace.json, with a summary table per figure.
+trace: bool = False
+tracer = gmttrace.Tracer()
+if trace:
+    tracer.start()
+
 # %%
 
 # %% [markdown]
 # # Figure of Siple Coast active subglacial lakes
 
 # %%
+tracer.section(name="Siple Coast")
 # We're making this a specific height
 figheight = 115  # in mm
 
@@ -157,52 +131,135 @@ sipproj = f"x1:{sipratio}"
 sipproj_ll = f"s0/-90/-71/1:{sipratio}"
 
 # %%
-# Initialize figure and plot MOA as the basemap with ticks every 200 km in xy directions
-fig = pygmt.Figure()
-with pygmt.config(MAP_FRAME_TYPE="inside"):
-    fig.basemap(
-        region=sipreg, projection=sipproj, frame=["nwse", "xf200000", "yf200000"]
+# Describe the Siple Coast figure declaratively, as a list of products and
+# layers, so that rebuilding it after an edit (e.g. to a label) only re-renders
+# the layers that changed and those plotted over them, see figurespec.py
+sipfig = figurespec.FigureSpec(
+    name="siple_coast_lakes", region=sipreg, projection=sipproj
+)
+
+# Cut MOA and ice velocity grids to the Siple Coast region, at the resolution
+# needed for saving the figure at 1200 dpi
+sipmoa = sipfig.product(
+    "sipmoa", mapdata.cut_raster, grid=moa, region=sipreg, scale=sipratio, dpi=1200
+)
+sipvel = sipfig.product(
+    "sipvel", mapdata.cut_raster, grid=vel, region=sipreg, scale=sipratio, dpi=1200
+)
+
+# Clip the grounding line to the Siple Coast region, simplified to the pixel size
+gdf_groundingline: gpd.GeoDataFrame = mapdata.clip_simplify(
+    vector=groundingline, region=sipreg, scale=sipratio, dpi=1200
+)
+
+if composite_layers:
+    # Composite velocity over MOA except where the graticules, frame
+    # annotations and grounding line are drawn, which velocity goes over
+    siplayers: list = [(sipmoa, "cmap_moa.cpt", 0), (sipvel, "cmap_vel.cpt", 70)]
+    sipvectors: gpd.GeoDataFrame = mapdata.vector_cover(
+        region=sipreg,
+        scale=sipratio,
+        lines=[gdf_groundingline],
+        graticule=(15, 2),
+        frame=36,
+    )
+    sipbase = sipfig.product(
+        "sipbase", mapdata.composite_rgb, layers=siplayers, vectors=sipvectors
     )
-    fig.grdimage(grid=moa, cmap="cmap_moa.cpt", nan_transparent=True)
+    sipvel_over = sipfig.product(
+        "sipvel_over",
+        mapdata.composite_remainder,
+        layers=siplayers,
+        index=1,
+        vectors=sipvectors,
+    )
+else:
+    sipvel_over = sipvel
 
-# Plot graticules overtop, every 2° latitude and 15° longitude
-with pygmt.config(
-    MAP_ANNOT_OFFSET_PRIMARY="-2p",
-    MAP_FRAME_TYPE="inside",
-    MAP_ANNOT_OBLIQUE=0,
-    FONT_ANNOT_PRIMARY="8p,grey",
-    MAP_GRID_PEN_PRIMARY="grey",
-    MAP_TICK_LENGTH_PRIMARY="-10p",
-    MAP_TICK_PEN_PRIMARY="thinnest,grey",
-    FORMAT_GEO_MAP="dddF",
-    MAP_POLAR_CAP="88/90",  # less longitude graticules at >88°S
-):
-    fig.basemap(
-        projection=sipproj_ll, region=sipreg, frame=["NSWE", "xa15g15", "ya2g2"]
+# %%
+# Grid the ICESat-2 ATL11 dhdt point cloud over Siple Coast (if available),
+# using the per-cell median rate of elevation change
+dhdt_grid: str = "ds_grid_dhdt_siple_coast.nc"
+if not os.path.exists(dhdt_grid) and os.path.exists("df_dhdt_siple_coast.parquet"):
+    gridding.grid_dhdt(
+        path="df_dhdt_siple_coast.parquet",
+        outgrid=dhdt_grid,
+        region=sipreg,
+        spacing=1000,
     )
 
+# %%
+# Plot MOA as the basemap with ticks every 200 km in xy directions
+sipfig.layer(
+    "basemap",
+    config=dict(MAP_FRAME_TYPE="inside"),
+    region=sipreg,
+    projection=sipproj,
+    frame=["nwse", "xf200000", "yf200000"],
+)
+if composite_layers:
+    sipfig.layer("grdimage", grid=sipbase, nan_transparent="255/0/255")
+else:
+    sipfig.layer("grdimage", grid=sipmoa, cmap="cmap_moa.cpt", nan_transparent=True)
+
+# Plot graticules overtop, every 2° latitude and 15° longitude
+sipfig.layer(
+    "basemap",
+    config=dict(
+        MAP_ANNOT_OFFSET_PRIMARY="-2p",
+        MAP_FRAME_TYPE="inside",
+        MAP_ANNOT_OBLIQUE=0,
+        FONT_ANNOT_PRIMARY="8p,grey",
+        MAP_GRID_PEN_PRIMARY="grey",
+        MAP_TICK_LENGTH_PRIMARY="-10p",
+        MAP_TICK_PEN_PRIMARY="thinnest,grey",
+        FORMAT_GEO_MAP="dddF",
+        MAP_POLAR_CAP="88/90",  # less longitude graticules at >88°S
+    ),
+    projection=sipproj_ll,
+    region=sipreg,
+    frame=["NSWE", "xa15g15", "ya2g2"],
+)
+
 # Plot the grounding line in white
-fig.plot(data=gdf_groundingline, region=sipreg, projection=sipproj, pen="0.15p,white")
+sipfig.layer(
+    "plot",
+    checkpoint=True,
+    data=gdf_groundingline,
+    region=sipreg,
+    projection=sipproj,
+    pen="0.15p,white",
+)
 
 
 # %%
-# Overlay ice velocity with 70% transparency
-fig.grdimage(grid=vel, cmap="cmap_vel.cpt", transparency=70, nan_transparent=True)
+# Overlay ice velocity with 70% transparency (only where it is not composited)
+sipfig.layer(
+    "grdimage",
+    checkpoint=True,
+    grid=sipvel_over,
+    cmap="cmap_vel.cpt",
+    transparency=70,
+    nan_transparent=True,
+)
 # Overlay dhdt with 30% transparency
 # pygmt.makecpt(cmap="berlin", series=[-1.0, 1.0, 0.25], continuous=True, reverse=True)
-# fig.grdimage(
-#     grid="ATLXI/ds_grid_dhdt_siple_coast.nc",
+# sipfig.layer(
+#     "grdimage",
+#     grid=dhdt_grid,
 #     cmap=True,
 #     # cmap="cmap_dhdt.cpt",
 #     transparency=30,
 #     nan_transparent=True,
 # )
-fig.show()
+if preview:
+    sipfig.show()
 
 
 # %%
 # Plot lakes in PS71 as blobs (red for draining, blue for filling)
-fig.plot(
+sipfig.layer(
+    "plot",
     data=gdf_lakes,
     pen="thinnest,yellow,-",
     cmap="cmap_dhdt.cpt",
@@ -212,73 +269,67 @@ fig.plot(
     aspatial="Z=inner_dhdt",
 )
 
+
 # %%
 # Siple Coast placename labels
-gdf = gpd.read_file("antarctic_subglacial_lakes_3031.gmt")
-with open("place_labels_siple_coast.tsv", mode="w") as file:
-    # Ice Streams A to E
-    font = "7p,Helvetica-Narrow-Oblique,white"
-    print(f"-320000\t-440000\t-65\t{font}\tCM\tMercer Ice Stream", file=file)
-    print(f"-385000\t-555000\t-5\t{font}\tCM\tWhillans Ice Stream", file=file)
-    print(f"-470000\t-450000\t-55\t{font}\tCM\tVan der Veen Ice Stream", file=file)
-    print(f"-550000\t-625000\t-40\t{font}\tCM\tKamb Ice Stream", file=file)
-    print(f"-700000\t-700000\t-45\t{font}\tCM\tBindschadler Ice Stream", file=file)
-    print(f"-700000\t-850000\t-37\t{font}\tCM\tMacAyeal Ice Stream", file=file)
-
-    # Ice ridges, rises and domes
-    print(f"-370000\t-480000\t-30\t{font}\tCM\tConway Ice Ridge", file=file)
-    print(f"-400000\t-600000\t0\t{font}\tCM\tEngelhardt Ice Ridge", file=file)
-    print(f"-100000\t-750000\t-45\t{font}\tCM\tCrary Ice Rise", file=file)
-    print(f"-450000\t-780000\t-35\t{font}\tCM\tSiple Dome", file=file)
-    print(f"-650000\t-800000\t-25\t{font}\tCM\tShabtaie Ice Ridge", file=file)
-    print(f"-650000\t-950000\t-15\t{font}\tCM\tHarrison Ice Ridge", file=file)
-
-    # Abbreviated lakes
-    abbrev_dict: dict = {
-        "Subglacial": "S",
-        "Lake": "L",
-        "Conway": "C",
-        "Engelhardt": "E",
-        "Kamb": "K",
-        "MacAyeal": "Mac",
-        "Mercer": "M",
-        # "Recovery", "R",
-        # "Slessor","S"
-        "Whillans": "W",
-    }
-    pattern = re.compile(pattern=rf"\b({'|'.join(abbrev_dict.keys())})\b")
-
-    for idx, row in gdf.dissolve(by="lake_name", as_index=False).iterrows():
-        x, y = row.geometry.centroid.xy
-
-        label = pattern.sub(
-            repl=lambda name: abbrev_dict[name.group()], string=row.lake_name
-        ).replace(" ", "")
-        justify = (
-            "BL"
-            if label in ("L12", "L78", "SLW", "W7", "WX", "WXI")
-            else "TC"
-            if ("*" in label or label == "SLM")
-            else "TR"
-        )
+def write_siple_labels(lakes: str, outfile: str, scale: float, region: list) -> str:
+    # Ice Streams A to E, and ice ridges, rises and domes
+    df_places = pd.DataFrame(
+        data=[
+            [-320000, -440000, -65, "Mercer Ice Stream"],
+            [-385000, -555000, -5, "Whillans Ice Stream"],
+            [-470000, -450000, -55, "Van der Veen Ice Stream"],
+            [-550000, -625000, -40, "Kamb Ice Stream"],
+            [-700000, -700000, -45, "Bindschadler Ice Stream"],
+            [-700000, -850000, -37, "MacAyeal Ice Stream"],
+            [-370000, -480000, -30, "Conway Ice Ridge"],
+            [-400000, -600000, 0, "Engelhardt Ice Ridge"],
+            [-100000, -750000, -45, "Crary Ice Rise"],
+            [-450000, -780000, -35, "Siple Dome"],
+            [-650000, -800000, -25, "Shabtaie Ice Ridge"],
+            [-650000, -950000, -15, "Harrison Ice Ridge"],
+        ],
+        columns=["x", "y", "angle", "text"],
+    ).assign(font="7p,Helvetica-Narrow-Oblique,white", justify="CM")
+
+    # Abbreviated lakes, placed to avoid overlapping the lakes and each other
+    df_lakes = labels.lake_labels(
+        gdf=lakecatalog.read_lakes(store=lakes, region=region),
+        scale=scale,
+        region=region,
+    )
 
-        print(f"{x[0]:.0f}\t{y[0]:.0f}\t0\t6p,white\t{justify}\t{label}", file=file)
+    return labels.write_labels(
+        df_labels=pd.concat(objs=[df_places, df_lakes]), outfile=outfile
+    )
+
+
+siplabels = sipfig.product(
+    "siplabels",
+    write_siple_labels,
+    lakes="antarctic_subglacial_lakes_3031.fgb",
+    outfile="place_labels_siple_coast.tsv",
+    scale=sipratio,
+    region=sipreg,
+)
 
 # %%
 # Plot labels for Siple Coast ice streams, active subglacial lakes, etc
-fig.text(
-    textfiles="place_labels_siple_coast.tsv",
+sipfig.layer(
+    "text",
+    textfiles=siplabels,
     angle=True,
     font=True,
     justify=True,
     offset="j0.12c",
     # frame=["WsNe", "af10000g50000"],
 )
-fig.show()
+if preview:
+    sipfig.show()
 
 # %%
 # Plot the color bar once with a transparent box, then again with no box and no transparency
-with pygmt.config(
+colorbar_config: dict = dict(
     FONT_ANNOT_PRIMARY="6p,white",
     FONT_LABEL="6p,white",
     MAP_ANNOT_OFFSET_PRIMARY="2p",
@@ -286,47 +337,64 @@ with pygmt.config(
     MAP_TICK_LENGTH_PRIMARY="3p",
     MAP_FRAME_PEN="0.5p,white",
     MAP_LABEL_OFFSET="4p",
-):
-    colorbar_kwargs = dict(
-        cmap="cmap_dhdt.cpt",
-        position="jBR+jBR+w1.6c/0.18c+o1.2c/0.3c+v+e",
-        frame=["xaf", 'y+l"dhdt (m/yr)"'],
-    )
-    fig.colorbar(
-        box="+gblack+c-9p/3p",
-        # box = '+gblack+p0.5p,black+c3p'
-        transparency=70,
-        **colorbar_kwargs,
-    )
-    fig.colorbar(**colorbar_kwargs)
-
-    # Add a scalebar
-    fig.basemap(
-        projection=sipproj_ll, region=sipreg, map_scale="jBR+o2.2c/0.3c+w50k+uk+f"
-    )
+)
+colorbar_kwargs = dict(
+    cmap="cmap_dhdt.cpt",
+    position="jBR+jBR+w1.6c/0.18c+o1.2c/0.3c+v+e",
+    frame=["xaf", 'y+l"dhdt (m/yr)"'],
+)
+sipfig.layer(
+    "colorbar",
+    config=colorbar_config,
+    box="+gblack+c-9p/3p",
+    # box = '+gblack+p0.5p,black+c3p'
+    transparency=70,
+    **colorbar_kwargs,
+)
+sipfig.layer("colorbar", config=colorbar_config, **colorbar_kwargs)
+
+# Add a scalebar
+sipfig.layer(
+    "basemap",
+    config=colorbar_config,
+    projection=sipproj_ll,
+    region=sipreg,
+    map_scale="jBR+o2.2c/0.3c+w50k+uk+f",
+)
 
-fig.show()
+if preview:
+    sipfig.show()
 
 # %%
 # Make inset overview map of Antarctica
 antwidth: int = 3
-with fig.inset(position=f"jTR+w{antwidth}c"):
-    # Plot the inset map
-    fig.basemap(region=vel, projection=f"S0/-90/71/{antwidth}c", frame="+n")
-    fig.coast(area_thresh="+a", land="white")  # ice shelf in white
-    fig.coast(area_thresh="+ag", land="gray")  # grounded ice in gray
-    fig.plot(
-        projection=f"X{antwidth}c",
-        x=[sip_xl, sip_xl, sip_xh, sip_xh, sip_xl],
-        y=[sip_yl, sip_yh, sip_yh, sip_yl, sip_yl],
-        pen="1p,black",  # map location in black
-    )
-fig.show()
+sipfig.layer(
+    "inset",
+    position=f"jTR+w{antwidth}c",
+    layers=[
+        # Plot the inset map
+        ("basemap", dict(region=vel, projection=f"S0/-90/71/{antwidth}c", frame="+n")),
+        ("coast", dict(area_thresh="+a", land="white")),  # ice shelf in white
+        ("coast", dict(area_thresh="+ag", land="gray")),  # grounded ice in gray
+        (
+            "plot",
+            dict(
+                projection=f"X{antwidth}c",
+                x=[sip_xl, sip_xl, sip_xh, sip_xh, sip_xl],
+                y=[sip_yl, sip_yh, sip_yh, sip_yl, sip_yl],
+                pen="1p,black",  # map location in black
+            ),
+        ),
+    ],
+)
+if preview:
+    sipfig.show()
 
 # %%
-# Save the figure
-fig.savefig(fname="siple_coast_lakes.pdf")
-fig.savefig(fname="siple_coast_lakes.png", dpi=1200)
+# Save the figure, reusing any unchanged layers from the last build
+sipfig.build(outputs=[("siple_coast_lakes.pdf", None), ("siple_coast_lakes.png", 1200)])
+for fname, seconds in sipfig.timings.items():
+    print(f"{fname}: {seconds:.1f}s")
 
 
 # %%
@@ -335,6 +403,7 @@ fig.savefig(fname="siple_coast_lakes.png", dpi=1200)
 # # Figure of Antarctic active subglacial lake map
 
 # %%
+tracer.section(name="Antarctica")
 # We're making this a specific height
 figheight = 115  # in mm
 
@@ -350,6 +419,40 @@ aisreg = [ais_xl, ais_xh, ais_yl, ais_yh]
 aisproj = "x1:" + str(aisratio)
 aisproj_ll = "s0/-90/-71/1:" + str(aisratio)
 
+# %%
+# Downsample MOA and ice velocity grids to the resolution needed for saving
+# the figure at 900 dpi
+aismoa: str = mapdata.cut_raster(grid=moa, region=aisreg, scale=aisratio, dpi=900)
+# (starting from the 2x downsampled velocity grid pyramid level if available)
+vel_2x: str = vel.replace("-vmag.nc", "-vmag-2x.nc")
+aisvel: str = mapdata.cut_raster(
+    grid=vel_2x if os.path.exists(vel_2x) else vel,
+    region=aisreg,
+    scale=aisratio,
+    dpi=900,
+)
+
+# Clip the grounding line to the Antarctic region, simplified to the pixel size
+gdf_groundingline: gpd.GeoDataFrame = mapdata.clip_simplify(
+    vector=groundingline, region=aisreg, scale=aisratio, dpi=900
+)
+
+# Cells under the graticules, frame annotations, grounding line and Siple Coast
+# box, which the velocity layer is drawn over
+aislayers: list = [(aismoa, "cmap_moa.cpt", 0), (aisvel, "cmap_vel.cpt", 70)]
+aisvectors: gpd.GeoDataFrame = mapdata.vector_cover(
+    region=aisreg,
+    scale=aisratio,
+    lines=[
+        gdf_groundingline,
+        gpd.GeoDataFrame(
+            geometry=[shapely.geometry.box(sip_xl, sip_yl, sip_xh, sip_yh).exterior]
+        ),
+    ],
+    graticule=(45, 10),
+    frame=36,
+)
+
 
 # %%
 # Initialize figure and plot MOA as the base map with ticks every 200 km both directions
@@ -370,7 +473,15 @@ with pygmt.config(MAP_FRAME_TYPE="inside"):
     fig.basemap(
         projection=aisproj, region=aisreg, frame=["nwse", "xf200000", "yf200000"]
     )
-    fig.grdimage(grid=moa, cmap="cmap_moa.cpt", nan_transparent=True)
+    if composite_layers:
+        # Leave out the velocity cells without MOA under them, which are blended
+        # over the relief map instead, and those under the vectors, see below
+        aisbase: str = mapdata.composite_rgb(
+            layers=aislayers, background=None, vectors=aisvectors
+        )
+        fig.grdimage(grid=aisbase, nan_transparent="255/0/255")
+    else:
+        fig.grdimage(grid=aismoa, cmap="cmap_moa.cpt", nan_transparent=True)
 
 # Plot graticules overtop, every 10° latitude and 45° longitude
 with pygmt.config(
@@ -389,7 +500,9 @@ with pygmt.config(
     )
 
 # Plot the grounding line in white
-fig.plot(data=gdf_groundingline, region=aisreg, projection=aisproj, pen="0.15p,white")
+gmtvector.plot(
+    fig, data=gdf_groundingline, region=aisreg, projection=aisproj, pen="0.15p,white"
+)
 
 # Plot bounding box of Siple Coast study area
 fig.plot(
@@ -400,9 +513,20 @@ fig.plot(
 )
 
 # %%
-# Overlay ice velocity with 70% transparency
-fig.grdimage(grid=vel, cmap="cmap_vel.cpt", transparency=70, nan_transparent=True)
-fig.show()
+# Overlay ice velocity with 70% transparency (only where it is not composited)
+aisvel_over: str = (
+    mapdata.composite_remainder(
+        layers=aislayers, index=1, background=None, vectors=aisvectors
+    )
+    if composite_layers
+    else aisvel
+)
+if aisvel_over is not None:
+    fig.grdimage(
+        grid=aisvel_over, cmap="cmap_vel.cpt", transparency=70, nan_transparent=True
+    )
+if preview:
+    fig.show()
 
 # %%
 # Antarctica placename labels
@@ -449,8 +573,9 @@ fig.text(
 
 # %%
 # Plot lakes in PS71 as cyan blobs with 60% transparency
-fig.plot(data=gdf_lakes, pen="0.5p,cyan", color="cyan", transparency=60)
-fig.show()
+gmtvector.plot(fig, data=gdf_lakes, pen="0.5p,cyan", color="cyan", transparency=60)
+if preview:
+    fig.show()
 
 # %%
 # Add the finishing touches by putting a panel label in the bottom left corner,
@@ -479,13 +604,30 @@ with pygmt.config(
     )
     fig.legend(spec="legend.txt", position=legend_pos)
 
-fig.show()
+if preview:
+    fig.show()
 
 # %%
-# Save the figure
-fig.savefig(fname="antarctica_lakes.pdf")
-fig.savefig(fname="antarctica_lakes.png", dpi=600)
-fig.savefig(fname="antarctica_lakes.jpg", dpi=900)
+# Save the figure, converting the PostScript to each format concurrently, and
+# downsampling the 900 dpi raster to get the 600 dpi PNG
+timings: dict = figexport.export_figure(
+    fig=fig,
+    outputs=[
+        ("antarctica_lakes.pdf", None),
+        ("antarctica_lakes.png", 600),
+        ("antarctica_lakes.jpg", 900),
+    ],
+    downsample=True,
+)
+for fname, seconds in timings.items():
+    print(f"{fname}: {seconds:.1f}s")
+
+# %%
+# Save the trace of PyGMT calls, and summarise where the time went per figure
+if trace:
+    tracer.stop()
+    tracer.save(filename="key_figure_trace.json")
+    print(tracer.summary())
 
 # %%
 
@@ -503,28 +645,22 @@ import pygmt
 import geopandas as gpd
 import os
 
-_ = pygmt.which(fname=lakes, download=True)
+_ = pygmt.which(fname=datasets.SOURCES["lakes"]["url"], download=True)
 lake_catalog = deepicedrain.catalog.subglacial_lakes()
-antarctic_lakes = lake_catalog.read()
-antarctic_lakes.insert(loc=0, column="lake_name", value=pd.NA)
-
-for _, lake_data in pd.json_normalize(lake_catalog.metadata["lakedict"]).iterrows():
-    for id in lake_data.ids:
-        antarctic_lakes.at[id, "lake_name"] = lake_data.lakename
-subset_lakes = antarctic_lakes.dropna(subset=["lake_name"]).set_index(
-    keys=["lake_name"]
-)
-subset_lakes: gpd.GeoDataFrame = subset_lakes.sort_values(
-    by=["basin_name", "lake_name"]
+antarctic_lakes: gpd.GeoDataFrame = lake_catalog.read()
+
+# Join the lake names onto the catalogue by id, reporting any duplicate or
+# conflicting (or missing) ids in the lake dictionary
+antarctic_lakes, df_report = lakecatalog.name_lakes(
+    gdf=antarctic_lakes, lakedict=lake_catalog.metadata["lakedict"]
 )
+df_report
 
 # %%
-# Save subset of lakes
+# Save subset of lakes, sorted by basin and lake name, to a spatially indexed
+# FlatGeobuf store (read by region or basin with lakecatalog.read_lakes), and
+# to an OGR GMT file generated from it
 # subset_lakes = gdf.query("basin_name == 'Whillans'")
-try:
-    os.remove(f"antarctic_subglacial_lakes_3031.gmt")
-except FileNotFoundError:
-    pass
-subset_lakes.to_file(
-    filename=f"antarctic_subglacial_lakes_3031.gmt", driver="OGR_GMT", index=True
+subset_lakes: gpd.GeoDataFrame = lakecatalog.export_named_lakes(
+    gdf_named=antarctic_lakes, store="antarctic_subglacial_lakes_3031.fgb"
 )
@@ -0,0 +1,180 @@
+"""
+Label engine for placing abbreviated lake names on the key figure maps.
+
+Abbreviations and representative points are computed for all lakes at once,
+and each label's justification is picked automatically from a set of candidate
+positions around its point, using an R-tree of the lake outlines and of the
+labels placed so far to avoid collisions.
+"""
+
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rtree
+import shapely.geometry
+
+ABBREVIATIONS: dict = {
+    "Subglacial": "S",
+    "Lake": "L",
+    "Conway": "C",
+    "Engelhardt": "E",
+    "Kamb": "K",
+    "MacAyeal": "Mac",
+    "Mercer": "M",
+    # "Recovery", "R",
+    # "Slessor","S"
+    "Whillans": "W",
+}
+
+
+def abbreviate(names: pd.Series, abbreviations: dict = ABBREVIATIONS) -> pd.Series:
+    """
+    Abbreviate whole words in lake names (e.g. Subglacial Lake Whillans to
+    SLW), and remove any spaces.
+    """
+    pattern: str = rf"\b({'|'.join(map(re.escape, abbreviations))})\b"
+    return names.str.replace(
+        pat=pattern, repl=lambda name: abbreviations[name.group()], regex=True
+    ).str.replace(pat=" ", repl="", regex=False)
+
+
+def lake_labels(
+    gdf: gpd.GeoDataFrame,
+    scale: float,
+    by: str = "lake_name",
+    abbreviations: dict = ABBREVIATIONS,
+    font: str = "6p,white",
+    offset: float = 0.12,
+    justifications: tuple = ("TR", "TL", "BR", "BL", "TC", "BC", "MR", "ML"),
+    region: list = None,
+) -> pd.DataFrame:
+    """
+    Make a table of abbreviated lake name labels, placed to avoid overlapping
+    the lake outlines and each other.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        Lake outlines, with the lake names in column 'by'. Outlines with the
+        same name are dissolved into one label.
+    scale : float
+        The map scale denominator, e.g. sipratio for a 1:sipratio map, used to
+        convert the label sizes in print units to map units.
+    by : str
+        Name of the column with the lake names. Default is 'lake_name'.
+    abbreviations : dict
+        Mapping of words to their abbreviations. Default is ABBREVIATIONS.
+    font : str
+        GMT font of the labels, e.g. '6p,white'.
+    offset : float
+        Distance in cm to offset each label away from its point, in the
+        direction implied by its justification (i.e. GMT text -Dj0.12c).
+    justifications : tuple
+        Candidate GMT justification codes, in order of preference.
+    region : list
+        Optional [xmin, xmax, ymin, ymax] map region that labels should stay
+        inside of.
+
+    Returns
+    -------
+    df_labels : pd.DataFrame
+        Table with columns x, y, angle, font, justify and text, as read by
+        pygmt.Figure.text(angle=True, font=True, justify=True). Empty if there
+        are no lakes in gdf.
+    """
+    if gdf.empty:  # an R-tree cannot be bulk loaded from no items
+        return pd.DataFrame(columns=["x", "y", "angle", "font", "justify", "text"])
+
+    gdf: gpd.GeoDataFrame = gdf.dissolve(by=by, as_index=False)
+    points: gpd.GeoSeries = gdf.representative_point()
+    text: pd.Series = abbreviate(names=gdf[by], abbreviations=abbreviations)
+
+    # Approximate label sizes in map units, taking an average character to be
+    # 0.6 times the font size wide
+    metres_per_point: float = 0.0254 / 72 * scale
+    fontsize: float = float(re.match(pattern=r"[\d.]+", string=font).group())
+    height: float = fontsize * metres_per_point
+    width: np.ndarray = text.str.len().to_numpy() * 0.6 * height
+    shift: float = offset / 100 * scale
+
+    # Bounding boxes (n_labels, n_candidates, 4) of every candidate position
+    x: np.ndarray = points.x.to_numpy()[:, None]
+    y: np.ndarray = points.y.to_numpy()[:, None]
+    vertical: np.ndarray = np.array([j[0] for j in justifications])
+    horizontal: np.ndarray = np.array([j[1] for j in justifications])
+    w: np.ndarray = width[:, None]
+    xmin: np.ndarray = np.select(
+        condlist=[horizontal == "L", horizontal == "R"],
+        choicelist=[x + shift, x - shift - w],
+        default=x - w / 2,
+    )
+    ymin: np.ndarray = np.select(
+        condlist=[vertical == "B", vertical == "T"],
+        choicelist=[y + shift, y - shift - height],
+        default=y - height / 2,
+    )
+    boxes: np.ndarray = np.stack(arrays=[xmin, ymin, xmin + w, ymin + height], axis=-1)
+
+    # Index the lake outlines, and count how crowded each label's surroundings
+    # are, so that the most constrained labels are placed first
+    index = rtree.index.Index(
+        (i, bounds, None) for i, bounds in enumerate(gdf.bounds.itertuples(index=False))
+    )
+    order: np.ndarray = np.argsort(
+        [
+            -index.count(
+                (box[:, 0].min(), box[:, 1].min(), box[:, 2].max(), box[:, 3].max())
+            )
+            for box in boxes
+        ],
+        kind="stable",
+    )
+
+    n: int = len(gdf)
+    chosen: np.ndarray = np.zeros(shape=n, dtype=np.int64)
+    for i in order:
+        costs: list = []
+        for box in boxes[i]:
+            cost: int = 0
+            for j in index.intersection(tuple(box)):
+                if j >= n:  # another label
+                    cost += 1
+                elif j != i and gdf.geometry.iloc[j].intersects(
+                    shapely.geometry.box(*box)
+                ):  # another lake
+                    cost += 1
+            if region is not None and (
+                box[0] < region[0]
+                or box[2] > region[1]
+                or box[1] < region[2]
+                or box[3] > region[3]
+            ):
+                cost += n
+            costs.append(cost)
+            if cost == 0:
+                break
+        chosen[i] = int(np.argmin(costs))
+        index.insert(id=n + i, coordinates=tuple(boxes[i, chosen[i]]))
+
+    return pd.DataFrame(
+        data=dict(
+            x=points.x.round().astype(int),
+            y=points.y.round().astype(int),
+            angle=0,
+            font=font,
+            justify=np.asarray(justifications)[chosen],
+            text=text,
+        )
+    )
+
+
+def write_labels(df_labels: pd.DataFrame, outfile: str, mode: str = "w") -> str:
+    """
+    Write a table of labels to a tab separated GMT text file in one go.
+    """
+    df_labels[["x", "y", "angle", "font", "justify", "text"]].to_csv(
+        path_or_buf=outfile, sep="\t", header=False, index=False, mode=mode
+    )
+    return outfile
@@ -0,0 +1,227 @@
+"""
+Helper functions for naming clusters of active subglacial lakes in the
+DeepIceDrain lake catalogue, and storing the named subset in an indexed
+FlatGeobuf file that can be read by region or basin, with an OGR GMT copy
+for plotting.
+"""
+
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+
+def name_lakes(
+    gdf: gpd.GeoDataFrame, lakedict: list, column: str = "lake_name"
+) -> (gpd.GeoDataFrame, pd.DataFrame):
+    """
+    Name lakes by joining an id to name mapping onto the lake catalogue.
+
+    Parameters
+    ----------
+    gdf : gpd.GeoDataFrame
+        The lake catalogue, indexed by lake id.
+    lakedict : list
+        List of {'lakename': str, 'ids': list} dictionaries, e.g. from
+        deepicedrain.catalog.subglacial_lakes().metadata["lakedict"].
+    column : str
+        Name of the column to put the lake names in. Default is 'lake_name'.
+
+    Returns
+    -------
+    gdf_named : gpd.GeoDataFrame
+        Copy of the lake catalogue with the lake names inserted as the first
+        column, or NaN for lakes without a name.
+    df_report : pd.DataFrame
+        Table of the (id, name) pairs with an 'issue', either 'duplicate' (an
+        id listed more than once under the same name), 'conflict' (an id given
+        more than one name, in which case the last name is used) or 'missing'
+        (an id that is not in the catalogue). Empty if there are no issues.
+    """
+    names: pd.DataFrame = (
+        pd.DataFrame(data=lakedict, columns=["lakename", "ids"])
+        .explode(column="ids")
+        .dropna(subset=["ids"])
+        .rename(columns=dict(lakename=column, ids="id"))
+        .reset_index(drop=True)
+    )
+    names["id"] = names["id"].astype(gdf.index.dtype)
+
+    repeats: pd.Series = names.groupby(by="id")["id"].transform("size") > 1
+    conflicts: pd.Series = names.groupby(by="id")[column].transform("nunique") > 1
+    missing: pd.Series = ~names["id"].isin(gdf.index)
+    df_report: pd.DataFrame = names[repeats | missing].assign(
+        issue=np.select(
+            condlist=[missing[repeats | missing], conflicts[repeats | missing]],
+            choicelist=["missing", "conflict"],
+            default="duplicate",
+        )
+    )
+
+    mapping: pd.Series = names.drop_duplicates(subset="id", keep="last").set_index(
+        keys="id"
+    )[column]
+    gdf_named: gpd.GeoDataFrame = gdf.copy()
+    gdf_named.insert(loc=0, column=column, value=gdf.index.map(mapping))
+
+    return gdf_named, df_report.sort_values(by="id", kind="stable", ignore_index=True)
+
+
+def export_named_lakes(
+    gdf_named: gpd.GeoDataFrame,
+    store: str = "antarctic_subglacial_lakes_3031.fgb",
+    column: str = "lake_name",
+    by: list = ["basin_name", "lake_name"],
+) -> gpd.GeoDataFrame:
+    """
+    Subset the named lakes, sort them (by basin and then lake name), and save
+    them to an indexed lake outline store (see write_store), plus an OGR GMT
+    file that can be plotted easily later. Returns the sorted subset, indexed
+    by lake name.
+    """
+    subset_lakes: gpd.GeoDataFrame = (
+        gdf_named.dropna(subset=[column]).set_index(keys=[column]).sort_values(by=by)
+    )
+    write_store(gdf=subset_lakes.reset_index(), store=store, by=by[0])
+    to_gmt(store=store, gdf=subset_lakes.reset_index())
+    return subset_lakes
+
+
+def write_store(
+    gdf: gpd.GeoDataFrame,
+    store: str = "antarctic_subglacial_lakes_3031.fgb",
+    by: str = "basin_name",
+) -> str:
+    """
+    Save lake outlines to a FlatGeobuf file, which has a packed Hilbert R-tree
+    spatial index so that reads by bounding box only parse the features inside
+    it. The bounds of each group of lakes (e.g. per basin) are saved alongside
+    in a {store}.json file, for reading one group at a time.
+
+    As the spatial index reorders the features, their original order (e.g.
+    sorted by basin and lake name) is kept in a 'store_order' column, which
+    read_lakes uses to put them back in that order.
+    """
+    if os.path.exists(store):
+        os.remove(store)
+    gdf.assign(store_order=np.arange(len(gdf))).to_file(
+        filename=store, driver="FlatGeobuf"
+    )
+
+    bounds: pd.DataFrame = gdf.bounds.groupby(by=gdf[by]).agg(
+        dict(minx="min", miny="min", maxx="max", maxy="max")
+    )
+    with open(file=f"{store}.json", mode="w") as file:
+        json.dump(
+            obj=dict(by=by, bounds=dict(zip(bounds.index, bounds.to_numpy().tolist()))),
+            fp=file,
+            indent=1,
+        )
+    return store
+
+
+def read_lakes(
+    store: str = "antarctic_subglacial_lakes_3031.fgb",
+    region: list = None,
+    group: str = None,
+    by: str = "basin_name",
+) -> gpd.GeoDataFrame:
+    """
+    Read lake outlines from the indexed store, optionally only those within
+    a region, or in one group (e.g. basin).
+
+    The store is (re)built from the OGR GMT file of the same name if it
+    doesn't exist, or is older than that file.
+
+    Parameters
+    ----------
+    store : str
+        Filepath to the FlatGeobuf lake outline store. Default is
+        antarctic_subglacial_lakes_3031.fgb.
+    region : list
+        The [xmin, xmax, ymin, ymax] region to read lakes from. Default is None
+        which reads all lakes.
+    group : str
+        Only read lakes with this value in the 'by' column, e.g. 'Whillans'.
+        Default is None which reads all groups.
+    by : str
+        Name of the column to select the group from. Default is 'basin_name'.
+
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame
+        The lake outlines.
+    """
+    gmtfile: str = os.path.splitext(store)[0] + ".gmt"
+    if not os.path.exists(store) or (
+        os.path.exists(gmtfile) and os.path.getmtime(gmtfile) > os.path.getmtime(store)
+    ):
+        write_store(gdf=gpd.read_file(filename=gmtfile), store=store, by=by)
+        _match_mtime(path=store, reference=gmtfile)
+
+    bbox: tuple = None
+    if region is not None:
+        xmin, xmax, ymin, ymax = region
+        bbox = (xmin, ymin, xmax, ymax)
+    if group is not None:
+        with open(file=f"{store}.json") as file:
+            index: dict = json.load(fp=file)
+        if index["by"] == by:
+            minx, miny, maxx, maxy = index["bounds"].get(group, (0, 0, 0, 0))
+            if bbox is not None:
+                minx, miny = max(minx, bbox[0]), max(miny, bbox[1])
+                maxx, maxy = min(maxx, bbox[2]), min(maxy, bbox[3])
+            bbox = (minx, miny, maxx, maxy)
+
+    gdf: gpd.GeoDataFrame = _read_store(store=store, bbox=bbox)
+    if group is not None:
+        gdf = gdf[gdf[by] == group]
+    return gdf
+
+
+def _read_store(store: str, bbox: tuple = None) -> gpd.GeoDataFrame:
+    """
+    Read lake outlines from the store, in the order they were written in.
+    """
+    gdf: gpd.GeoDataFrame = gpd.read_file(filename=store, bbox=bbox)
+    if "store_order" in gdf.columns:
+        gdf = gdf.sort_values(by="store_order", ignore_index=True).drop(
+            columns="store_order"
+        )
+    return gdf
+
+
+def to_gmt(
+    store: str = "antarctic_subglacial_lakes_3031.fgb",
+    gmtfile: str = None,
+    gdf: gpd.GeoDataFrame = None,
+) -> str:
+    """
+    Make an OGR GMT copy of the lake outline store for plotting with GMT,
+    unless there is already one that is newer than the store. The lakes are
+    written in the same order as they were given to write_store, or from gdf
+    if it is given (i.e. what was just saved to the store). Returns the
+    filepath to the OGR GMT file.
+    """
+    gmtfile: str = gmtfile or os.path.splitext(store)[0] + ".gmt"
+    if not os.path.exists(gmtfile) or os.path.getmtime(gmtfile) < os.path.getmtime(
+        store
+    ):
+        if os.path.exists(gmtfile):
+            os.remove(gmtfile)
+        if gdf is None:
+            gdf: gpd.GeoDataFrame = _read_store(store=store)
+        gdf.to_file(filename=gmtfile, driver="OGR_GMT")
+        _match_mtime(path=gmtfile, reference=store)
+    return gmtfile
+
+
+def _match_mtime(path: str, reference: str):
+    """
+    Give a file converted from another the same modification time, so that
+    neither looks out of date compared to the other.
+    """
+    stat = os.stat(reference)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
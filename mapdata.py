@@ -0,0 +1,677 @@
+"""
+Helper functions for preparing the background map layers (rasters, vectors)
+used by the key_figure notebook, caching the results so that repeat renders
+don't need to reprocess the full-continent datasets.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pygmt
+import shapely.geometry
+import xarray as xr
+
+
+def cache_key(*items) -> str:
+    """
+    Make a short hexadecimal key from a hash of the given items. Any item that
+    is a path to an existing file is identified by its contents if it is small
+    (e.g. a cpt file), or else by its absolute path, size and modification time,
+    so that the key changes when the file does. Dictionaries, (Geo)DataFrames
+    and numpy arrays are identified by their contents.
+    """
+    hasher = hashlib.sha256()
+    for item in items:
+        if isinstance(item, (tuple, list)):
+            item = cache_key(*item)
+        elif isinstance(item, dict):
+            item = cache_key(*sorted(item.items()))
+        elif isinstance(item, pd.DataFrame):
+            item = _hash_frame(df=item)
+        elif isinstance(item, np.ndarray):
+            array: np.ndarray = np.ascontiguousarray(item)
+            item = (hashlib.sha256(array.tobytes()).hexdigest(), array.dtype.str)
+        elif isinstance(item, str) and os.path.isfile(item):
+            stat = os.stat(item)
+            if stat.st_size < 2**20:
+                with open(file=item, mode="rb") as file:
+                    item = hashlib.sha256(file.read()).hexdigest()
+            else:
+                item = (os.path.abspath(item), stat.st_size, stat.st_mtime_ns)
+        hasher.update(repr(item).encode())
+    return hasher.hexdigest()[:16]
+
+
+def _hash_frame(df: pd.DataFrame) -> str:
+    """
+    Hash the contents of a (Geo)DataFrame, using the well-known binary
+    representation of any geometry columns.
+    """
+    hasher = hashlib.sha256(repr(list(df.columns)).encode())
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, gpd.array.GeometryDtype):
+            hasher.update(b"".join(gpd.GeoSeries(df[column]).to_wkb()))
+        else:
+            hasher.update(pd.util.hash_pandas_object(df[column]).values.tobytes())
+    return hasher.hexdigest()
+
+
+def cut_raster(
+    grid: str,
+    region: list,
+    scale: float,
+    dpi: int,
+    cachedir: str = os.path.join(
+        os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"), "cache"
+    ),
+) -> str:
+    """
+    Cut a raster to a map region, and downsample it (with a boxcar filter) to
+    the pixel size of a figure printed at a given map scale and dpi, if that is
+    coarser than the raster's own resolution.
+
+    Outputs are cached as NetCDF grids under cachedir, keyed by a hash of the
+    source file, region and output grid spacing, and are reused on later calls.
+
+    Parameters
+    ----------
+    grid : str
+        Filepath to the input raster, e.g. the MOA or velocity grid.
+    region : list
+        The [xmin, xmax, ymin, ymax] map region, in the raster's coordinates.
+    scale : float
+        The map scale denominator, e.g. sipratio for a 1:sipratio map.
+    dpi : int
+        The highest resolution the figure will be saved at, in dots per inch.
+    cachedir : str
+        Directory to store the cut rasters in. Default is a 'cache' folder
+        under the DATAHOME environment variable (or ./Quantarctica3).
+
+    Returns
+    -------
+    outgrid : str
+        Filepath to the cut (and possibly downsampled) raster.
+    """
+    # Native grid spacing, and the ground distance covered by one printed dot
+    info: list = pygmt.grdinfo(grid=grid, per_column="n").split()
+    native_spacing: float = float(info[6])
+    pixel_spacing: float = scale * 0.0254 / dpi
+    spacing: float = max(native_spacing, pixel_spacing)
+
+    # Pad the region by a pixel so that there are no gaps at the map edges
+    xmin, xmax, ymin, ymax = region
+    padded: list = [xmin - spacing, xmax + spacing, ymin - spacing, ymax + spacing]
+
+    os.makedirs(name=cachedir, exist_ok=True)
+    name: str = os.path.splitext(os.path.basename(grid))[0]
+    outgrid: str = os.path.join(
+        cachedir, f"{name}-{cache_key(grid, padded, spacing)}.nc"
+    )
+    if not os.path.exists(outgrid):
+        if spacing > native_spacing:
+            pygmt.grdfilter(
+                grid=grid,
+                filter=f"b{spacing}",
+                distance="0",
+                spacing=spacing,
+                region=padded,
+                nans="i",
+                outgrid=outgrid,
+            )
+        else:
+            pygmt.grdcut(grid=grid, region=padded, outgrid=outgrid)
+
+    return outgrid
+
+
+def read_cpt(cpt: str) -> dict:
+    """
+    Read a GMT color palette table (.cpt) file with colors given as r/g/b,
+    gray levels or names.
+
+    Parameters
+    ----------
+    cpt : str
+        Filepath to the .cpt file, e.g. cmap_moa.cpt.
+
+    Returns
+    -------
+    palette : dict
+        Dictionary with arrays 'z_low', 'z_high' of shape (n,) and 'rgb_low',
+        'rgb_high' of shape (n, 3) for each color slice, and the 'B', 'F', 'N'
+        background, foreground and NaN colors as arrays of shape (3,).
+    """
+    slices: list = []
+    palette: dict = dict(B=[0, 0, 0], F=[255, 255, 255], N=[127.5, 127.5, 127.5])
+    with open(file=cpt) as file:
+        for line in file:
+            fields: list = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if fields[0] in ("B", "F", "N"):
+                palette[fields[0]] = _color_to_rgb(fields[1])
+            else:
+                slices.append(
+                    [float(fields[0]), *_color_to_rgb(fields[1])]
+                    + [float(fields[2]), *_color_to_rgb(fields[3])]
+                )
+
+    slices: np.ndarray = np.asarray(slices)
+    palette.update(
+        z_low=slices[:, 0],
+        rgb_low=slices[:, 1:4],
+        z_high=slices[:, 4],
+        rgb_high=slices[:, 5:8],
+    )
+    return {key: np.asarray(value) for key, value in palette.items()}
+
+
+def _color_to_rgb(color: str) -> list:
+    """
+    Convert a GMT color (r/g/b, a gray level or a name) to r, g, b in 0-255.
+    """
+    if "/" in color:
+        return [float(c) for c in color.split("/")]
+    try:
+        return [float(color)] * 3
+    except ValueError:
+        pass
+    # X11 color names, where grayN is N% gray and plain gray differs from CSS
+    match = re.fullmatch(pattern=r"gr[ae]y(\d{1,3})?", string=color.lower())
+    if match:
+        level: int = 190 if match.group(1) is None else int(match.group(1))
+        return [level if match.group(1) is None else round(level * 2.55)] * 3
+    import matplotlib.colors
+
+    return [c * 255 for c in matplotlib.colors.to_rgb(color)]
+
+
+def apply_cpt(values: np.ndarray, palette: dict) -> np.ndarray:
+    """
+    Map values to float RGB colors (0-255, in the same float precision as the
+    values) using a palette from read_cpt, linearly interpolating within each
+    color slice like GMT does. Values below
+    or above the palette range get the B or F color, and NaNs stay as NaN.
+    """
+    dtype = values.dtype if values.dtype.kind == "f" else np.float64
+    palette: dict = {key: value.astype(dtype) for key, value in palette.items()}
+    index: np.ndarray = np.searchsorted(palette["z_low"], values, side="right") - 1
+    index: np.ndarray = np.clip(index, a_min=0, a_max=len(palette["z_low"]) - 1)
+    z_low, z_high = palette["z_low"][index], palette["z_high"][index]
+    weight: np.ndarray = np.clip((values - z_low) / (z_high - z_low), 0, 1)[..., None]
+    del z_low, z_high
+    rgb: np.ndarray = (1 - weight) * palette["rgb_low"][index] + weight * palette[
+        "rgb_high"
+    ][index]
+
+    rgb[values < palette["z_low"][0]] = palette["B"]
+    rgb[values > palette["z_high"][-1]] = palette["F"]
+    rgb[np.isnan(values)] = np.nan
+    return rgb
+
+
+def composite_rgb(
+    layers: list,
+    background: str = "white",
+    vectors: gpd.GeoDataFrame = None,
+    transparent: tuple = (255, 0, 255),
+    cachedir: str = os.path.join(
+        os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"), "cache"
+    ),
+) -> str:
+    """
+    Pre-composite a stack of color-mapped grids into a single RGB GeoTIFF,
+    alpha-blending each layer over the ones below it in numpy instead of using
+    PostScript transparency (which is slow to rasterize with Ghostscript).
+
+    All layers are sampled (nearest neighbour) onto the finest grid spacing
+    among them, over the extent of the bottom layer. NaN cells in a layer are
+    transparent, as with grdimage's nan_transparent=True. Pixels where the
+    layers are not opaque (e.g. only a partially transparent layer over NaN
+    cells of the layers below) are blended over the background color, which
+    should be whatever is drawn under the composite. If that is not a single
+    color (e.g. a shaded relief map), set background to None to leave those
+    pixels out of the composite, and plot the rest of the partially
+    transparent layers over it with composite_remainder. Pixels with no layer
+    at all are set to the 'transparent' color, so that they can be masked out
+    again by grdimage (which is checked to work with the installed GMT).
+
+    Vector layers (e.g. graticules) that are drawn over the bottom layer but
+    under the others can be given as 'vectors', to keep that drawing order.
+    The cells they might be drawn over only get the bottom layer, so plot the
+    composite in place of the bottom layer, then the vectors, and then the
+    other layers in those cells with composite_remainder.
+
+    Outputs are cached under cachedir, keyed by a hash of the inputs.
+
+    Parameters
+    ----------
+    layers : list
+        List of (grid, cpt, transparency) tuples from bottom to top, e.g.
+        [(moa, "cmap_moa.cpt", 0), (vel, "cmap_vel.cpt", 70)], where
+        transparency is a percentage like in pygmt.
+    background : str
+        Color of what is drawn under the composite. Default is white (i.e. the
+        paper color). Set to None if it is not a single color.
+    vectors : gpd.GeoDataFrame
+        Optional lines drawn between the bottom layer and the others, with a
+        'width' column in map units that covers their pen, e.g. as made by
+        vector_cover.
+    transparent : tuple
+        The r/g/b color used to flag fully transparent pixels. Default is
+        (255, 0, 255).
+    cachedir : str
+        Directory to store the composited image in.
+
+    Returns
+    -------
+    image : str
+        Filepath to the RGB GeoTIFF. Plot it with
+        fig.grdimage(grid=image, nan_transparent="255/0/255").
+    """
+    os.makedirs(name=cachedir, exist_ok=True)
+    _check_transparent(transparent=tuple(transparent))
+    image: str = os.path.join(
+        cachedir,
+        f"composite-{cache_key(*layers, background, vectors, transparent)}.tif",
+    )
+    if os.path.exists(image):
+        return image
+
+    # Blend with premultiplied colors in float32, i.e. 16 bytes per pixel for
+    # the composite plus the current layer's values and colors. The fraction
+    # of what is under the composite that still shows through each pixel is
+    # kept as a product, which is exactly 0 under any opaque layer
+    x, y, spacing, samples = _sample_layers(layers=layers)
+    under: np.ndarray = _vector_mask(vectors=vectors, x=x, y=y, spacing=spacing)
+    color = np.zeros(shape=(len(y), len(x), 3), dtype=np.float32)
+    showthrough = np.ones(shape=(len(y), len(x)), dtype=np.float32)
+    for i, (values, cpt, opacity) in enumerate(samples):
+        colors: np.ndarray = apply_cpt(values=values, palette=read_cpt(cpt))
+        valid: np.ndarray = ~np.isnan(values) & (~under if i > 0 else True)
+        color[valid] = opacity * colors[valid] + (1 - opacity) * color[valid]
+        showthrough[valid] *= 1 - opacity
+        del values, colors, valid
+    del under
+
+    if background is None:
+        color[showthrough > 0] = transparent
+    else:
+        color += showthrough[..., None] * np.float32(_color_to_rgb(background))
+        color[showthrough == 1] = transparent
+
+    _write_rgb(
+        image=image,
+        color=color,
+        geotransform=(x[0] - spacing / 2, spacing, 0, y[0] + spacing / 2, 0, -spacing),
+        epsg=3031,
+    )
+
+    return image
+
+
+def _write_rgb(image: str, color: np.ndarray, geotransform: tuple, epsg: int = None):
+    """
+    Write an array of shape (rows, columns, 3) of 0-255 colors to an RGB
+    GeoTIFF, rounded to 8 bits.
+    """
+    from osgeo import gdal, osr
+
+    rows, columns, _ = color.shape
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        image, columns, rows, 3, gdal.GDT_Byte, options=["COMPRESS=DEFLATE"]
+    )
+    dataset.SetGeoTransform(geotransform)
+    if epsg is not None:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        dataset.SetProjection(srs.ExportToWkt())
+    for band in range(3):
+        dataset.GetRasterBand(band + 1).WriteArray(
+            np.round(color[:, :, band]).astype(np.uint8)
+        )
+    dataset.FlushCache()
+    dataset = None
+
+
+@functools.lru_cache(maxsize=None)
+def _check_transparent(transparent: tuple):
+    """
+    Check that grdimage -Q<r/g/b> makes pixels of that color transparent when
+    plotting an RGB image with the installed GMT, by plotting a 2x2 image with
+    one such pixel over a red map and looking at the result. Raises a
+    RuntimeError if it does not, as composites would then hide what is drawn
+    under them.
+    """
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        color = np.zeros(shape=(2, 2, 3), dtype=np.float32)
+        color[0, 0] = transparent
+        _write_rgb(
+            image=f"{tmpdir}/check.tif", color=color, geotransform=(0, 1, 0, 2, 0, -1)
+        )
+        fig = pygmt.Figure()
+        fig.basemap(region=[0, 2, 0, 2], projection="X2c", frame="+gred")
+        fig.grdimage(
+            grid=f"{tmpdir}/check.tif", nan_transparent="/".join(map(str, transparent))
+        )
+        fig.savefig(fname=f"{tmpdir}/check.png", dpi=100)
+        with Image.open(f"{tmpdir}/check.png") as png:
+            pixels: np.ndarray = np.asarray(png.convert("RGB"), dtype=np.float32)
+
+    rows, columns, _ = pixels.shape
+    masked: np.ndarray = pixels[rows // 4, columns // 4]
+    opaque: np.ndarray = pixels[3 * rows // 4, 3 * columns // 4]
+    if np.abs(masked - [255, 0, 0]).max() > 32 or np.abs(opaque).max() > 32:
+        raise RuntimeError(
+            f"grdimage -Q{'/'.join(map(str, transparent))} did not make the "
+            "pixels of that color in an RGB image transparent with this GMT "
+            f"version (got {masked} over red), so composites would hide what is "
+            "drawn under them. Plot the layers separately instead."
+        )
+
+
+def composite_remainder(
+    layers: list,
+    index: int,
+    background: str = "white",
+    vectors: gpd.GeoDataFrame = None,
+    cachedir: str = os.path.join(
+        os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"), "cache"
+    ),
+) -> str:
+    """
+    Get the cells of one layer of a composite_rgb stack that were left out of
+    the composite, i.e. where the layers are not opaque in a composite made
+    with background=None, and (for all but the bottom layer) under the
+    vectors. Plotting these with the layer's cpt and transparency over the
+    composite (and whatever is drawn over and under it) gives the same result
+    as plotting the layers one by one.
+
+    Outputs are cached as NetCDF grids under cachedir, keyed by a hash of the
+    inputs.
+
+    Parameters
+    ----------
+    layers : list
+        List of (grid, cpt, transparency) tuples from bottom to top, the same as
+        given to composite_rgb.
+    index : int
+        Position of the layer in the list, e.g. 1 for the velocity layer in
+        [(moa, "cmap_moa.cpt", 0), (vel, "cmap_vel.cpt", 70)].
+    background : str
+        The background given to composite_rgb. Default is white.
+    vectors : gpd.GeoDataFrame
+        The vectors given to composite_rgb, if any.
+    cachedir : str
+        Directory to store the grid in.
+
+    Returns
+    -------
+    outgrid : str
+        Filepath to the NetCDF grid, with NaN in every other cell, or None if
+        there are no such cells.
+    """
+    os.makedirs(name=cachedir, exist_ok=True)
+    outgrid: str = os.path.join(
+        cachedir, f"remainder-{cache_key(*layers, index, background, vectors)}.nc"
+    )
+    if not os.path.exists(outgrid):
+        x, y, spacing, samples = _sample_layers(layers=layers)
+        under: np.ndarray = _vector_mask(vectors=vectors, x=x, y=y, spacing=spacing)
+        showthrough = np.ones(shape=(len(y), len(x)), dtype=np.float32)
+        for i, (values, _, opacity) in enumerate(samples):
+            showthrough[~np.isnan(values) & (~under if i > 0 else True)] *= 1 - opacity
+            if i == index:
+                remainder: np.ndarray = values
+        left_out: np.ndarray = (
+            showthrough > 0 if background is None else np.zeros_like(under)
+        )
+        if index > 0:
+            left_out |= under
+        remainder[~left_out] = np.nan
+        xr.DataArray(
+            data=remainder,
+            coords=dict(y=y, x=x),
+            dims=("y", "x"),
+            name="z",
+            attrs=dict(valid_cells=int(np.count_nonzero(~np.isnan(remainder)))),
+        ).to_netcdf(path=outgrid)
+
+    with xr.open_dataarray(outgrid) as grid:
+        return outgrid if grid.attrs["valid_cells"] > 0 else None
+
+
+def _sample_layers(layers: list) -> (np.ndarray, np.ndarray, float, iter):
+    """
+    Get the x and y coordinates and spacing of the composite grid (the finest
+    spacing among the layers, over the extent of the bottom layer), and an
+    iterator of each layer's (float32 values, cpt, opacity) on that grid, read
+    one layer at a time.
+    """
+    grids: list = [xr.open_dataarray(grid) for grid, _, _ in layers]
+    spacings: list = [float(abs(grid.x[1] - grid.x[0])) for grid in grids]
+    spacing: float = min(spacings)
+    xmin, xmax = float(grids[0].x.min()), float(grids[0].x.max())
+    ymin, ymax = float(grids[0].y.min()), float(grids[0].y.max())
+    for grid in grids:
+        grid.close()
+    x: np.ndarray = np.arange(xmin, xmax + spacing / 2, spacing)
+    y: np.ndarray = np.arange(ymax, ymin - spacing / 2, -spacing)
+
+    def _samples():
+        for (grid, cpt, transparency), grid_spacing in zip(layers, spacings):
+            with xr.open_dataarray(grid) as dataarray:
+                values: np.ndarray = dataarray.reindex(
+                    x=x, y=y, method="nearest", tolerance=grid_spacing
+                ).values.astype(np.float32)
+            yield values, cpt, np.float32(1 - transparency / 100)
+
+    return x, y, spacing, _samples()
+
+
+def vector_cover(
+    region: list,
+    scale: float,
+    lines: list = (),
+    pen: float = 2,
+    graticule: tuple = None,
+    frame: float = 0,
+) -> gpd.GeoDataFrame:
+    """
+    Outline where vector layers are drawn on a polar stereographic
+    (EPSG:3031) map, as lines with a width that covers their pen, to be left
+    out of a composite_rgb with vectors=...
+
+    Parameters
+    ----------
+    region : list
+        The [xmin, xmax, ymin, ymax] map region in EPSG:3031 metres.
+    scale : float
+        The map scale denominator, e.g. sipratio for a 1:sipratio map.
+    lines : list
+        GeoDataFrames of the lines (or polygon outlines) plotted, e.g. the
+        grounding line.
+    pen : float
+        Width in points that is at least that of the pens (plus any miters)
+        the lines and graticules are drawn with. Default is 2.
+    graticule : tuple
+        Optional (longitude, latitude) spacing in degrees of the gridlines.
+    frame : float
+        Width in points of the strip along the inside of the map frame that
+        holds its ticks and annotations (i.e. MAP_FRAME_TYPE="inside").
+        Default is 0.
+
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame
+        The lines, with their 'width' in map units.
+    """
+    metres_per_point: float = 0.0254 / 72 * scale
+    geometries: list = [g for gdf in lines for g in gdf.geometry]
+    widths: list = [pen * metres_per_point] * len(geometries)
+    if graticule is not None:
+        lon_step, lat_step = graticule
+        lats: np.ndarray = np.linspace(start=-90, stop=-40, num=501)
+        lons: np.ndarray = np.linspace(start=-180, stop=180, num=3601)
+        gridlines: gpd.GeoSeries = gpd.GeoSeries(
+            data=[
+                shapely.geometry.LineString(
+                    np.column_stack([np.full_like(lats, lon), lats])
+                )
+                for lon in np.arange(-180, 180, lon_step)
+            ]
+            + [
+                shapely.geometry.LineString(
+                    np.column_stack([lons, np.full_like(lons, lat)])
+                )
+                for lat in np.arange(-90 + lat_step, -40, lat_step)
+            ],
+            crs="EPSG:4326",
+        ).to_crs(crs="EPSG:3031")
+        geometries += list(gridlines)
+        widths += [pen * metres_per_point] * len(gridlines)
+    if frame > 0:
+        xmin, xmax, ymin, ymax = region
+        geometries.append(shapely.geometry.box(xmin, ymin, xmax, ymax).exterior)
+        widths.append(2 * frame * metres_per_point)
+
+    return gpd.GeoDataFrame(
+        data=dict(width=widths), geometry=geometries, crs="EPSG:3031"
+    )
+
+
+def _vector_mask(
+    vectors: gpd.GeoDataFrame, x: np.ndarray, y: np.ndarray, spacing: float
+) -> np.ndarray:
+    """
+    Flag the cells of a composite grid that any of the vectors might be drawn
+    over. Points are sampled every half a block along the lines, where blocks
+    of cells are about 1/32 of the line width across, and the blocks
+    within reach of half the line width (plus a cell) of those points are
+    marked. This covers every cell that a line touches, and a little more.
+    """
+    under = np.zeros(shape=(len(y), len(x)), dtype=bool)
+    if vectors is None:
+        return under
+    for width, group in vectors.groupby(by="width"):
+        block: int = max(1, int(width / spacing / 32))
+        size: float = block * spacing
+        reach: int = int(np.ceil((width / 2 + spacing + size / 4) / size))
+        rows, columns = -(-len(y) // block), -(-len(x) // block)
+        blocks = np.zeros(shape=(rows + 2 * reach, columns + 2 * reach), dtype=bool)
+        for line in (c for geometry in group.geometry for c in _line_coords(geometry)):
+            lengths: np.ndarray = np.hypot(*np.diff(line, axis=0).T)
+            steps: np.ndarray = np.maximum(np.ceil(lengths / (size / 2)), 1).astype(int)
+            segment: np.ndarray = np.repeat(np.arange(len(steps)), steps)
+            fraction: np.ndarray = (
+                np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            ) / np.repeat(steps, steps)
+            points: np.ndarray = np.concatenate(
+                [
+                    line[segment]
+                    + fraction[:, None] * (line[segment + 1] - line[segment]),
+                    line[-1:],
+                ]
+            )
+            bx: np.ndarray = np.floor((points[:, 0] - x[0] + spacing / 2) / size)
+            by: np.ndarray = np.floor((y[0] + spacing / 2 - points[:, 1]) / size)
+            bx, by = bx.astype(np.int64) + reach, by.astype(np.int64) + reach
+            inside: np.ndarray = (
+                (bx >= 0) & (bx < blocks.shape[1]) & (by >= 0) & (by < blocks.shape[0])
+            )
+            blocks[by[inside], bx[inside]] = True
+
+        # Square dilation, one axis at a time
+        wide = np.zeros(shape=(rows + 2 * reach, columns), dtype=bool)
+        for dx in range(2 * reach + 1):
+            wide |= blocks[:, dx : dx + columns]
+        near = np.zeros(shape=(rows, columns), dtype=bool)
+        for dy in range(2 * reach + 1):
+            near |= wide[dy : dy + rows]
+        under |= near.repeat(block, axis=0)[: len(y)].repeat(block, axis=1)[:, : len(x)]
+    return under
+
+
+def _line_coords(geometry) -> list:
+    """
+    Get the (n, 2) coordinate arrays of the lines or polygon rings in a
+    (multi-part) geometry.
+    """
+    if hasattr(geometry, "geoms"):
+        return [c for part in geometry.geoms for c in _line_coords(part)]
+    if isinstance(geometry, shapely.geometry.Polygon):
+        rings: list = [geometry.exterior, *geometry.interiors]
+    else:
+        rings: list = [geometry]
+    return [np.asarray(r.coords)[:, :2] for r in rings if not r.is_empty]
+
+
+def clip_simplify(
+    vector: str,
+    region: list,
+    scale: float,
+    dpi: int,
+    pixels: float = 0.5,
+    cachedir: str = os.path.join(
+        os.getenv("DATAHOME") or os.path.abspath("Quantarctica3"), "cache"
+    ),
+) -> gpd.GeoDataFrame:
+    """
+    Clip vector geometries to a map region and simplify them with a tolerance
+    matched to the printed pixel size, so that off-map vertices and vertices
+    far closer together than a pixel are not sent to GMT.
+
+    Outputs are cached as FlatGeobuf files under cachedir, keyed by a hash of
+    the source file, region and simplification tolerance.
+
+    Parameters
+    ----------
+    vector : str
+        Filepath to the input vector file, e.g. the grounding line shapefile.
+    region : list
+        The [xmin, xmax, ymin, ymax] map region, in the vector's coordinates.
+    scale : float
+        The map scale denominator, e.g. sipratio for a 1:sipratio map.
+    dpi : int
+        The highest resolution the figure will be saved at, in dots per inch.
+    pixels : float
+        The simplification tolerance, in number of printed pixels. Default is
+        0.5.
+    cachedir : str
+        Directory to store the prepared vector files in. Default is a 'cache'
+        folder under the DATAHOME environment variable (or ./Quantarctica3).
+
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame
+        The clipped and simplified geometries.
+    """
+    tolerance: float = pixels * scale * 0.0254 / dpi
+    xmin, xmax, ymin, ymax = region
+    # Pad the region a little so that lines don't stop short of the map edges
+    pad: float = 0.01 * max(xmax - xmin, ymax - ymin)
+    bbox: tuple = (xmin - pad, ymin - pad, xmax + pad, ymax + pad)
+
+    os.makedirs(name=cachedir, exist_ok=True)
+    name: str = os.path.splitext(os.path.basename(vector))[0]
+    outfile: str = os.path.join(
+        cachedir, f"{name}-{cache_key(vector, bbox, tolerance)}.fgb"
+    )
+    if os.path.exists(outfile):
+        return gpd.read_file(filename=outfile)
+
+    gdf: gpd.GeoDataFrame = gpd.read_file(filename=vector, bbox=bbox)
+    gdf: gpd.GeoDataFrame = gpd.clip(gdf=gdf, mask=shapely.geometry.box(*bbox))
+    gdf["geometry"] = gdf.geometry.simplify(tolerance=tolerance)
+    gdf: gpd.GeoDataFrame = gdf[~gdf.geometry.is_empty].reset_index(drop=True)
+    gdf.to_file(filename=outfile, driver="FlatGeobuf")
+
+    return gdf
@@ -0,0 +1,922 @@
+"""
+Helper functions for handling the ICESat-2 ATL11 point cloud over Antarctica,
+used by the 3d_sketchfab_model notebook to go from the (very big) pre-processed
+dhdt parquet table to something small enough to render in 3D, or to the points
+inside each subglacial lake.
+"""
+
+import concurrent.futures
+import json
+import os
+
+import fastparquet
+import numpy as np
+import pandas as pd
+
+# Running least squares regression state of height (h) over time (t) for each
+# point: the number of observations, mean time and height, and the sums of
+# squared time deviations (tt) and time-height co-deviations (th), so that the
+# slope dhdt = th / tt can be updated one cycle at a time
+REGRESSION_DTYPE: list = [
+    ("n", "f8"),
+    ("t", "f8"),
+    ("h", "f8"),
+    ("tt", "f8"),
+    ("th", "f8"),
+]
+
+
+def iter_dhdt_chunks(
+    path: str = "df_dhdt_siple_coast.parquet",
+    dhdt_threshold: float = None,
+    columns: tuple = ("x", "y", "h_corr_11", "dhdt_slope"),
+    extra_columns: tuple = (),
+):
+    """
+    Stream an ATL11 dhdt parquet table one row group at a time, yielding only
+    the points where abs(dhdt_slope) > dhdt_threshold.
+
+    Only the requested columns are read, and row groups whose min/max
+    statistics show that no point can pass the threshold are skipped without
+    being decompressed. Each remaining row group is filtered, stripped of NaNs
+    and downcast to float32 before being yielded.
+
+    Parameters
+    ----------
+    path : str
+        Filepath to the parquet file, e.g. as produced by atlxi_dhdt.ipynb.
+    dhdt_threshold : float
+        Minimum absolute rate of elevation change (m/yr) for a point to be
+        kept. Default is None which keeps all non-NaN points.
+    columns : tuple
+        Names of the columns to read, with the dhdt column last. Default is
+        ("x", "y", "h_corr_11", "dhdt_slope").
+    extra_columns : tuple
+        Names of any other columns to read for the same points, which may have
+        NaNs, e.g. the h_corr and utc_time of each cycle. Default is ().
+
+    Yields
+    ------
+    array : np.ndarray
+        A float32 array of shape (m, len(columns)) with the columns in the
+        order given.
+    extra : np.ndarray
+        Only if extra_columns are given, a float64 array of shape
+        (m, len(extra_columns)), with any datetime columns converted to
+        decimal years since 2018 (see decimal_years).
+    """
+    dhdt_col: str = columns[-1]
+    parquetfile = fastparquet.ParquetFile(fn=path)
+    # Row groups pass if dhdt_slope > threshold OR dhdt_slope < -threshold
+    filters: list = (
+        [[(dhdt_col, ">", dhdt_threshold)], [(dhdt_col, "<", -dhdt_threshold)]]
+        if dhdt_threshold is not None
+        else None
+    )
+
+    for df in parquetfile.iter_row_groups(
+        filters=filters, columns=[*columns, *extra_columns]
+    ):
+        array: np.ndarray = df[list(columns)].to_numpy(dtype=np.float32)
+        extra: np.ndarray = np.column_stack(
+            [decimal_years(df[column].to_numpy()) for column in extra_columns]
+            or [np.empty(shape=(len(df), 0))]
+        )
+        del df
+        mask: np.ndarray = ~np.isnan(array).any(axis=1)
+        if dhdt_threshold is not None:
+            mask &= np.abs(array[:, -1]) > dhdt_threshold
+        if mask.any():
+            yield (array[mask], extra[mask]) if extra_columns else array[mask]
+
+
+def load_dhdt_points(
+    path: str = "df_dhdt_siple_coast.parquet",
+    dhdt_threshold: float = 0.12,
+    columns: tuple = ("x", "y", "h_corr_11", "dhdt_slope"),
+) -> pd.DataFrame:
+    """
+    Load the points from an ATL11 dhdt parquet table where
+    abs(dhdt_slope) > dhdt_threshold, streaming in one row group at a time (see
+    iter_dhdt_chunks) so that peak memory scales with the filtered point cloud
+    rather than the input file.
+
+    Parameters
+    ----------
+    path : str
+        Filepath to the parquet file, e.g. as produced by atlxi_dhdt.ipynb.
+    dhdt_threshold : float
+        Minimum absolute rate of elevation change (m/yr) for a point to be
+        kept. Default is 0.12.
+    columns : tuple
+        Names of the x, y, height and dhdt columns to read, in that order.
+        Default is ("x", "y", "h_corr_11", "dhdt_slope").
+
+    Returns
+    -------
+    points : pd.DataFrame
+        A table with float32 columns x, y, z and dhdt_slope, where z is the
+        height column renamed.
+    """
+    chunks: list = list(
+        iter_dhdt_chunks(path=path, dhdt_threshold=dhdt_threshold, columns=columns)
+    )
+    if chunks:
+        array: np.ndarray = np.concatenate(chunks)
+    else:
+        array: np.ndarray = np.empty(shape=(0, 4), dtype=np.float32)
+    del chunks
+
+    return pd.DataFrame(
+        data={
+            "x": array[:, 0],
+            "y": array[:, 1],
+            "z": array[:, 2],
+            "dhdt_slope": array[:, 3],
+        },
+        copy=False,
+    )
+
+
+def morton_code(
+    x: np.ndarray, y: np.ndarray, region: list = None, bits: int = 16
+) -> np.ndarray:
+    """
+    Compute Morton (Z-order) codes for x/y coordinates, by quantizing each
+    axis to an unsigned integer grid over the region and interleaving the bits
+    of the two integers.
+
+    Points that are close together in x/y space will (mostly) have Morton codes
+    that are close together too, so sorting by the code gives a spatially
+    coherent ordering of the point cloud.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The x coordinates, e.g. in EPSG:3031 metres.
+    y : np.ndarray
+        The y coordinates, same shape as x.
+    region : list
+        Bounding box [xmin, xmax, ymin, ymax] to quantize over. Default is None
+        which uses the min/max of the x and y arrays.
+    bits : int
+        Number of bits used per axis, up to 32. Default is 16.
+
+    Returns
+    -------
+    codes : np.ndarray
+        The uint64 Morton code of each point.
+    """
+    if region is None:
+        region = [np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y)]
+    xmin, xmax, ymin, ymax = region
+    maxint: int = (1 << bits) - 1
+
+    def _quantize(arr: np.ndarray, low: float, high: float) -> np.ndarray:
+        scale: float = maxint / max(high - low, np.finfo(np.float32).tiny)
+        return np.clip((arr - low) * scale, a_min=0, a_max=maxint)
+
+    return _part1by1(_quantize(x, xmin, xmax)) | (
+        _part1by1(_quantize(y, ymin, ymax)) << np.uint64(1)
+    )
+
+
+def build_dhdt_cache(
+    path: str = "df_dhdt_siple_coast.parquet",
+    cachedir: str = "df_dhdt_siple_coast_cache",
+    dhdt_threshold: float = 0.0,
+    block_size: int = 65536,
+    cycles: list = None,
+) -> str:
+    """
+    One-time conversion of an ATL11 dhdt parquet table into a memory-mappable
+    columnar cache, with points sorted along a Morton (Z-order) curve.
+
+    The cache directory contains:
+
+    - xyz.npy : float32 array of shape (n, 3) with x, y, h_corr_11
+    - dhdt_slope.npy : float32 array of shape (n,)
+    - blocks.npy : a small index with the start/stop offsets, bounding box
+      and dhdt_slope min/max of every run of block_size points
+    - codes.npy : uint64 array of shape (n,) with the sorted Morton codes
+    - metadata.json : the region and bits the Morton codes were computed
+      with, and the cycles appended since (see append_dhdt_cycle)
+    - regression.npy : only if cycles are given, the running least squares
+      regression state of height over time of every point (see
+      REGRESSION_DTYPE)
+
+    Parameters
+    ----------
+    path : str
+        Filepath to the input parquet file.
+    cachedir : str
+        Directory to write the cache to. Will be created if it does not exist.
+    dhdt_threshold : float
+        Only points with abs(dhdt_slope) > dhdt_threshold are cached. Default is
+        0.0 which keeps every non-zero, non-NaN point.
+    block_size : int
+        Number of points per block in the block index. Default is 65536.
+    cycles : list
+        List of (height, time) column pairs, one per ICESat-2 cycle, e.g.
+        [("h_corr_3", "utc_time_3"), ..., ("h_corr_11", "utc_time_11")], to
+        store the regression state needed to append new cycles later. Default
+        is None which doesn't.
+
+    Returns
+    -------
+    cachedir : str
+        The directory the cache was written to.
+    """
+    os.makedirs(name=cachedir, exist_ok=True)
+    if cycles:
+        points, state = _load_regression(
+            path=path, dhdt_threshold=dhdt_threshold, cycles=cycles
+        )
+    else:
+        points: pd.DataFrame = load_dhdt_points(
+            path=path, dhdt_threshold=dhdt_threshold
+        )
+        state: np.ndarray = None
+    x: np.ndarray = points.x.to_numpy()
+    y: np.ndarray = points.y.to_numpy()
+    region: list = (
+        [float(x.min()), float(x.max()), float(y.min()), float(y.max())]
+        if len(x)
+        else [0.0, 1.0, 0.0, 1.0]
+    )
+    bits: int = 16
+    codes: np.ndarray = morton_code(x=x, y=y, region=region, bits=bits)
+    order: np.ndarray = np.argsort(codes, kind="stable")
+    np.save(file=f"{cachedir}/codes.npy", arr=codes[order])
+    del codes
+    if state is not None:
+        np.save(file=f"{cachedir}/regression.npy", arr=state[order])
+        del state
+    with open(file=f"{cachedir}/metadata.json", mode="w") as file:
+        json.dump(
+            obj=dict(region=region, bits=bits, regression=bool(cycles), cycles={}),
+            fp=file,
+            indent=1,
+        )
+
+    xyz: np.memmap = np.lib.format.open_memmap(
+        filename=f"{cachedir}/xyz.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(order), 3),
+    )
+    for i, column in enumerate(["x", "y", "z"]):
+        xyz[:, i] = points[column].to_numpy()[order]
+    dhdt: np.ndarray = points.dhdt_slope.to_numpy()[order]
+    del points, order
+    np.save(file=f"{cachedir}/dhdt_slope.npy", arr=dhdt)
+
+    starts: np.ndarray = np.arange(0, len(dhdt), block_size)
+    blocks = np.empty(
+        shape=len(starts),
+        dtype=[
+            ("start", "i8"),
+            ("stop", "i8"),
+            ("xmin", "f4"),
+            ("xmax", "f4"),
+            ("ymin", "f4"),
+            ("ymax", "f4"),
+            ("dhdt_min", "f4"),
+            ("dhdt_max", "f4"),
+        ],
+    )
+    blocks["start"] = starts
+    blocks["stop"] = np.append(starts[1:], len(dhdt))
+    if len(starts) > 0:
+        blocks["xmin"] = np.minimum.reduceat(xyz[:, 0], starts)
+        blocks["xmax"] = np.maximum.reduceat(xyz[:, 0], starts)
+        blocks["ymin"] = np.minimum.reduceat(xyz[:, 1], starts)
+        blocks["ymax"] = np.maximum.reduceat(xyz[:, 1], starts)
+        blocks["dhdt_min"] = np.minimum.reduceat(dhdt, starts)
+        blocks["dhdt_max"] = np.maximum.reduceat(dhdt, starts)
+    np.save(file=f"{cachedir}/blocks.npy", arr=blocks)
+    xyz.flush()
+
+    return cachedir
+
+
+def query_dhdt_cache(
+    cachedir: str = "df_dhdt_siple_coast_cache",
+    region: list = None,
+    dhdt_threshold: float = 0.0,
+    z_scale: float = 1.0,
+    block_ids: np.ndarray = None,
+) -> (np.ndarray, np.ndarray):
+    """
+    Select points from a cache made by build_dhdt_cache that are inside a
+    bounding box and have abs(dhdt_slope) > dhdt_threshold.
+
+    Only blocks whose bounding box and dhdt_slope range can contain matching
+    points are read from the memory-mapped arrays. The output xyz array is
+    C-contiguous float32 so it can be passed to pv.PolyData without a copy.
+
+    Parameters
+    ----------
+    cachedir : str
+        Directory holding the cache.
+    region : list
+        Bounding box [xmin, xmax, ymin, ymax] in the same coordinates as the
+        point cloud, e.g. sipreg. Default is None which selects everywhere.
+    dhdt_threshold : float
+        Minimum absolute rate of elevation change (m/yr). Default is 0.0. Set
+        to None to select points regardless of their dhdt_slope.
+    z_scale : float
+        Vertical exaggeration applied to the output z column. Default is 1.0.
+    block_ids : np.ndarray
+        Only select points from these blocks of the cache, e.g. those changed
+        by append_dhdt_cycle. Default is None which uses all blocks.
+
+    Returns
+    -------
+    xyz : np.ndarray
+        float32 array of shape (n, 3) with the x, y, z of the selected points.
+    dhdt_slope : np.ndarray
+        float32 array of shape (n,) with the dhdt_slope of the selected points.
+    """
+    xyz: np.memmap = np.load(file=f"{cachedir}/xyz.npy", mmap_mode="r")
+    dhdt: np.memmap = np.load(file=f"{cachedir}/dhdt_slope.npy", mmap_mode="r")
+    blocks: np.ndarray = np.load(file=f"{cachedir}/blocks.npy")
+
+    # Keep blocks that could have points passing the dhdt and region filters
+    keep: np.ndarray = np.ones(shape=len(blocks), dtype=bool)
+    if dhdt_threshold is not None:
+        keep &= (blocks["dhdt_min"] < -dhdt_threshold) | (
+            blocks["dhdt_max"] > dhdt_threshold
+        )
+    if block_ids is not None:
+        keep &= np.isin(np.arange(len(blocks)), block_ids)
+    if region is not None:
+        xmin, xmax, ymin, ymax = region
+        keep &= (blocks["xmax"] >= xmin) & (blocks["xmin"] <= xmax)
+        keep &= (blocks["ymax"] >= ymin) & (blocks["ymin"] <= ymax)
+
+    # First pass finds the matching points in each candidate block, so that the
+    # output arrays can be allocated at exactly the right size
+    masks: list = []
+    for block in blocks[keep]:
+        _slice = slice(block["start"], block["stop"])
+        mask: np.ndarray = (
+            np.abs(dhdt[_slice]) > dhdt_threshold
+            if dhdt_threshold is not None
+            else np.ones(shape=block["stop"] - block["start"], dtype=bool)
+        )
+        if region is not None:
+            _x, _y = xyz[_slice, 0], xyz[_slice, 1]
+            mask &= (_x >= xmin) & (_x <= xmax) & (_y >= ymin) & (_y <= ymax)
+        masks.append((_slice, mask))
+
+    size: int = sum(int(mask.sum()) for _, mask in masks)
+    out_xyz: np.ndarray = np.empty(shape=(size, 3), dtype=np.float32)
+    out_dhdt: np.ndarray = np.empty(shape=size, dtype=np.float32)
+    offset: int = 0
+    for _slice, mask in masks:
+        count: int = int(mask.sum())
+        out_xyz[offset : offset + count] = xyz[_slice][mask]
+        out_dhdt[offset : offset + count] = dhdt[_slice][mask]
+        offset += count
+
+    if z_scale != 1.0:
+        out_xyz[:, 2] *= z_scale
+
+    return out_xyz, out_dhdt
+
+
+def append_dhdt_cycle(
+    cachedir: str = "df_dhdt_siple_coast_cache",
+    path: str = None,
+    cycle: str = None,
+    columns: tuple = ("x", "y", "h_corr", "utc_time"),
+    update_z: bool = True,
+) -> np.ndarray:
+    """
+    Update a cache made by build_dhdt_cache(cycles=...) with the heights from
+    one new ICESat-2 cycle, in time proportional to the new data.
+
+    Each new point is matched to a cached point with the same x and y, by
+    looking up its Morton code in the sorted codes of the cache. The running
+    regression state of the matched points is updated with the new height and
+    time, and their dhdt_slope (and z) are rewritten in place. The dhdt_slope
+    range of the blocks they are in is then recomputed. New points that are
+    not in the cache are skipped, and counted in metadata.json, as adding them
+    needs the cache to be rebuilt.
+
+    Parameters
+    ----------
+    cachedir : str
+        Directory holding the cache.
+    path : str or pd.DataFrame
+        Filepath to a parquet table (or a table) of the new cycle's points.
+    cycle : str
+        Name of the new cycle, e.g. '12'. Cycles that have already been
+        appended are skipped.
+    columns : tuple
+        Names of the x, y, height and time columns, in that order. Default is
+        ("x", "y", "h_corr", "utc_time").
+    update_z : bool
+        Set the z of the updated points to their new height. Default is True.
+
+    Returns
+    -------
+    block_ids : np.ndarray
+        Sorted indices of the blocks of the cache with points that changed,
+        e.g. to pass to query_dhdt_cache or block_code_ranges.
+    """
+    metadata: dict = cache_metadata(cachedir=cachedir)
+    if not metadata.get("regression"):
+        raise ValueError(
+            f"The cache in {cachedir} has no regression state, "
+            "rebuild it with build_dhdt_cache(cycles=...) first."
+        )
+    if cycle in metadata["cycles"]:
+        return np.asarray(metadata["cycles"][cycle]["block_ids"], dtype=np.int64)
+
+    df: pd.DataFrame = (
+        fastparquet.ParquetFile(fn=path).to_pandas(columns=list(columns))
+        if isinstance(path, str)
+        else path[list(columns)]
+    )
+    x: np.ndarray = df[columns[0]].to_numpy(dtype=np.float32)
+    y: np.ndarray = df[columns[1]].to_numpy(dtype=np.float32)
+    h: np.ndarray = df[columns[2]].to_numpy(dtype=np.float64)
+    t: np.ndarray = decimal_years(df[columns[3]].to_numpy())
+    del df
+    valid: np.ndarray = ~(np.isnan(x) | np.isnan(y) | np.isnan(h) | np.isnan(t))
+    x, y, h, t = x[valid], y[valid], h[valid], t[valid]
+
+    # Find the cached points with exactly the same x and y, among those with
+    # the same Morton code
+    cache_codes: np.memmap = np.load(file=f"{cachedir}/codes.npy", mmap_mode="r")
+    xyz: np.memmap = np.load(file=f"{cachedir}/xyz.npy", mmap_mode="r+")
+    codes: np.ndarray = morton_code(
+        x=x, y=y, region=metadata["region"], bits=metadata["bits"]
+    )
+    lo: np.ndarray = np.searchsorted(cache_codes, codes, side="left")
+    hi: np.ndarray = np.searchsorted(cache_codes, codes, side="right")
+    counts: np.ndarray = hi - lo
+    rows: np.ndarray = np.repeat(np.arange(len(codes)), counts)
+    candidates: np.ndarray = (
+        np.repeat(lo, counts)
+        + np.arange(len(rows))
+        - np.repeat(counts.cumsum() - counts, counts)
+    )
+    match: np.ndarray = (xyz[candidates, 0] == x[rows]) & (
+        xyz[candidates, 1] == y[rows]
+    )
+    index, first = np.unique(candidates[match], return_index=True)
+    rows = rows[match][first]
+
+    # Update the regression state, dhdt_slope and z of the matched points
+    regression: np.memmap = np.load(file=f"{cachedir}/regression.npy", mmap_mode="r+")
+    dhdt: np.memmap = np.load(file=f"{cachedir}/dhdt_slope.npy", mmap_mode="r+")
+    state: np.ndarray = regression[index]
+    _regress(state=state, h=h[rows], t=t[rows])
+    regression[index] = state
+    slope: np.ndarray = _regression_slope(state=state)
+    dhdt[index] = np.where(np.isnan(slope), dhdt[index], slope)
+    if update_z:
+        xyz[index, 2] = h[rows]
+
+    # Recompute the dhdt_slope range of the changed blocks
+    blocks: np.ndarray = np.load(file=f"{cachedir}/blocks.npy")
+    block_ids: np.ndarray = np.unique(
+        np.searchsorted(blocks["start"], index, side="right") - 1
+    )
+    for i in block_ids:
+        values: np.ndarray = dhdt[blocks["start"][i] : blocks["stop"][i]]
+        blocks["dhdt_min"][i], blocks["dhdt_max"][i] = values.min(), values.max()
+    np.save(file=f"{cachedir}/blocks.npy", arr=blocks)
+    for array in (regression, dhdt, xyz):
+        array.flush()
+
+    metadata["cycles"][cycle] = dict(
+        points=len(index),
+        skipped=int(len(x) - len(index)),
+        block_ids=block_ids.tolist(),
+    )
+    with open(file=f"{cachedir}/metadata.json", mode="w") as file:
+        json.dump(obj=metadata, fp=file, indent=1)
+
+    return block_ids
+
+
+def cache_metadata(cachedir: str = "df_dhdt_siple_coast_cache") -> dict:
+    """
+    Read the metadata.json of a cache made by build_dhdt_cache, with the
+    'region' and 'bits' of its Morton codes, and the 'cycles' appended to it.
+    """
+    with open(file=f"{cachedir}/metadata.json") as file:
+        return json.load(fp=file)
+
+
+def block_code_ranges(
+    cachedir: str = "df_dhdt_siple_coast_cache", block_ids: np.ndarray = None
+) -> np.ndarray:
+    """
+    Get the [first, last + 1) Morton code range of the points in some blocks of
+    a cache, as an array of shape (k, 2), e.g. to tell export3d.write_3dtiles
+    which of its tiles need to be rewritten.
+    """
+    codes: np.memmap = np.load(file=f"{cachedir}/codes.npy", mmap_mode="r")
+    blocks: np.ndarray = np.load(file=f"{cachedir}/blocks.npy")
+    if block_ids is not None:
+        blocks = blocks[np.asarray(block_ids, dtype=np.int64)]
+    return np.column_stack(
+        [codes[blocks["start"]], codes[blocks["stop"] - 1] + np.uint64(1)]
+    ).astype(np.uint64)
+
+
+def decimal_years(values: np.ndarray) -> np.ndarray:
+    """
+    Convert datetime64 values to float64 decimal years since 2018-01-01 (close
+    to the start of the ICESat-2 mission), with NaT as NaN. Other values are
+    just cast to float64.
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        delta: np.ndarray = values - np.datetime64("2018-01-01")
+        years: np.ndarray = delta / np.timedelta64(1, "D") / 365.25
+        return np.where(np.isnat(values), np.nan, years)
+    return values.astype(np.float64)
+
+
+def _load_regression(
+    path: str, dhdt_threshold: float, cycles: list
+) -> (pd.DataFrame, np.ndarray):
+    """
+    Load the points like load_dhdt_points, along with their regression state
+    over the (height, time) column pairs of each cycle.
+    """
+    chunks: list = []
+    states: list = []
+    for array, extra in iter_dhdt_chunks(
+        path=path,
+        dhdt_threshold=dhdt_threshold,
+        extra_columns=[column for pair in cycles for column in pair],
+    ):
+        state: np.ndarray = np.zeros(shape=len(array), dtype=REGRESSION_DTYPE)
+        for i in range(len(cycles)):
+            _regress(state=state, h=extra[:, 2 * i], t=extra[:, 2 * i + 1])
+        chunks.append(array)
+        states.append(state)
+
+    array: np.ndarray = (
+        np.concatenate(chunks) if chunks else np.empty(shape=(0, 4), dtype=np.float32)
+    )
+    state: np.ndarray = (
+        np.concatenate(states) if states else np.zeros(shape=0, dtype=REGRESSION_DTYPE)
+    )
+    del chunks, states
+    points: pd.DataFrame = pd.DataFrame(
+        data={
+            "x": array[:, 0],
+            "y": array[:, 1],
+            "z": array[:, 2],
+            "dhdt_slope": array[:, 3],
+        },
+        copy=False,
+    )
+    return points, state
+
+
+def _regress(state: np.ndarray, h: np.ndarray, t: np.ndarray):
+    """
+    Add one (time, height) observation per point to a regression state array
+    in place, with Welford's online algorithm. NaN observations are skipped.
+    """
+    ok: np.ndarray = ~(np.isnan(h) | np.isnan(t))
+    h, t = h[ok], t[ok]
+    n: np.ndarray = state["n"][ok] + 1
+    dt: np.ndarray = t - state["t"][ok]
+    mean_t: np.ndarray = state["t"][ok] + dt / n
+    mean_h: np.ndarray = state["h"][ok] + (h - state["h"][ok]) / n
+    state["tt"][ok] += dt * (t - mean_t)
+    state["th"][ok] += dt * (h - mean_h)
+    state["n"][ok], state["t"][ok], state["h"][ok] = n, mean_t, mean_h
+
+
+def _regression_slope(state: np.ndarray) -> np.ndarray:
+    """
+    Ordinary least squares slope (e.g. dhdt in m/yr) of a regression state,
+    or NaN where there are fewer than two distinct times.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(state["tt"] > 0, state["th"] / state["tt"], np.nan).astype(
+            np.float32
+        )
+
+
+def octree_decimate(
+    xyz: np.ndarray,
+    dhdt_slope: np.ndarray,
+    target_points: int = None,
+    target_bytes: int = None,
+    bytes_per_point: int = 16,
+) -> np.ndarray:
+    """
+    Thin out a point cloud using an octree, keeping one representative point
+    per occupied cell, chosen as the point with the largest abs(dhdt_slope) so
+    that the strongest lake drainage/filling signals survive.
+
+    The octree level (and hence cell size) is chosen automatically as the
+    finest level with no more occupied cells than the target number of points.
+    As each coarser level can have up to 8 times fewer cells, the rest of the
+    budget is then topped up with the most extreme points of the next finer
+    level's cells. All levels are evaluated from a single sort of 3D Morton
+    codes, so this scales to hundreds of millions of points.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Array of shape (n, 3) with the point coordinates, after any vertical
+        exaggeration has been applied (cells are cubes).
+    dhdt_slope : np.ndarray
+        Array of shape (n,) with the rate of elevation change of each point.
+    target_points : int
+        Maximum number of points to keep. This is an upper bound, which is
+        reached whenever there are more points than that to start with, so a
+        target of less than one point keeps no points at all.
+    target_bytes : int
+        Maximum output file size, used instead of target_points if provided.
+        Also an upper bound, as long as bytes_per_point is not underestimated.
+    bytes_per_point : int
+        Estimated number of bytes each point takes up in the output file, used
+        to convert target_bytes into a number of points. Default is 16 (float32
+        xyz plus an RGBA colour).
+
+    Returns
+    -------
+    indices : np.ndarray
+        Sorted integer indices of the points to keep.
+    """
+    if target_bytes is not None:
+        target_points: int = target_bytes // bytes_per_point
+    if target_points is None:
+        raise ValueError("Either target_points or target_bytes must be provided")
+    if target_points < 1:
+        return np.arange(0)
+    if target_points >= len(xyz):
+        return np.arange(len(xyz))
+
+    # Quantize points onto the finest octree level, inside a bounding cube
+    bits: int = 21
+    lowest: np.ndarray = xyz.min(axis=0)
+    extent: float = float((xyz.max(axis=0) - lowest).max()) or 1.0
+    codes = np.zeros(shape=len(xyz), dtype=np.uint64)
+    for axis in range(3):
+        quantized: np.ndarray = np.clip(
+            (xyz[:, axis] - lowest[axis]) * (((1 << bits) - 1) / extent),
+            a_min=0,
+            a_max=(1 << bits) - 1,
+        )
+        codes |= _part1by2(quantized) << np.uint64(axis)
+    order: np.ndarray = np.argsort(codes)
+    codes: np.ndarray = codes[order]
+
+    # Find the finest level that does not exceed the target number of points,
+    # keeping the cells of the next finer level (or the points themselves)
+    finer: np.ndarray = np.arange(len(codes))
+    for level in range(bits, -1, -1):
+        cells: np.ndarray = codes >> np.uint64(3 * (bits - level))
+        starts: np.ndarray = np.insert(np.flatnonzero(np.diff(cells)) + 1, 0, 0)
+        if len(starts) <= target_points:
+            break
+        finer: np.ndarray = starts
+    del codes, cells
+
+    # Pick the point with the most extreme dhdt_slope in each occupied cell,
+    # with NaN slopes ranked below every other point
+    absdhdt: np.ndarray = np.nan_to_num(np.abs(dhdt_slope[order]), nan=-1.0)
+    picks: np.ndarray = _cell_extremes(values=absdhdt, starts=starts)
+
+    # Top up to the target with the most extreme points of the finer cells. A
+    # cell's extreme point is also the extreme point of the finer cell that it
+    # is in, so these are the finer cells' extreme points not yet picked
+    extras: np.ndarray = np.setdiff1d(
+        _cell_extremes(values=absdhdt, starts=finer), picks, assume_unique=True
+    )
+    extras: np.ndarray = extras[
+        np.argsort(-absdhdt[extras], kind="stable")[: target_points - len(picks)]
+    ]
+
+    return np.sort(order[np.concatenate([picks, extras])])
+
+
+def _cell_extremes(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Index of the first largest value in each cell of a sorted array, where
+    cells are contiguous runs beginning at the (sorted) starts indices.
+    """
+    cellmax: np.ndarray = np.maximum.reduceat(values, starts)
+    lengths: np.ndarray = np.diff(np.append(starts, len(values)))
+    candidates: np.ndarray = np.flatnonzero(values == np.repeat(cellmax, lengths))
+    return candidates[np.searchsorted(candidates, starts)]
+
+
+def extract_lake_points(
+    gdf_lakes,
+    path: str = "df_dhdt_siple_coast.parquet",
+    by: str = "lake_name",
+    columns: list = None,
+    cellsize: float = 10_000,
+    max_workers: int = None,
+) -> dict:
+    """
+    Extract the points inside each lake outline from an ATL11 dhdt parquet
+    table, in a single pass over the data.
+
+    Each row group's points are bucketed into a uniform grid (sorted by cell
+    id), so that every lake only looks at the points in the grid cells under
+    its bounding box. These candidates are tested against the lake's bounding
+    box and then its exact outline, using vectorized ray casting, with the
+    lakes done in parallel threads.
+
+    Parameters
+    ----------
+    gdf_lakes : gpd.GeoDataFrame
+        Lake outlines in the same coordinates as the points, with the lake
+        names in column 'by'. Outlines with the same name are dissolved.
+    path : str
+        Filepath to the parquet file, e.g. as produced by atlxi_dhdt.ipynb.
+    by : str
+        Name of the column with the lake names. Default is 'lake_name'.
+    columns : list
+        Names of the columns to read, which must include x and y. Default is
+        None which reads all columns, e.g. the h_corr_* heights for each
+        ICESat-2 cycle to make a time-series.
+    cellsize : float
+        Size of the grid cells used to bucket the points. Default is 10 km.
+    max_workers : int
+        Number of threads to test lakes with. Default is None which lets
+        concurrent.futures decide.
+
+    Returns
+    -------
+    lake_points : dict
+        Mapping of each lake name to a pd.DataFrame of the points inside it.
+    """
+    gdf_lakes = gdf_lakes.dissolve(by=by)
+    names: list = list(gdf_lakes.index)
+    bounds: np.ndarray = gdf_lakes.bounds.to_numpy()
+    edges: list = [_polygon_edges(geom) for geom in gdf_lakes.geometry]
+
+    # Grid over all the lakes, and the range of cells under each lake
+    xmin, ymin = bounds[:, :2].min(axis=0)
+    xmax, ymax = bounds[:, 2:].max(axis=0)
+    nx: int = int((xmax - xmin) // cellsize) + 1
+    ny: int = int((ymax - ymin) // cellsize) + 1
+    cellranges: np.ndarray = np.column_stack(
+        [
+            (bounds[:, 0] - xmin) // cellsize,
+            (bounds[:, 2] - xmin) // cellsize,
+            (bounds[:, 1] - ymin) // cellsize,
+            (bounds[:, 3] - ymin) // cellsize,
+        ]
+    ).astype(np.int64)
+
+    parquetfile = fastparquet.ParquetFile(fn=path)
+    columns: list = list(columns or parquetfile.columns)
+    # Skip row groups whose min/max statistics are outside of all the lakes
+    filters: list = [
+        [("x", ">=", xmin), ("x", "<=", xmax), ("y", ">=", ymin), ("y", "<=", ymax)]
+    ]
+    subsets: dict = {name: [] for name in names}
+    empty: pd.DataFrame = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for df in parquetfile.iter_row_groups(filters=filters, columns=columns):
+            df = df[columns].reset_index(drop=True)
+            empty = df.iloc[:0]
+            x: np.ndarray = df["x"].to_numpy(dtype=np.float64)
+            y: np.ndarray = df["y"].to_numpy(dtype=np.float64)
+
+            # Bucket the points by grid cell
+            with np.errstate(invalid="ignore"):
+                ix: np.ndarray = (x - xmin) // cellsize
+                iy: np.ndarray = (y - ymin) // cellsize
+            rows: np.ndarray = np.flatnonzero(
+                (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+            )
+            cells: np.ndarray = (iy[rows] * nx + ix[rows]).astype(np.int64)
+            order: np.ndarray = np.argsort(cells, kind="stable")
+            rows, cells = rows[order], cells[order]
+
+            futures: dict = {
+                executor.submit(
+                    _lake_rows,
+                    x=x,
+                    y=y,
+                    rows=rows,
+                    cells=cells,
+                    nx=nx,
+                    cellrange=cellranges[i],
+                    bbox=bounds[i],
+                    edges=edges[i],
+                ): name
+                for i, name in enumerate(names)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                index: np.ndarray = future.result()
+                if len(index):
+                    subsets[futures[future]].append(df.iloc[index])
+
+    return {
+        name: (
+            pd.concat(objs=parts, ignore_index=True)
+            if parts
+            else (empty if empty is not None else pd.DataFrame(columns=columns))
+        )
+        for name, parts in subsets.items()
+    }
+
+
+def _lake_rows(
+    x: np.ndarray,
+    y: np.ndarray,
+    rows: np.ndarray,
+    cells: np.ndarray,
+    nx: int,
+    cellrange: np.ndarray,
+    bbox: np.ndarray,
+    edges: np.ndarray,
+) -> np.ndarray:
+    """
+    Find the (sorted) indices of the points inside one lake, given the point
+    rows sorted by their grid cell id.
+    """
+    ix0, ix1, iy0, iy1 = cellrange
+    # Cells under the bounding box are contiguous ids along each grid row
+    row_starts: np.ndarray = np.arange(iy0, iy1 + 1) * nx
+    lo: np.ndarray = np.searchsorted(cells, row_starts + ix0, side="left")
+    hi: np.ndarray = np.searchsorted(cells, row_starts + ix1, side="right")
+    candidates: np.ndarray = np.concatenate(
+        [rows[a:b] for a, b in zip(lo, hi)] + [np.empty(shape=0, dtype=np.int64)]
+    )
+
+    px, py = x[candidates], y[candidates]
+    inbox: np.ndarray = (
+        (px >= bbox[0]) & (px <= bbox[2]) & (py >= bbox[1]) & (py <= bbox[3])
+    )
+    candidates = candidates[inbox]
+    inside: np.ndarray = _points_in_polygon(x[candidates], y[candidates], edges)
+    return np.sort(candidates[inside])
+
+
+def _polygon_edges(geometry) -> np.ndarray:
+    """
+    Get every edge of a (multi)polygon's rings, including any holes, as an
+    array of shape (k, 4) with columns x1, y1, x2, y2.
+    """
+    polygons: list = getattr(geometry, "geoms", [geometry])
+    rings: list = [
+        np.asarray(ring.coords)[:, :2]
+        for polygon in polygons
+        for ring in (polygon.exterior, *polygon.interiors)
+    ]
+    return np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+
+
+def _points_in_polygon(px: np.ndarray, py: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Test which points are inside a polygon with the even-odd ray casting rule,
+    vectorized over the points, by counting the polygon edges crossed by a ray
+    going from each point in the +x direction.
+    """
+    inside = np.zeros(shape=len(px), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for x1, y1, x2, y2 in edges:
+            crosses: np.ndarray = (y1 > py) != (y2 > py)
+            x_cross: np.ndarray = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (px < x_cross)
+    return inside
+
+
+def _part1by2(arr: np.ndarray) -> np.ndarray:
+    """
+    Spread out the lower 21 bits of an integer array so that there are two
+    zero bits between each of them, for use in 3D Morton codes.
+    """
+    arr = arr.astype(np.uint64) & np.uint64(0x1FFFFF)
+    arr = (arr | (arr << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+    arr = (arr | (arr << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+    arr = (arr | (arr << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    arr = (arr | (arr << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    arr = (arr | (arr << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return arr
+
+
+def _part1by1(arr: np.ndarray) -> np.ndarray:
+    """
+    Spread out the lower 32 bits of an integer array so that there is a zero
+    bit between each of them, for use in 2D Morton codes.
+    """
+    arr = arr.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    arr = (arr | (arr << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    arr = (arr | (arr << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    arr = (arr | (arr << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    arr = (arr | (arr << np.uint64(2))) & np.uint64(0x3333333333333333)
+    arr = (arr | (arr << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return arr
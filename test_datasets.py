@@ -0,0 +1,160 @@
+"""
+Tests for the data manager in datasets.py, run with `pytest`, against a local
+HTTP server standing in for the remote data sources.
+"""
+
+import hashlib
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+try:
+    import datasets
+except Exception as error:  # e.g. pygmt without the GMT library
+    pytest.skip(reason=f"datasets needs pygmt: {error}", allow_module_level=True)
+
+
+def double_values(infile: str, outfile: str) -> str:
+    """
+    Stand-in post-processing step, counting its calls in a file next to outfile.
+    """
+    values: np.ndarray = np.loadtxt(fname=infile)
+    np.savetxt(fname=outfile, X=values * 2)
+    with open(file=f"{outfile}.calls", mode="a") as file:
+        file.write("1")
+    return outfile
+
+
+def fail(infile: str, outfile: str) -> str:
+    raise RuntimeError("post-processing failed")
+
+
+def _serve(server, fname: str, content: bytes) -> str:
+    """
+    Put a file on the server, returning its sha256 hash.
+    """
+    (server.root / fname).write_bytes(content)
+    return hashlib.sha256(content).hexdigest()
+
+
+def _sources(server, **hashes) -> dict:
+    return dict(
+        values=dict(
+            url=f"{server.url}/values.txt",
+            known_hash=hashes.get("values"),
+            fname="values.txt",
+            path="values",
+            postprocess=(double_values, "values-doubled.txt"),
+        ),
+        lakes=dict(
+            url=f"{server.url}/lakes.geojson",
+            known_hash=hashes.get("lakes"),
+            fname="lakes.geojson",
+            path="lakes",
+        ),
+    )
+
+
+def test_fetch_all_cold_then_warm(http_server, tmp_path):
+    """
+    A cold run downloads and post-processes everything, and a warm run reuses
+    it all without any network access or recomputation.
+    """
+    hashes: dict = dict(
+        values=_serve(http_server, "values.txt", b"1\n2\n3\n"),
+        lakes=_serve(http_server, "lakes.geojson", b'{"type": "FeatureCollection"}'),
+    )
+    sources: dict = _sources(http_server, **hashes)
+    datafold: str = str(tmp_path / "data")
+
+    filepaths: dict = datasets.fetch_all(datafold=datafold, sources=sources)
+    assert filepaths["values"] == os.path.join(datafold, "values", "values-doubled.txt")
+    np.testing.assert_allclose(
+        actual=np.loadtxt(filepaths["values"]), desired=[2, 4, 6]
+    )
+    assert http_server.requests == {"/values.txt": 1, "/lakes.geojson": 1}
+
+    http_server.shutdown()
+    assert datasets.fetch_all(datafold=datafold, sources=sources) == filepaths
+    with open(file=f"{filepaths['values']}.calls") as file:
+        assert file.read() == "1"
+
+
+def test_fetch_all_hash_mismatch(http_server, tmp_path):
+    """
+    A download that does not match its known hash raises an error.
+    """
+    _serve(http_server, "lakes.geojson", b"tampered")
+    sources: dict = _sources(http_server, lakes="0" * 64)
+    with pytest.raises(ValueError, match="does not match the known hash"):
+        datasets.fetch_all(
+            datafold=str(tmp_path / "data"), names=["lakes"], sources=sources
+        )
+
+
+@pytest.mark.parametrize("broken", ["download", "postprocess"])
+def test_fetch_all_fallback(http_server, tmp_path, broken):
+    """
+    If a source cannot be downloaded or post-processed, its pre-processed
+    fallback is used instead, and counts as fresh on the next run.
+    """
+    content: bytes = b"2\n4\n6\n"
+    sources: dict = _sources(http_server)
+    sources["values"].update(
+        known_hash=_serve(http_server, "values.txt", b"1\n2\n3\n"),
+        fallback="values_preprocessed",
+    )
+    if broken == "download":
+        sources["values"]["url"] = f"{http_server.url}/missing.txt"
+    else:
+        sources["values"]["postprocess"] = (fail, "values-doubled.txt")
+    sources["values_preprocessed"] = dict(
+        url=f"{http_server.url}/values-doubled.txt",
+        known_hash=_serve(http_server, "values-doubled.txt", content),
+        fname="values-doubled.txt",
+        path="values",
+        fallback_only=True,
+    )
+    datafold: str = str(tmp_path / "data")
+
+    filepaths: dict = datasets.fetch_all(
+        datafold=datafold, names=["values"], sources=sources
+    )
+    assert filepaths["values"] == os.path.join(datafold, "values", "values-doubled.txt")
+    with open(file=filepaths["values"], mode="rb") as file:
+        assert file.read() == content
+
+    http_server.shutdown()
+    assert datasets.fetch_all(datafold=datafold, names=["values"], sources=sources) == (
+        filepaths
+    )
+
+
+def test_fetch_all_records_unpinned_hash(http_server, tmp_path):
+    """
+    A source without a known hash has its hash recorded (with a warning) on
+    first download only, and is verified against it from then on.
+    """
+    content: bytes = b'{"type": "FeatureCollection"}'
+    expected: str = f"sha256:{_serve(http_server, 'lakes.geojson', content)}"
+    sources: dict = _sources(http_server)
+    datafold: str = str(tmp_path / "data")
+
+    with pytest.warns(UserWarning, match=expected):
+        filepath: str = datasets.fetch_all(
+            datafold=datafold, names=["lakes"], sources=sources
+        )["lakes"]
+    with open(file=f"{filepath}.sha256") as file:
+        assert file.read() == expected
+
+    with warnings.catch_warnings():
+        warnings.simplefilter(action="error", category=UserWarning)
+        datasets.fetch_all(datafold=datafold, names=["lakes"], sources=sources)
+
+    # A changed upstream file no longer matches the recorded hash
+    os.remove(filepath)
+    _serve(http_server, "lakes.geojson", b"changed")
+    with pytest.raises(ValueError, match="does not match the known hash"):
+        datasets.fetch_all(datafold=datafold, names=["lakes"], sources=sources)
@@ -0,0 +1,90 @@
+"""
+Tests for the 3D model writers in export3d.py, run with `pytest`.
+"""
+
+import json
+import struct
+import urllib.request
+
+import matplotlib
+import numpy as np
+import pytest
+
+import export3d
+
+
+def _fetch(url: str) -> bytes:
+    with urllib.request.urlopen(url=url) as response:
+        return response.read()
+
+
+def test_write_3dtiles_served(http_server):
+    """
+    A tileset served from a static file server can be walked from
+    tileset.json to every .pnts tile, with valid tile headers, and with each
+    parent replaced by children that hold all of its points' descendants.
+    """
+    rng = np.random.default_rng(seed=42)
+    xyz: np.ndarray = rng.uniform(
+        low=(-1e5, -1e5, 0), high=(1e5, 1e5, 1e3), size=(30_000, 3)
+    )
+    dhdt_slope: np.ndarray = rng.normal(size=30_000)
+    export3d.write_3dtiles(
+        outdir=str(http_server.root),
+        xyz=xyz,
+        dhdt_slope=dhdt_slope,
+        cmap=matplotlib.colormaps["viridis"],
+        max_points_per_tile=2000,
+        max_workers=2,
+    )
+
+    tileset: dict = json.loads(_fetch(url=f"{http_server.url}/tileset.json"))
+    assert tileset["asset"]["version"] == "1.0"
+
+    def _points(tile: dict) -> int:
+        # Check the header and tables of a tile, returning its number of points
+        pnts: bytes = _fetch(url=f"{http_server.url}/{tile['content']['uri']}")
+        magic, version, length, *lengths = struct.unpack("<4s6I", pnts[:28])
+        assert (magic, version, length) == (b"pnts", 1, len(pnts))
+        offsets: np.ndarray = np.cumsum([28, *lengths])
+        assert offsets[-1] == length
+        assert np.all(offsets[1:] % 8 == 0)
+
+        feature_json: dict = json.loads(pnts[offsets[0] : offsets[1]])
+        points: int = feature_json["POINTS_LENGTH"]
+        assert feature_json["RGB"]["byteOffset"] == points * 6
+        assert lengths[1] >= points * 9  # uint16 positions and uint8 colours
+        batch_json: dict = json.loads(pnts[offsets[2] : offsets[3]])
+        assert batch_json["dhdt_slope"]["componentType"] == "FLOAT"
+        assert lengths[3] >= points * 4
+        return points
+
+    def _check(tile: dict) -> int:
+        # Check a tile and its descendants, returning their number of leaf points
+        points: int = _points(tile=tile)
+        assert 0 < points <= 2000
+        if "children" not in tile:
+            assert tile["geometricError"] == 0
+            return points
+
+        assert tile["refine"] == "REPLACE"
+        children: list = tile["children"]
+        assert all(c["geometricError"] < tile["geometricError"] for c in children)
+        assert points == min(2000, sum(_points(tile=child) for child in children))
+        return sum(_check(tile=child) for child in children)
+
+    assert _check(tile=tileset["root"]) == len(xyz)
+
+
+def test_write_glb_empty(tmp_path):
+    """
+    An empty point cloud raises a clear error instead of failing on its bounds.
+    """
+    with pytest.raises(ValueError, match="no points"):
+        export3d.write_glb(
+            filename=str(tmp_path / "empty.glb"),
+            xyz=np.empty(shape=(0, 3)),
+            dhdt_slope=np.empty(shape=0),
+            cmap=matplotlib.colormaps["viridis"],
+            zipped=True,
+        )
@@ -0,0 +1,76 @@
+"""
+Tests for the lake catalogue helpers in lakecatalog.py, run with `pytest`.
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.geometry
+
+import lakecatalog
+
+
+def _lakes(count: int = 60) -> gpd.GeoDataFrame:
+    """
+    Synthetic lake catalogue indexed by id, with lakes scattered so that the
+    FlatGeobuf spatial index reorders them.
+    """
+    rng = np.random.default_rng(seed=42)
+    return gpd.GeoDataFrame(
+        data=dict(
+            basin_name=rng.choice(a=["Whillans", "Mercer", "Kamb"], size=count),
+            inner_dhdt=rng.normal(size=count),
+        ),
+        geometry=[
+            shapely.geometry.Point(x, y).buffer(5000)
+            for x, y in rng.uniform(low=-1e6, high=1e6, size=(count, 2))
+        ],
+        index=pd.Index(data=np.arange(count) * 10, name="id"),
+        crs="EPSG:3031",
+    )
+
+
+def test_export_named_lakes_keeps_sort_order(tmp_path):
+    """
+    The named lakes read back from the store and its OGR GMT copy stay sorted
+    by basin and lake name, despite the store's spatial index reordering them.
+    """
+    gdf: gpd.GeoDataFrame = _lakes()
+    lakedict: list = [
+        dict(lakename=f"Lake {chr(65 + i % 26)}{i}", ids=[int(i * 10)])
+        for i in range(0, len(gdf), 2)
+    ]
+    gdf_named, _ = lakecatalog.name_lakes(gdf=gdf, lakedict=lakedict)
+    store: str = str(tmp_path / "lakes.fgb")
+
+    subset: gpd.GeoDataFrame = lakecatalog.export_named_lakes(
+        gdf_named=gdf_named, store=store
+    ).reset_index()
+    expected: np.ndarray = subset.lake_name.to_numpy()
+    assert (expected == np.sort(expected)).sum() < len(expected)  # not alphabetic
+    assert subset.basin_name.is_monotonic_increasing
+
+    back: gpd.GeoDataFrame = lakecatalog.read_lakes(store=store)
+    np.testing.assert_equal(actual=back.lake_name.to_numpy(), desired=expected)
+    assert "store_order" not in back.columns
+
+    gmt: gpd.GeoDataFrame = gpd.read_file(filename=str(tmp_path / "lakes.gmt"))
+    np.testing.assert_equal(actual=gmt.lake_name.to_numpy(), desired=expected)
+
+    # Regenerating the OGR GMT file from the store keeps the same order
+    (tmp_path / "lakes.gmt").unlink()
+    lakecatalog.to_gmt(store=store)
+    gmt: gpd.GeoDataFrame = gpd.read_file(filename=str(tmp_path / "lakes.gmt"))
+    np.testing.assert_equal(actual=gmt.lake_name.to_numpy(), desired=expected)
+
+    # Reads by region and by group keep the relative order too
+    region: list = [-1e6, 0, -1e6, 1e6]
+    inside: np.ndarray = expected[(subset.centroid.x < 0).to_numpy()]
+    np.testing.assert_equal(
+        actual=lakecatalog.read_lakes(store=store, region=region).lake_name.to_numpy(),
+        desired=inside,
+    )
+    np.testing.assert_equal(
+        actual=lakecatalog.read_lakes(store=store, group="Mercer").lake_name.to_numpy(),
+        desired=expected[(subset.basin_name == "Mercer").to_numpy()],
+    )
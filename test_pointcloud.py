@@ -0,0 +1,90 @@
+"""
+Tests for the point cloud helpers in pointcloud.py, run with `pytest`.
+"""
+
+import numpy as np
+import pytest
+
+import pointcloud
+
+
+def test_octree_decimate_nan_dhdt():
+    """
+    Cells with NaN dhdt_slope values still get exactly one point each, with
+    no duplicates, instead of failing to match the cell maximum.
+    """
+    rng = np.random.default_rng(seed=42)
+    xyz: np.ndarray = rng.uniform(low=0, high=1000, size=(1000, 3))
+    dhdt_slope: np.ndarray = rng.normal(size=1000)
+    dhdt_slope[rng.choice(a=1000, size=50, replace=False)] = np.nan
+
+    keep: np.ndarray = pointcloud.octree_decimate(
+        xyz=xyz, dhdt_slope=dhdt_slope, target_points=100
+    )
+    assert len(keep) == 100
+    assert len(np.unique(keep)) == len(keep)
+    assert np.isnan(dhdt_slope[keep]).sum() == 0
+
+
+def test_octree_decimate_all_nan_dhdt():
+    """
+    Points with only NaN dhdt_slope values are still decimated to the target.
+    """
+    xyz: np.ndarray = np.random.default_rng(seed=0).uniform(size=(500, 3))
+    keep: np.ndarray = pointcloud.octree_decimate(
+        xyz=xyz, dhdt_slope=np.full(shape=500, fill_value=np.nan), target_points=64
+    )
+    assert len(keep) == 64
+    assert len(np.unique(keep)) == len(keep)
+
+
+@pytest.mark.parametrize("target_points", [100, 20000, 123457])
+def test_octree_decimate_fills_target(target_points):
+    """
+    The target number of points is an upper bound that is reached, with the
+    most extreme point of every cell at the chosen octree level kept.
+    """
+    rng = np.random.default_rng(seed=1)
+    xyz: np.ndarray = rng.uniform(low=0, high=1e5, size=(300_000, 3))
+    dhdt_slope: np.ndarray = rng.normal(size=300_000)
+
+    keep: np.ndarray = pointcloud.octree_decimate(
+        xyz=xyz, dhdt_slope=dhdt_slope, target_points=target_points
+    )
+    assert len(keep) == target_points
+    assert np.all(np.diff(keep) > 0)
+
+    assert np.abs(dhdt_slope[keep]).max() == np.abs(dhdt_slope).max()
+
+
+def test_octree_decimate_target_bytes():
+    """
+    A byte budget is converted into a number of points, and fewer points than
+    the target are returned unchanged.
+    """
+    xyz: np.ndarray = np.random.default_rng(seed=2).uniform(size=(1000, 3))
+    dhdt_slope: np.ndarray = np.linspace(start=-1, stop=1, num=1000)
+
+    keep: np.ndarray = pointcloud.octree_decimate(
+        xyz=xyz, dhdt_slope=dhdt_slope, target_bytes=1200, bytes_per_point=12
+    )
+    assert len(keep) == 100
+    np.testing.assert_equal(
+        actual=pointcloud.octree_decimate(
+            xyz=xyz, dhdt_slope=dhdt_slope, target_points=5000
+        ),
+        desired=np.arange(1000),
+    )
+
+
+@pytest.mark.parametrize("budget", [dict(target_points=0), dict(target_bytes=15)])
+def test_octree_decimate_empty_budget(budget):
+    """
+    A budget of less than one point keeps no points, instead of one point.
+    """
+    xyz: np.ndarray = np.random.default_rng(seed=3).uniform(size=(1000, 3))
+    keep: np.ndarray = pointcloud.octree_decimate(
+        xyz=xyz, dhdt_slope=np.zeros(shape=1000), **budget
+    )
+    assert len(keep) == 0
+    assert keep.dtype.kind == "i"